@@ -0,0 +1,183 @@
+"""
+Учёт SQL-запросов и времени сериализации на каждый запрос.
+
+В DEBUG метрики отдаются заголовками ``X-Query-*``, иначе пишутся в лог
+``core.instrumentation`` одной JSON-строкой на уровне INFO. Вьюха может
+объявить ``query_budget`` — при превышении пишется предупреждение, а с
+``QUERY_BUDGET_STRICT = True`` (для тестов) выбрасывается исключение.
+
+Время сериализации снимают сами вьюхи: ``SerializerTimingMixin`` для
+generic-вьюх DRF и ``timed_serialization()`` там, где сериализаторы
+создаются вручную.
+
+Middleware работает и под WSGI, и под ASGI: в асинхронном режиме обёртки
+ставятся на соединения в том потоке, где выполняются запросы ORM.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('query_stats', default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """SQL без конкретных значений — одинаковые запросы с разными id совпадают."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('(...)', sql)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.most_common() if count > 1}
+
+
+@contextmanager
+def timed_serialization():
+    """Засчитывает время блока (вместе с ленивыми запросами в нём) как сериализацию."""
+    stats = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serializer_time += time.perf_counter() - started
+
+
+class SerializerTimingMixin:
+    """
+    Время сериализации generic-вьюхи чтения: от первого ``get_serializer``
+    до ``finalize_response``. Между ними обработчик DRF только читает
+    ``.data`` и собирает ответ, так что вложенные сериализаторы не трогаем.
+    """
+    serializer_started = None
+
+    def get_serializer(self, *args, **kwargs):
+        if self.serializer_started is None and self.request.method in SAFE_METHODS:
+            self.serializer_started = time.perf_counter()
+        return super().get_serializer(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        stats = _current.get()
+        if stats is not None and self.serializer_started is not None:
+            stats.serializer_time += time.perf_counter() - self.serializer_started
+            self.serializer_started = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', 5)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, stats)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        stack = ExitStack()
+        try:
+            # Асинхронный ORM выполняет запросы в потоке запроса
+            # (thread_sensitive), там же создаются и его соединения
+            await sync_to_async(self.wrap_connections)(stack, stats)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.report(request, response, stats, time.perf_counter() - started)
+
+    def wrap_connections(self, stack, stats):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+
+    def report(self, request, response, stats, total_time):
+        budget = getattr(request, '_query_budget', None)
+        suspects = {sql: count for sql, count in stats.duplicates().items() if count >= self.threshold}
+        metrics = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'sql_ms': round(stats.sql_time * 1000, 2),
+            'serializer_ms': round(stats.serializer_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+            'duplicate_queries': sum(count - 1 for count in stats.duplicates().values()),
+            'budget': budget,
+        }
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = stats.count
+            response['X-Query-Time-Ms'] = metrics['sql_ms']
+            response['X-Serializer-Time-Ms'] = metrics['serializer_ms']
+            response['X-Duplicate-Queries'] = metrics['duplicate_queries']
+        else:
+            logger.info(json.dumps(metrics, ensure_ascii=False))
+
+        if suspects:
+            logger.warning('Possible N+1 on %s: %s', request.path, json.dumps(suspects, ensure_ascii=False))
+
+        if budget is not None and stats.count > budget:
+            message = f'{request.method} {request.path}: {stats.count} queries, budget is {budget}'
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+        request._query_budget = getattr(view_class, 'query_budget', None)
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +89,24 @@ DATABASES = {
 }
 
 
+# Кэш. По умолчанию в памяти процесса; для нескольких воркеров — Redis:
+# 'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+# 'LOCATION': 'redis://127.0.0.1:6379',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Кэш ответов каталога (product/cache.py)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 300
+# Версии тегов — в таблице CacheTagVersion, поэтому ETag/Last-Modified
+# верны во всех процессах при любом бэкенде кэша
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -148,14 +167,116 @@ SIMPLE_JWT = {
     'ALGORITHM': 'HS256',  # Алгоритм подписи токенов
     'AUTH_HEADER_TYPES': ('Bearer',),  # Тип HTTP заголовка, содержащего токен (обычно 'Bearer')
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
+    # Роль и версия токенов в claims — для проверки без запроса к базе
+    'TOKEN_OBTAIN_SERIALIZER': 'user.serializers.ClaimsTokenObtainPairSerializer',
 }
 
+# Пользователь из claims токена без чтения строки из базы (user/authentication.py)
+JWT_STATELESS_AUTH = True
+# Сколько секунд процесс доверяет запомненной версии токенов: за это время
+# смена роли или пароля доходит до всех процессов
+AUTH_VERSION_CACHE_TTL = 5
+# Общий кэш перед базой для версий токенов; кэш в памяти процесса
+# (LocMemCache) пропускается, и версия читается из базы. Сколько секунд
+# живёт версия в общем кэше
+AUTH_VERSION_CACHE_ALIAS = 'default'
+AUTH_VERSION_SHARED_TTL = 300
+# Сколько секунд процесс хранит полную строку пользователя
+AUTH_USER_CACHE_TTL = 30
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-      'rest_framework_simplejwt.authentication.JWTAuthentication',
+      'user.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
-    ]
+    ],
+    # Колоночный JSON — только по Accept или ?format=columnar (product/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'product.renderers.ColumnarJSONRenderer',
+    ],
+}
+
+# Размер блока при потоковой отдаче видеофайлов (байт)
+MEDIA_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Кто передаёт байты медиафайлов (product/delivery.py): 'django' — сам Django
+# (разработка), 'nginx' — X-Accel-Redirect на internal-location
+# MEDIA_ACCEL_PREFIX, 'sendfile' — X-Sendfile (Apache mod_xsendfile, lighttpd)
+MEDIA_DELIVERY = 'django'
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Видео и HLS-нарезка — только вошедшим; фильмы с этими рейтингами — всегда только им
+MEDIA_PLAYBACK_LOGIN_REQUIRED = True
+MEDIA_ADULT_AGE_RATINGS = ('18+',)
+# Подписанные ссылки на видео в ответах API (product/url_signing.py): срок
+# жизни (с). Срок округляется вверх до шага, чтобы ссылки в его пределах
+# совпадали и кэшировались. Ключи — для проверки подписи на CDN; без них
+# ключ выводится из SECRET_KEY
+MEDIA_SIGNED_URLS = True
+MEDIA_URL_TTL = 4 * 3600
+MEDIA_URL_TTL_STEP = 600
+MEDIA_URL_SIGNING_KEYS = []
+
+# Загрузка файлов фильмов и серий по частям (product/uploads.py)
+UPLOAD_MAX_LENGTH = 50 * 1024 ** 3  # размер файла, байт
+UPLOAD_CHUNK_MAX_SIZE = 64 * 1024 ** 2  # один PATCH, байт
+UPLOAD_EXPIRE_HOURS = 24  # незавершённые загрузки старше удаляет `manage.py purge_uploads`
+
+# Нарезка загруженных видео на HLS-качества (высота кадра, битрейт)
+HLS_LADDER = (
+    (144, 150_000),
+    (360, 800_000),
+    (720, 2_800_000),
+    (1080, 5_000_000),
+)
+HLS_TRANSCODER = 'product.transcoding.FFmpegTranscoder'  # локально можно 'product.transcoding.FakeTranscoder'
+HLS_WORKERS = 2
+HLS_AUTO_ENQUEUE = True  # False — обрабатывать только командой `manage.py transcode`
+
+# Полнотекстовый поиск (FTS5 на SQLite, tsvector на PostgreSQL, icontains на прочих)
+SEARCH_INDEX_ENABLED = True
+# Исправление опечаток по словарю индекса — только на SQLite (FTS5).
+# PostgreSQL и icontains ищут только по началу слов, без исправления
+SEARCH_TYPO_TOLERANCE = True
+
+# Сколько похожих фильмов хранить и отдавать в карточке фильма
+RECOMMENDATIONS_TOP_K = 20
+
+# Уменьшенные копии картинок (ширина в пикселях и форматы; AVIF — если его поддерживает Pillow)
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+IMAGE_DERIVATIVE_FORMATS = ('avif', 'webp', 'jpeg')
+# Сколько секунд помнить, что копий картинки ещё нет (готовые помнятся сутки)
+IMAGE_READY_PENDING_TIMEOUT = 60
+IMAGE_WORKERS = 2
+
+# Прогресс просмотра: как часто (сек) сбрасывать накопленные отметки плеера в БД
+WATCH_PROGRESS_FLUSH_INTERVAL = 10
+
+# Оценки через буфер: всплески схлопываются в пачки раз в RATING_FLUSH_INTERVAL
+# секунд (product/ratings.py); по умолчанию пишутся сразу
+RATING_BUFFERED_WRITES = False
+RATING_FLUSH_INTERVAL = 2
+
+# Списки каталога с плоским сериализатором собираются из values_list без
+# экземпляров моделей (product/eager.py)
+SERIALIZER_VALUES_FAST_PATH = True
+
+# Учёт запросов к БД (core/instrumentation.py)
+QUERY_N_PLUS_ONE_THRESHOLD = 5  # столько одинаковых запросов за один HTTP-запрос — подозрение на N+1
+QUERY_BUDGET_STRICT = False  # True — превышение query_budget вьюхи выбрасывает исключение (для тестов)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # WARNING — только превышения бюджета и подозрения на N+1;
+        # INFO — JSON с метриками на каждый запрос
+        'core.instrumentation': {'handlers': ['console'], 'level': 'WARNING'},
+    },
 }
@@ -24,6 +24,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from product.views import MediaView
+
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -41,11 +43,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('api/', include('product.urls')),
-    path('api/user/', include('user.urls'))
-
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('api/user/', include('user.urls')),
+    # Медиафайлы с проверкой доступа; отдаёт фронт-сервер (MEDIA_DELIVERY)
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:name>', MediaView.as_view(), name='media'),
+]
 
 
 if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
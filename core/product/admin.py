@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 
-from .models import Banner, Movie, Series, Category, Genre, Country, FilmCrew, Favorite, Rating
+from .models import Banner, Movie, Series, Category, Genre, Country, FilmCrew, Favorite, Rating, StreamManifest, Rendition, MovieRecommendation, WatchProgress, FacetCount, ChunkedUpload
 
 admin.site.register(Banner)
 admin.site.register(Movie)
@@ -12,3 +12,9 @@ admin.site.register(Country)
 admin.site.register(FilmCrew)
 admin.site.register(Favorite)
 admin.site.register(Rating)
+admin.site.register(StreamManifest)
+admin.site.register(Rendition)
+admin.site.register(MovieRecommendation)
+admin.site.register(WatchProgress)
+admin.site.register(FacetCount)
+admin.site.register(ChunkedUpload)
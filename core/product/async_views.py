@@ -0,0 +1,175 @@
+"""
+Асинхронные (ASGI) версии нагруженных GET-эндпоинтов.
+
+Вьюхи наследуют синхронные — queryset, фильтры, права и сериализаторы
+общие, — а ``dispatch`` и ``get`` заменены корутинами. Под ASGI ожидание БД
+не занимает цикл событий, и он тем временем обслуживает другие запросы.
+Сами SQL-запросы одного запроса Django выполняет по очереди в его
+потоке (асинхронный ORM — обёртка ``sync_to_async``), поэтому
+``asyncio.gather`` независимых частей (баннер, фильмы, сериалы,
+рекомендации) не делает их быстрее, а лишь не ждёт каждую отдельно.
+Сериализация и фильтры, которые сами ходят в БД, выполняются через
+``sync_to_async``.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from rest_framework import generics
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from core.instrumentation import timed_serialization
+
+from .cache import cache_response, conditional_response
+from .eager import EagerLoadingViewMixin
+from .models import Banner, Movie
+from .pagination import IndexSectionPagination
+from .permissions import IsAdminOrManager
+from .recommendations import get_recommendations
+from .serializers import MovieIndexSerializer, MovieSerialDetailSerializer
+from . import views
+
+
+class AsyncAPIViewMixin:
+    """``APIView.dispatch`` с асинхронным обработчиком метода."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Аутентификация по JWT загружает пользователя из БД
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncListModelMixin:
+    """
+    Список как у ``ListAPIView``. Пагинатор должен уметь
+    ``apaginate_queryset``.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        paginator = self.paginator
+        if paginator is None:
+            objects = [obj async for obj in queryset]
+            return Response(await self.aserialize(objects))
+
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(await self.aserialize(page))
+
+    async def aserialize(self, objects):
+        return await sync_to_async(lambda: self.get_serializer(objects, many=True).data)()
+
+
+class AsyncMovieSerialIndexView(AsyncAPIViewMixin, views.MovieSerialIndexView):
+
+    @conditional_response('movie', 'series', 'banner', 'genre', 'country', 'filmcrew', 'media', anonymous_only=True)
+    async def get(self, request, *args, **kwargs):
+        response = await self.get_catalog(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            continue_watching = await sync_to_async(self.get_continue_watching)(request)
+            response.data = {**response.data, 'continue_watching': continue_watching}
+        return response
+
+    @cache_response('movie', 'series', 'banner', 'genre', 'country', 'filmcrew', 'media', conditional=False)
+    async def get_catalog(self, request, *args, **kwargs):
+        movies, serials = await sync_to_async(self.get_section_querysets)(request)
+        paginator = IndexSectionPagination(request)
+
+        banners, (movies, movies_next), (serials, serials_next) = await asyncio.gather(
+            Banner.objects.filter(is_asset=True).afirst(),
+            self.asection(paginator, movies, 'movies'),
+            self.asection(paginator, serials, 'serials'),
+        )
+        data = await sync_to_async(self.get_catalog_data)(
+            paginator, banners, movies, movies_next, serials, serials_next
+        )
+        return Response(data)
+
+    async def asection(self, paginator, queryset, section):
+        if paginator.is_enabled():
+            return await paginator.apaginate_section(queryset, section)
+        return [obj async for obj in queryset], None
+
+
+class AsyncMovieDetailView(AsyncAPIViewMixin, EagerLoadingViewMixin, generics.RetrieveAPIView):
+    queryset = Movie.objects.all()
+    serializer_class = MovieSerialDetailSerializer
+    permission_classes = [IsAdminOrManager]
+
+    @cache_response('movie', 'movie:{pk}', 'category', 'genre', 'country', 'filmcrew', 'recommendation', 'media',
+                    signed_urls=True)
+    async def get(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        # Через filter_queryset, как get_object: он применяет план загрузки
+        # сериализатора
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        # Рекомендациям нужен только id фильма, поэтому их не ждут после фильма
+        product, recommendations = await asyncio.gather(
+            queryset.filter(pk=pk).afirst(),
+            sync_to_async(self.get_recommendations_data)(pk),
+        )
+        if product is None:
+            raise NotFound('Movie not found')
+        self.check_object_permissions(request, product)
+
+        return Response({
+            'product': await sync_to_async(lambda: self.get_serializer(product).data)(),
+            'recommendations': recommendations,
+        })
+
+    def get_recommendations_data(self, pk):
+        recommendations = MovieIndexSerializer.setup_eager_loading(get_recommendations(Movie(pk=pk)))
+        with timed_serialization():
+            return MovieIndexSerializer(recommendations, many=True).data
+
+
+class AsyncSerialListView(AsyncAPIViewMixin, AsyncListModelMixin, views.SerialListView):
+
+    @conditional_response('series', 'media')
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+
+class AsyncMovieCategoryFilterView(AsyncAPIViewMixin, AsyncListModelMixin, views.MovieCategoryFilterView):
+
+    @conditional_response('movie', 'category', 'rating', 'media')
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+
+class AsyncSeriesCategoryFilterView(AsyncAPIViewMixin, AsyncListModelMixin, views.SeriesCategoryFilterView):
+
+    @conditional_response('movie', 'category', 'rating', 'media')
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+
+class AsyncGenreFilterView(AsyncAPIViewMixin, AsyncListModelMixin, views.GenreFilterView):
+
+    @conditional_response('movie', 'genre', 'rating', 'media')
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+
+class AsyncCountryFilterView(AsyncAPIViewMixin, AsyncListModelMixin, views.CountryFilterView):
+
+    @conditional_response('movie', 'country', 'rating', 'media')
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
@@ -0,0 +1,90 @@
+"""
+Буфер записей в памяти процесса с фоновым сбросом пачками.
+
+Записи копятся по ключу (последняя побеждает) и раз в ``get_flush_interval()``
+секунд уходят в ``write`` одной пачкой из фонового потока. Если ``write``
+падает (потеряно соединение, таймаут блокировки), пачка возвращается в
+буфер — записи того же ключа, пришедшие за это время, новее и остаются, — и
+пишется со следующим сбросом. При штатной остановке буфер сбрасывается
+через atexit. Используется для отметок прогресса (``progress``) и оценок
+(``ratings``).
+"""
+import abc
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingBuffer(abc.ABC):
+    thread_name = 'buffer-flush'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flusher = None
+
+    @abc.abstractmethod
+    def get_flush_interval(self):
+        """Секунды между сбросами."""
+
+    @abc.abstractmethod
+    def write(self, entries):
+        """
+        Записывает пачку; вызывается из потока сброса и при остановке.
+        Исключение возвращает всю пачку в буфер.
+        """
+
+    def put(self, key, entry):
+        with self.lock:
+            self.pending[key] = entry
+        self.start()
+
+    def discard(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def drain(self):
+        with self.lock:
+            items, self.pending = list(self.pending.items()), {}
+        return items
+
+    def requeue(self, items):
+        """Возвращает несохранённые записи, не затирая пришедшие после них."""
+        with self.lock:
+            for key, entry in items:
+                self.pending.setdefault(key, entry)
+
+    def flush(self):
+        items = self.drain()
+        if not items:
+            return 0
+        try:
+            self.write([entry for _, entry in items])
+        except Exception:
+            self.requeue(items)
+            raise
+        return len(items)
+
+    def start(self):
+        if self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+                self.flusher.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        stop = threading.Event()
+        while not stop.wait(self.get_flush_interval()):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('%s failed', self.thread_name)
+            finally:
+                close_old_connections()
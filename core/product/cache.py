@@ -0,0 +1,263 @@
+import functools
+import hashlib
+import inspect
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .models import CacheTagVersion
+from .url_signing import get_request_scope
+
+
+METRICS_PREFIX = 'resp-metrics:'
+
+# Имена вьюх с кэшем — для статистики попаданий
+cached_views = []
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def get_tag_state(tags):
+    """
+    Версии тегов и время (unix, сек) последнего изменения любого из них —
+    одним запросом к ``CacheTagVersion``. У тега, который ещё не менялся,
+    строки нет: версия 0, а время изменения неизвестно (None).
+    """
+    rows = dict(
+        (tag, (version, modified)) for tag, version, modified in
+        CacheTagVersion.objects.filter(tag__in=tags).values_list('tag', 'version', 'modified')
+    )
+    versions = [rows[tag][0] if tag in rows else 0 for tag in tags]
+    if len(rows) < len(set(tags)):
+        return versions, None
+    return versions, max((int(modified.timestamp()) for _, modified in rows.values()), default=None)
+
+
+def get_request_tag_state(request, tags):
+    """``get_tag_state`` с запоминанием на запросе: ETag и кэш ответа читают теги один раз."""
+    memo = request.__dict__.setdefault('_tag_state', {})
+    if tuple(tags) not in memo:
+        memo[tuple(tags)] = get_tag_state(tags)
+    return memo[tuple(tags)]
+
+
+def _increment(cache, key, initial, timeout=None):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, initial, timeout=timeout):
+            cache.incr(key)
+
+
+def _bump(tags):
+    now = timezone.now()
+    versions = CacheTagVersion.objects.filter(tag__in=tags)
+    if versions.update(version=F('version') + 1, modified=now) < len(set(tags)):
+        # Первое изменение тега: строка с версией 1 (до неё версия — 0)
+        existing = set(versions.values_list('tag', flat=True))
+        CacheTagVersion.objects.bulk_create(
+            [CacheTagVersion(tag=tag, modified=now) for tag in set(tags) - existing], ignore_conflicts=True
+        )
+
+
+def invalidate(*tags):
+    """
+    Сбрасывает закэшированные ответы с этими тегами. Новые версии тегов
+    появляются только после коммита, чтобы в кэш не попали данные из
+    незавершённой транзакции.
+    """
+    transaction.on_commit(lambda: _bump(tags))
+
+
+def record(view_name, outcome):
+    cache = get_cache()
+    _increment(cache, f'{METRICS_PREFIX}{outcome}', 1)
+    _increment(cache, f'{METRICS_PREFIX}{outcome}:{view_name}', 1)
+
+
+def get_metrics():
+    cache = get_cache()
+    stats = {}
+    for name in [None, *cached_views]:
+        suffix = f':{name}' if name else ''
+        hits = cache.get(f'{METRICS_PREFIX}hit{suffix}', 0)
+        misses = cache.get(f'{METRICS_PREFIX}miss{suffix}', 0)
+        total = hits + misses
+        stats[name or 'total'] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else 0,
+        }
+    return stats
+
+
+def get_auth_class(request):
+    user = request.user
+    if not user or not user.is_authenticated:
+        return 'anon'
+    if getattr(user, 'is_admin', False) or getattr(user, 'status', None) == 2:
+        return 'staff'
+    return 'user'
+
+
+def get_digest(request, tags, *extra):
+    """Отпечаток ответа: путь, параметры, класс пользователя, версии тегов и ``extra``."""
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = '|'.join([
+        request.path,
+        query,
+        get_auth_class(request),
+        '.'.join(map(str, get_request_tag_state(request, tags)[0])),
+        *extra,
+    ])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def get_cache_key(request, tags, *extra):
+    return 'resp:' + get_digest(request, tags, *extra)
+
+
+def get_signed_extra(request, signed_urls):
+    """Для ответов с подписанными ссылками — пользователь и срок ссылок (product/url_signing.py)."""
+    return (get_request_scope(request),) if signed_urls else ()
+
+
+def lookup(request, tags, view_name, *extra):
+    """Ключ ответа и закэшированные данные (None при промахе)."""
+    key = get_cache_key(request, tags, *extra)
+    data = get_cache().get(key)
+    record(view_name, 'miss' if data is None else 'hit')
+    return key, data
+
+
+def store(key, response):
+    if response.status_code == 200:
+        get_cache().set(key, response.data, get_timeout())
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cache_response(*tags, conditional=True, signed_urls=False):
+    """
+    Кэширует данные успешного GET-ответа вьюхи.
+
+    Ключ — путь, отсортированные параметры запроса, класс пользователя
+    (аноним, пользователь, менеджер) и текущие версии тегов. Теги могут
+    ссылаться на аргументы URL, например ``'movie:{pk}'``. Сигналы моделей
+    повышают версии тегов, и старые ключи просто перестают использоваться.
+
+    Ответ заодно получает ETag и Last-Modified (см. ``conditional_response``);
+    ``conditional=False`` — если к ответу потом добавляются данные не из тегов.
+
+    ``signed_urls`` — в ответе подписанные ссылки на медиафайлы: они свои у
+    каждого пользователя и меняются с шагом срока, поэтому входят в ключ и ETag.
+
+    Работает и с асинхронными методами: обращения к кэшу тогда уходят
+    в поток через ``sync_to_async``.
+    """
+    def decorator(method):
+        view_name = method.__qualname__.split('.')[0]
+        cached_views.append(view_name)
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                key, data = await sync_to_async(lookup)(
+                    request, [tag.format(**kwargs) for tag in tags], view_name,
+                    *get_signed_extra(request, signed_urls)
+                )
+                if data is not None:
+                    return Response(data, headers={'X-Cache': 'HIT'})
+                response = await method(self, request, *args, **kwargs)
+                return await sync_to_async(store)(key, response)
+            if conditional:
+                return conditional_response(*tags, signed_urls=signed_urls)(async_wrapper)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key, data = lookup(
+                request, [tag.format(**kwargs) for tag in tags], view_name, *get_signed_extra(request, signed_urls)
+            )
+            if data is not None:
+                return Response(data, headers={'X-Cache': 'HIT'})
+            return store(key, method(self, request, *args, **kwargs))
+        return conditional_response(*tags, signed_urls=signed_urls)(wrapper) if conditional else wrapper
+    return decorator
+
+
+def check_conditions(request, tags, *extra):
+    """
+    ETag и Last-Modified ответа по версиям тегов и готовый 304/412, если
+    клиенту хватит своей копии.
+    """
+    _, last_modified = get_request_tag_state(request, tags)
+    # Один и тот же ответ в разных форматах (JSON, колоночный) — разные представления
+    etag = f'"{get_digest(request, tags, getattr(request, "accepted_media_type", ""), *extra)}"'
+    return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def add_validators(response, etag, last_modified):
+    if etag is not None and response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    # Ответ зависит от класса пользователя (а тот — от токена) и от формата
+    patch_vary_headers(response, ['Authorization', 'Accept'])
+    return response
+
+
+def conditional_response(*tags, anonymous_only=False, signed_urls=False):
+    """
+    Условный GET: ETag и Last-Modified берутся из версий тегов (те же, что
+    у ``cache_response``), и запрос с совпавшим ``If-None-Match`` или
+    свежим ``If-Modified-Since`` получает 304, не вызывая вьюху — без
+    queryset и сериализатора.
+
+    ``anonymous_only`` — для ответов с личными данными, которые тегами не
+    описываются: авторизованным запросам валидаторы не выдаются.
+    ``signed_urls`` — как у ``cache_response``.
+    """
+    def decorator(method):
+        def skip(request):
+            return anonymous_only and request.user.is_authenticated
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                if skip(request):
+                    return await method(self, request, *args, **kwargs)
+                etag, last_modified, not_modified = await sync_to_async(check_conditions)(
+                    request, [tag.format(**kwargs) for tag in tags], *get_signed_extra(request, signed_urls)
+                )
+                if not_modified is not None:
+                    return add_validators(not_modified, etag, last_modified)
+                return add_validators(await method(self, request, *args, **kwargs), etag, last_modified)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if skip(request):
+                return method(self, request, *args, **kwargs)
+            etag, last_modified, not_modified = check_conditions(
+                request, [tag.format(**kwargs) for tag in tags], *get_signed_extra(request, signed_urls)
+            )
+            if not_modified is not None:
+                return add_validators(not_modified, etag, last_modified)
+            return add_validators(method(self, request, *args, **kwargs), etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,415 @@
+"""
+Массовый импорт и экспорт каталога в JSONL/CSV.
+
+Каждая строка JSONL — объект с полем ``type``: ``genre``, ``country``,
+``category``, ``film_crew`` или ``movie`` (по умолчанию). Фильм ссылается
+на жанры, страны и категории по названию, на съёмочную группу — по имени::
+
+    {"type": "movie", "title": "...", "description": "...", "release_date": "2020-01-01",
+     "production_year": 2020, "rating": 7, "duration": 120, "poster": "poster_image/1.jpeg",
+     "age_rating": "16+", "is_film": false, "genres": ["Драма"], "country": ["США"],
+     "categories": ["Новинки"], "film_crews": ["Иван Иванов"],
+     "episodes": [{"number": "1", "image": "image_serial/1.jpeg", "series": "media/series/1.mp4"}]}
+
+В CSV выгружаются съёмочная группа (строки ``film_crew``) и фильмы,
+списки разделяются символом ``|``; серий в CSV нет — для полного переноса
+каталога нужен JSONL. Неизвестные жанры, страны и категории создаются без
+картинки в транзакции той пачки, которая на них ссылается, и проверяются
+валидаторами модели, как фильмы.
+
+Каждый фильм и серия проверяются валидаторами полей модели до записи, и
+ошибка попадает в отчёт со своей строкой. Если пачка всё же не записалась
+(например, нарушено ограничение базы), она повторяется по одной строке:
+откатываются только плохие строки.
+"""
+import csv
+import io
+import itertools
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils.dateparse import parse_date
+
+from .models import Movie, Series, Category, Genre, Country, FilmCrew
+from . import cache, facets, search, transcoding
+
+
+MOVIE_FIELDS = (
+    'title', 'description', 'release_date', 'production_year', 'rating', 'duration',
+    'poster', 'movie', 'age_rating', 'budget', 'is_film', 'is_active',
+)
+LIST_FIELDS = ('genres', 'country', 'categories', 'film_crews')
+REQUIRED_FIELDS = ('title', 'release_date', 'production_year', 'rating', 'duration', 'age_rating', 'is_film')
+CSV_LIST_SEPARATOR = '|'
+# Поля, которые импорт не проверяет: файлы могут появиться позже, связи
+# разбираются отдельно, описание может быть пустым
+MOVIE_CLEAN_EXCLUDE = ('poster', 'movie', 'description', 'series', 'movie_categories', 'series_categories',
+                       'genres', 'country', 'film_crews')
+EPISODE_CLEAN_EXCLUDE = ('movie_serial', 'image', 'series', 'categories')
+CREW_FIELDS = ('name', 'birth_date', 'birthplace', 'position', 'bio', 'image')
+# Тип записи -> поле ссылки у фильма
+LOOKUP_TYPES = {'genre': 'genres', 'country': 'country', 'category': 'categories'}
+# Картинка справочника: импорт её не проверяет, как и файлы фильма
+LOOKUP_IMAGE_FIELDS = {'genres': 'genre_img', 'country': 'country_img', 'categories': 'image'}
+
+
+class CatalogImportError(ValueError):
+    pass
+
+
+def format_error(exc):
+    if isinstance(exc, ValidationError) and hasattr(exc, 'error_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in exc.message_dict.items())
+    if isinstance(exc, ValidationError):
+        return ' '.join(exc.messages)
+    return str(exc)
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.created = {}
+        self.errors = []
+        self.rows = 0
+
+    def add(self, kind, count=1):
+        self.created[kind] = self.created.get(kind, 0) + count
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'errors': self.errors[:100],
+            'error_count': len(self.errors),
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1) if elapsed else None,
+        }
+
+
+def parse_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'да')
+
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if line:
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield line_number, exc
+
+
+def read_csv(stream):
+    for line_number, row in enumerate(csv.DictReader(stream), start=2):
+        record = {key: value for key, value in row.items() if value not in (None, '')}
+        for field in LIST_FIELDS:
+            if field in record:
+                record[field] = [item.strip() for item in record[field].split(CSV_LIST_SEPARATOR) if item.strip()]
+        for field in ('is_film', 'is_active'):
+            if field in record:
+                record[field] = parse_bool(record[field])
+        yield line_number, record
+
+
+class CatalogImporter:
+    """
+    Разбирает поток записей и пишет их пачками: на каждую пачку одна
+    транзакция и по одному ``bulk_create`` на таблицу. Ссылки на жанры,
+    страны, категории и людей ищутся в словарях, загруженных один раз.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.stats = ImportStats()
+        self.lookups = {
+            'genres': dict(Genre.objects.values_list('title', 'id')),
+            'country': dict(Country.objects.values_list('title', 'id')),
+            'categories': dict(Category.objects.values_list('title', 'id')),
+            'film_crews': dict(FilmCrew.objects.values_list('name', 'id')),
+        }
+        self.models = {'genres': Genre, 'country': Country, 'categories': Category}
+        self.batch = []
+
+    def run(self, records):
+        for line_number, record in records:
+            self.stats.rows += 1
+            try:
+                if isinstance(record, Exception):
+                    raise CatalogImportError(str(record))
+                if not isinstance(record, dict):
+                    raise CatalogImportError('Запись должна быть объектом')
+                self.handle_record(line_number, record)
+            except (CatalogImportError, ValidationError, KeyError, ValueError, TypeError) as exc:
+                self.stats.errors.append({'line': line_number, 'error': format_error(exc)})
+            if len(self.batch) >= self.batch_size:
+                self.flush_safely()
+        self.flush_safely()
+        return self.stats
+
+    def flush_safely(self, batch=None):
+        if batch is None:
+            batch, self.batch = self.batch, []
+        try:
+            self.flush(batch)
+        except (DatabaseError, ValidationError, ValueError, TypeError) as exc:
+            if len(batch) == 1:
+                self.stats.errors.append({'line': batch[0][0], 'error': format_error(exc)})
+                return
+            # Пачка откатилась целиком — повторяем по одной строке, чтобы
+            # потерять только плохие
+            for line_number, entry in batch:
+                self.reset(entry)
+                self.flush_safely([(line_number, entry)])
+
+    def reset(self, entry):
+        """Объекты откатившейся пачки снова становятся новыми (bulk_create мог выдать им id)."""
+        movie, _, episodes = entry
+        for obj in (movie, *episodes):
+            obj.pk = None
+            obj._state.adding = True
+
+    def handle_record(self, line_number, record):
+        kind = record.get('type', 'movie')
+        if kind == 'movie':
+            self.batch.append((line_number, self.build_movie(record)))
+        elif kind in LOOKUP_TYPES:
+            self.create_lookup(LOOKUP_TYPES[kind], record)
+        elif kind == 'film_crew':
+            self.create_film_crew(record)
+        else:
+            raise CatalogImportError(f'Неизвестный тип записи: {kind}')
+
+    def build_lookup(self, field, title, image=''):
+        image_field = LOOKUP_IMAGE_FIELDS[field]
+        obj = self.models[field](title=title, **{image_field: image})
+        obj.full_clean(exclude=[image_field], validate_unique=False, validate_constraints=False)
+        return obj
+
+    def create_lookup(self, field, record):
+        """Отдельная запись жанра, страны или категории — создаётся сразу, с картинкой, если она есть."""
+        title = str(record['title'])
+        if title in self.lookups[field]:
+            return
+        obj, = self.models[field].objects.bulk_create([self.build_lookup(field, title, record.get('image', ''))])
+        self.lookups[field][obj.title] = obj.id
+        self.stats.add(obj._meta.model_name)
+
+    def check_names(self, field, names):
+        """
+        Названия ссылок фильма. Неизвестных участников съёмочной группы нет
+        смысла ждать — это ошибка строки; недостающие жанры, страны и
+        категории только проверяются здесь, а создаёт их ``flush``.
+        """
+        names = [str(name) for name in names]
+        lookup = self.lookups[field]
+        missing = [name for name in dict.fromkeys(names) if name not in lookup]
+        if missing and field == 'film_crews':
+            raise CatalogImportError(f'Неизвестные участники съёмочной группы: {", ".join(missing)}')
+        for name in missing:
+            self.build_lookup(field, name)
+        return names
+
+    def create_lookups(self, batch):
+        """Создаёт недостающие жанры, страны и категории пачки: {поле: {название: id}}."""
+        created = {}
+        for field, model in self.models.items():
+            lookup = self.lookups[field]
+            missing = dict.fromkeys(
+                name for _, relations, _ in batch for name in relations[field] if name not in lookup
+            )
+            if missing:
+                objs = model.objects.bulk_create([self.build_lookup(field, name) for name in missing])
+                created[field] = {obj.title: obj.id for obj in objs}
+        return created
+
+    def create_film_crew(self, record):
+        if record['name'] in self.lookups['film_crews']:
+            return
+        crew = FilmCrew.objects.create(
+            name=record['name'],
+            birth_date=parse_date(record['birth_date']),
+            birthplace=record.get('birthplace', ''),
+            position=record.get('position', ''),
+            bio=record.get('bio', ''),
+            image=record.get('image') or None,
+        )
+        self.lookups['film_crews'][crew.name] = crew.id
+        self.stats.add('filmcrew')
+
+    def build_movie(self, record):
+        missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, '')]
+        if missing:
+            raise CatalogImportError(f'Не заполнены поля: {", ".join(missing)}')
+
+        movie = Movie(**{field: record[field] for field in MOVIE_FIELDS if field in record})
+        for field in ('is_film', 'is_active'):
+            if isinstance(record.get(field), str):
+                setattr(movie, field, parse_bool(record[field]))
+        movie.release_date = parse_date(str(record['release_date']))
+        if movie.release_date is None:
+            raise CatalogImportError(f'Неверная дата: {record["release_date"]}')
+        movie.production_year = int(movie.production_year)
+        movie.rating = int(movie.rating)
+        movie.duration = int(movie.duration)
+        if not 1 <= movie.rating <= 10:
+            raise CatalogImportError('Рейтинг должен быть от 1 до 10')
+        movie.description = movie.description or ''
+        movie.full_clean(exclude=MOVIE_CLEAN_EXCLUDE, validate_unique=False, validate_constraints=False)
+
+        episodes = []
+        for episode in record.get('episodes', []):
+            if not isinstance(episode, dict):
+                raise CatalogImportError('Серия должна быть объектом')
+            episode = Series(
+                number=str(episode['number']), image=episode.get('image', ''), series=episode.get('series', '')
+            )
+            episode.full_clean(exclude=EPISODE_CLEAN_EXCLUDE, validate_unique=False, validate_constraints=False)
+            episodes.append(episode)
+        for field in LIST_FIELDS:
+            if not isinstance(record.get(field, []), list):
+                raise CatalogImportError(f'{field}: ожидается список')
+        relations = {field: self.check_names(field, record.get(field, [])) for field in LIST_FIELDS}
+        return movie, relations, episodes
+
+    def flush(self, batch):
+        if not batch:
+            return
+        batch = [entry for _, entry in batch]
+
+        with transaction.atomic():
+            # Справочники — в той же транзакции: откат пачки откатывает и их
+            created = self.create_lookups(batch)
+            ids = {field: {**self.lookups[field], **created.get(field, {})} for field in LIST_FIELDS}
+            movies = Movie.objects.bulk_create([movie for movie, _, _ in batch])
+
+            through_rows = {
+                'genres': [], 'country': [], 'film_crews': [],
+                'movie_categories': [], 'series_categories': [], 'series': [],
+            }
+            episodes = []
+            for movie, (_, relations, movie_episodes) in zip(movies, batch):
+                for field in ('genres', 'country', 'film_crews'):
+                    through_rows[field] += [(movie.id, ids[field][name]) for name in relations[field]]
+                category_field = 'movie_categories' if movie.is_film else 'series_categories'
+                through_rows[category_field] += [(movie.id, ids['categories'][name]) for name in relations['categories']]
+                for episode in movie_episodes:
+                    episode.movie_serial = movie
+                    episodes.append(episode)
+
+            episodes = Series.objects.bulk_create(episodes)
+            through_rows['series'] = [(episode.movie_serial_id, episode.id) for episode in episodes]
+
+            for field, rows in through_rows.items():
+                if not rows:
+                    continue
+                through = getattr(Movie, field).through
+                target = getattr(Movie, field).field.m2m_reverse_field_name()
+                through.objects.bulk_create(
+                    [through(movie_id=movie_id, **{f'{target}_id': pk}) for movie_id, pk in rows],
+                    ignore_conflicts=True,
+                )
+
+            # bulk_create не вызывает сигналы — обновляем зависимое сами
+            search.update_index([movie.id for movie in movies])
+            facets.movies_added([movie.id for movie in movies])
+            cache.invalidate('movie', 'series', 'category', 'genre', 'country', 'filmcrew')
+
+        for movie in movies:
+            if movie.is_film and movie.movie:
+                transcoding.schedule(movie, movie.movie)
+        for episode in episodes:
+            if episode.series:
+                transcoding.schedule(episode, episode.series)
+
+        for field, names in created.items():
+            self.lookups[field].update(names)
+            self.stats.add(self.models[field]._meta.model_name, len(names))
+        self.stats.add('movie', len(movies))
+        self.stats.add('series', len(episodes))
+
+
+def import_catalog(stream, file_format='jsonl', batch_size=1000):
+    reader = read_csv if file_format == 'csv' else read_jsonl
+    return CatalogImporter(batch_size=batch_size).run(reader(stream))
+
+
+def _relation_names(through, movie_ids, target, name_field):
+    names = {}
+    rows = through.objects.filter(movie_id__in=movie_ids).values_list('movie_id', f'{target}__{name_field}')
+    for movie_id, name in rows:
+        names.setdefault(movie_id, []).append(name)
+    return names
+
+
+def export_records(batch_size=1000):
+    """Записи каталога по порядку id; на каждую пачку фиксированное число запросов."""
+    last_id = 0
+    while True:
+        movies = list(
+            Movie.objects.filter(id__gt=last_id).order_by('id').values('id', *MOVIE_FIELDS)[:batch_size]
+        )
+        if not movies:
+            return
+        ids = [movie['id'] for movie in movies]
+        last_id = ids[-1]
+
+        relations = {
+            'genres': _relation_names(Movie.genres.through, ids, 'genre', 'title'),
+            'country': _relation_names(Movie.country.through, ids, 'country', 'title'),
+            'film_crews': _relation_names(Movie.film_crews.through, ids, 'filmcrew', 'name'),
+            'movie_categories': _relation_names(Movie.movie_categories.through, ids, 'category', 'title'),
+            'series_categories': _relation_names(Movie.series_categories.through, ids, 'category', 'title'),
+        }
+        episodes = {}
+        for episode in Series.objects.filter(movie_serial_id__in=ids).order_by('id').values('movie_serial_id', 'number', 'image', 'series'):
+            episodes.setdefault(episode.pop('movie_serial_id'), []).append(episode)
+
+        for movie in movies:
+            movie_id = movie.pop('id')
+            movie['type'] = 'movie'
+            movie['release_date'] = movie['release_date'].isoformat()
+            movie['genres'] = relations['genres'].get(movie_id, [])
+            movie['country'] = relations['country'].get(movie_id, [])
+            movie['film_crews'] = relations['film_crews'].get(movie_id, [])
+            category_field = 'movie_categories' if movie['is_film'] else 'series_categories'
+            movie['categories'] = relations[category_field].get(movie_id, [])
+            if movie_id in episodes:
+                movie['episodes'] = episodes[movie_id]
+            yield movie
+
+
+def export_film_crews():
+    for crew in FilmCrew.objects.order_by('id').values(*CREW_FIELDS).iterator():
+        crew['type'] = 'film_crew'
+        crew['birth_date'] = crew['birth_date'].isoformat()
+        yield crew
+
+
+def export_jsonl(batch_size=1000):
+    # Сначала съёмочная группа: при импорте фильмы ссылаются на неё по имени
+    for record in export_film_crews():
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+    for record in export_records(batch_size):
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def export_csv(batch_size=1000):
+    columns = ('type', *MOVIE_FIELDS, *LIST_FIELDS, *CREW_FIELDS)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    # Первый кусок — заголовок, дальше по одной строке на запись; съёмочная
+    # группа первой, как в JSONL
+    writer.writeheader()
+    for record in itertools.chain(export_film_crews(), export_records(batch_size)):
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for field in LIST_FIELDS:
+            if field in record:
+                record[field] = CSV_LIST_SEPARATOR.join(record[field])
+        writer.writerow(record)
+    yield buffer.getvalue()
@@ -0,0 +1,236 @@
+"""
+Отдача медиафайлов через фронт-сервер.
+
+Django только решает, можно ли отдать файл, а байты передаёт фронт-сервер:
+nginx по заголовку ``X-Accel-Redirect`` (``MEDIA_DELIVERY = 'nginx'``),
+Apache (mod_xsendfile) и lighttpd — по ``X-Sendfile`` (``'sendfile'``).
+Range, ETag и sendfile() тогда делает сервер, а воркер Python свободен сразу
+после проверки доступа. В режиме ``'django'`` (по умолчанию, для разработки)
+файл отдаёт сам Django через ``stream_path``.
+
+Настройка nginx для ``MEDIA_ACCEL_PREFIX = '/protected-media/'``::
+
+    location /protected-media/ {
+        internal;
+        alias /srv/app/media/;
+    }
+
+Доступ: картинки общедоступны. Видео фильмов и серий и их HLS-нарезка —
+только для активных фильмов и серий и по умолчанию только вошедшим
+пользователям (``MEDIA_PLAYBACK_LOGIN_REQUIRED``); фильмы с возрастным
+рейтингом из ``MEDIA_ADULT_AGE_RATINGS`` — только им в любом случае.
+Файл фильма или серии узнаётся по имени в базе, где бы он ни лежал (импорт
+каталога пишет любые пути); видео и HLS-файлы, которых в базе нет, не
+отдаются, как и недокачанные загрузки (``uploads/``).
+
+Подписанные ссылки (``MEDIA_URL + 'signed/<токен>/…'``, product/url_signing.py)
+проверяются только по подписи и сроку, без базы: право смотреть проверено,
+когда ссылку выдавали (``signed_url``). Такой ответ — ``public`` до
+истечения ссылки, его может кэшировать CDN.
+
+``emulate_front_server`` делает с ответом то же, что фронт-сервер, — для
+``manage.py check_media_delivery`` и проверки режимов без nginx.
+"""
+import mimetypes
+import os
+import time
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.http import HttpResponse
+from rest_framework.exceptions import NotAuthenticated, NotFound, PermissionDenied
+
+from .models import Movie, Series
+from . import url_signing
+from .streaming import stream_path
+from .uploads import UPLOAD_DIR
+
+
+BACKENDS = ('django', 'nginx', 'sendfile')
+# Заголовки ответа Django, которые фронт-сервер оставляет при подмене тела
+PRESERVED_HEADERS = ('Cache-Control', 'Vary')
+# Файлы потокового видео, которых mimetypes не считает video/*
+STREAM_EXTENSIONS = ('.m3u8', '.m4s', '.mpd', '.ts')
+
+
+def get_backend():
+    backend = getattr(settings, 'MEDIA_DELIVERY', 'django')
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured(f'MEDIA_DELIVERY должен быть одним из: {", ".join(BACKENDS)}')
+    return backend
+
+
+def get_accel_prefix():
+    return getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+
+def is_login_required():
+    return getattr(settings, 'MEDIA_PLAYBACK_LOGIN_REQUIRED', True)
+
+
+def get_adult_ratings():
+    return getattr(settings, 'MEDIA_ADULT_AGE_RATINGS', ('18+',))
+
+
+def normalize(name):
+    """Путь относительно MEDIA_ROOT без ``..`` и лишних слешей или None, если он выходит за MEDIA_ROOT."""
+    try:
+        path = default_storage.path(name)
+    except SuspiciousFileOperation:
+        return None
+    return os.path.relpath(path, default_storage.path('')).replace(os.sep, '/')
+
+
+def is_playback_file(name):
+    """Видео, звук или файл HLS/DASH — по расширению."""
+    content_type = mimetypes.guess_type(name)[0] or ''
+    return content_type.startswith(('video/', 'audio/')) or name.lower().endswith(STREAM_EXTENSIONS)
+
+
+def find_title(name):
+    """
+    Фильм (сериал), к которому относится видеофайл или HLS-нарезка, или None
+    для общедоступных файлов. Неактивные фильмы и серии, а также видео, не
+    принадлежащие ни одному фильму, — 404. Картинки — без запроса, прочее —
+    один запрос.
+    """
+    if (mimetypes.guess_type(name)[0] or '').startswith('image/'):
+        return None
+    parts = name.split('/')
+    if parts[0] == 'hls':
+        # Каталоги нарезки: hls/movie/<id>/v<поколение>/… и hls/series/<id>/… (transcoding.output_dir)
+        kind, pk = parts[1:3] if len(parts) > 3 else (None, '')
+        movies = Movie.objects.filter(is_active=True).only('id', 'age_rating')
+        if kind == 'movie' and pk.isdigit():
+            movie = movies.filter(pk=pk).first()
+        elif kind == 'series' and pk.isdigit():
+            movie = movies.filter(series_related__pk=pk, series_related__is_active=True).first()
+        else:
+            movie = None
+        if movie is None:
+            raise NotFound()
+        return movie
+
+    # Файл фильма или серии ищется по имени, а не по каталогу: импорт
+    # каталога пишет любые пути. Доступные для просмотра — первыми
+    playable = Q(is_active=True) & (Q(movie=name) | Q(series_related__series=name, series_related__is_active=True))
+    movie = (
+        Movie.objects.filter(Q(movie=name) | Q(series_related__series=name))
+        .only('id', 'age_rating')
+        .annotate(playable=ExpressionWrapper(playable, output_field=BooleanField()))
+        .order_by('-playable')
+        .first()
+    )
+    if movie is not None and movie.playable:
+        return movie
+    if movie is not None or is_playback_file(name) or name.startswith(get_title_dirs()):
+        raise NotFound()
+    return None
+
+
+def get_title_dirs():
+    return (Movie._meta.get_field('movie').upload_to, Series._meta.get_field('series').upload_to)
+
+
+def can_play(user, movie):
+    """Может ли ``user`` смотреть фильм или сериал ``movie``."""
+    if user and user.is_authenticated:
+        return True
+    return not is_login_required() and movie.age_rating not in get_adult_ratings()
+
+
+def check_playback(request, movie):
+    if not can_play(request.user, movie):
+        raise NotAuthenticated('Войдите, чтобы смотреть')
+
+
+def signed_url(request, name, movie, depth=0):
+    """
+    Подписанная ссылка на файл ``name`` фильма (сериала) ``movie`` для
+    пользователя запроса или None, если подписи выключены или смотреть ему
+    нельзя — тогда остаётся обычная ссылка с проверкой при каждом запросе.
+    ``depth`` — подписать каталог из первых частей пути (HLS).
+    """
+    if not url_signing.is_enabled() or request is None or not movie.is_active:
+        return None
+    if not can_play(request.user, movie):
+        return None
+    return settings.MEDIA_URL + url_signing.sign(name, url_signing.get_user_id(request), depth)
+
+
+def serve(request, name, private=False, max_age=None):
+    """
+    Ответ с файлом ``name`` (путь относительно MEDIA_ROOT) выбранным в
+    ``MEDIA_DELIVERY`` способом. ``max_age`` — сколько секунд ответ можно
+    хранить в общих кэшах.
+    """
+    path = default_storage.path(name)
+    if not os.path.isfile(path):
+        raise NotFound()
+
+    backend = get_backend()
+    if backend == 'django':
+        response = stream_path(request, path)
+    else:
+        response = HttpResponse(content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        if backend == 'nginx':
+            response['X-Accel-Redirect'] = get_accel_prefix() + quote(name)
+        else:
+            response['X-Sendfile'] = os.path.abspath(path)
+    if private:
+        # Видео по правам доступа не должно оседать в общих кэшах
+        response['Cache-Control'] = 'private'
+    elif max_age is not None:
+        response['Cache-Control'] = f'public, max-age={max_age}'
+    return response
+
+
+def serve_media(request, name):
+    """Файл из MEDIA_URL: проверка доступа и отдача."""
+    token = None
+    if name.startswith(url_signing.SIGNED_PREFIX):
+        token, _, name = name[len(url_signing.SIGNED_PREFIX):].partition('/')
+    name = normalize(name)
+    if name is None or name.startswith(UPLOAD_DIR):
+        raise NotFound()
+    if token is not None:
+        expires = url_signing.verify(token, name)
+        if expires is None:
+            raise PermissionDenied('Ссылка недействительна или устарела')
+        return serve(request, name, max_age=max(int(expires - time.time()), 0))
+    movie = find_title(name)
+    if movie is not None:
+        check_playback(request, movie)
+    return serve(request, name, private=movie is not None)
+
+
+def offloaded_path(response):
+    """Файл, который фронт-сервер отдал бы вместо тела ответа, или None."""
+    if 'X-Accel-Redirect' in response:
+        location = response['X-Accel-Redirect']
+        prefix = get_accel_prefix()
+        if not location.startswith(prefix):
+            return None
+        return default_storage.path(unquote(location[len(prefix):]))
+    if 'X-Sendfile' in response:
+        return response['X-Sendfile']
+    return None
+
+
+def emulate_front_server(request, response):
+    """
+    Подменяет ответ с ``X-Accel-Redirect``/``X-Sendfile`` файлом, как это
+    сделал бы фронт-сервер (с Range, If-Range и ETag). Остальные ответы
+    возвращает как есть.
+    """
+    path = offloaded_path(response)
+    if path is None:
+        return response
+    served = stream_path(request, path)
+    for header in PRESERVED_HEADERS:
+        if header in response:
+            served[header] = response[header]
+    return served
@@ -0,0 +1,236 @@
+"""
+Сериализаторы сами объявляют, какие связи и колонки им нужны.
+
+План загрузки строится по полям сериализатора: обычные поля модели идут в
+``only()``, вложенные сериализаторы и точечные ``source`` на FK — в
+``select_related``, на many-to-many и обратные FK — в ``Prefetch`` с уже
+урезанным queryset вложенного сериализатора. Что нужно
+``SerializerMethodField``, дописывается руками в ``eager_only``,
+``eager_select_related`` и ``eager_prefetch_related``.
+
+Вьюхи с ``EagerLoadingViewMixin`` применяют план к своему queryset, так что
+число запросов не зависит от размера страницы.
+
+Плоские сериализаторы (только колонки самой модели) списки с
+``values_fast_path`` собирают из строк ``values_list`` без экземпляров
+модели: поля получают значения колонок напрямую, результат тот же.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import FileField, Prefetch, prefetch_related_objects
+from rest_framework import serializers
+
+from core.instrumentation import SerializerTimingMixin
+
+
+def _nested(field):
+    child = field.child if isinstance(field, serializers.ListSerializer) else field
+    return child if isinstance(child, EagerLoadingMixin) else None
+
+
+def _column(model_field):
+    return 'pk' if model_field.primary_key else model_field.name
+
+
+class EagerListSerializer(serializers.ListSerializer):
+    """Перед выводом подгружает условные связи сразу для всей страницы."""
+
+    def to_representation(self, data):
+        objects = list(data.all() if hasattr(data, 'all') else data)
+        if objects and isinstance(objects[0], tuple):
+            # Строки values_list из быстрого пути EagerLoadingViewMixin
+            return self.child.values_to_representation(objects)
+        self.child.prefetch_conditional(objects)
+        return super().to_representation(objects)
+
+
+class EagerLoadingMixin:
+    # Колонки и связи, которые нужны методам сериализатора помимо полей
+    eager_only = ()
+    eager_select_related = ()
+    eager_prefetch_related = ()
+    # {поле: условие(объект)} — поле выводится, только если условие истинно,
+    # иначе отдаётся пустое значение, а связь не загружается вовсе
+    conditional_fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = EagerListSerializer
+
+    @classmethod
+    def get_eager_plan(cls, prefix=''):
+        """Наборы (only, select_related, prefetch_related) с префиксом пути."""
+        model = cls.Meta.model
+        select = [prefix + name for name in cls.eager_select_related]
+        only = {prefix + 'pk', *select} | {prefix + name for name in cls.eager_only}
+        prefetch = [prefix + name for name in cls.eager_prefetch_related]
+
+        for name, field in cls().fields.items():
+            if field.write_only or field.source == '*' or name in cls.conditional_fields:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                continue
+            source, _, rest = field.source.partition('.')
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                continue
+            path = prefix + source
+            nested = _nested(field)
+
+            if model_field.many_to_many or model_field.one_to_many:
+                prefetch.append(cls.get_prefetch(model_field, nested, path))
+            elif not model_field.is_relation:
+                only.add(path)
+            else:
+                if model_field.concrete or nested is not None or rest:
+                    only.add(path)
+                if nested is not None:
+                    select.append(path)
+                    nested_only, nested_select, nested_prefetch = nested.get_eager_plan(path + '__')
+                    only |= nested_only
+                    select += nested_select
+                    prefetch += nested_prefetch
+                elif rest:
+                    select.append(path)
+                    only.add(f'{path}__{rest.replace(".", "__")}')
+                elif not model_field.concrete:
+                    select.append(path)
+                    only.add(path)
+        return only, select, prefetch
+
+    @classmethod
+    def get_prefetch(cls, model_field, nested, lookup):
+        if nested is None:
+            return lookup
+        queryset = model_field.related_model._default_manager.all()
+        # Обратному FK нужна колонка, по которой объекты раскладываются по родителям
+        extra = (model_field.field.attname,) if model_field.one_to_many else ()
+        return Prefetch(lookup, queryset=nested.setup_eager_loading(queryset, extra))
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, extra_only=()):
+        only, select, prefetch = cls.get_eager_plan()
+        return queryset.select_related(*select).prefetch_related(*prefetch).only(*only, *extra_only)
+
+    @classmethod
+    def get_values_columns(cls):
+        """
+        Колонки ``values_list`` для быстрого пути или None, если сериализатор
+        нельзя собрать из колонок модели: есть связи, вложенные сериализаторы,
+        ``SerializerMethodField``, условные поля или свой ``to_representation``.
+        """
+        if (cls.conditional_fields or cls.eager_only or cls.eager_select_related or cls.eager_prefetch_related
+                or cls.to_representation is not EagerLoadingMixin.to_representation):
+            return None
+        model = cls.Meta.model
+        # pk нужен пагинации для курсора
+        columns = ['pk']
+        for field in cls().fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer)):
+                return None
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            if model_field.is_relation:
+                return None
+            column = _column(model_field)
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def values_to_representation(self, rows):
+        """
+        То же, что ``to_representation`` для каждой строки, но из строк
+        ``values_list(*get_values_columns(), named=True)``. Файловые колонки
+        оборачиваются в ``FieldFile`` без экземпляра — ссылки строятся как обычно.
+        """
+        model = self.Meta.model
+        plan = []
+        for field in self._readable_fields:
+            model_field = model._meta.get_field(field.source)
+            file_field = model_field if isinstance(model_field, FileField) else None
+            plan.append((field.field_name, _column(model_field), field, file_field))
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, field, file_field in plan:
+                value = getattr(row, column)
+                if file_field is not None:
+                    item[name] = field.to_representation(file_field.attr_class(None, file_field, value))
+                elif value is None:
+                    item[name] = None
+                else:
+                    item[name] = field.to_representation(value)
+            data.append(item)
+        return data
+
+    @classmethod
+    def prefetch_conditional(cls, objects):
+        """Загружает условные связи только для тех объектов, где они выводятся."""
+        if not cls.conditional_fields:
+            return
+        fields = cls().fields
+        for name, condition in cls.conditional_fields.items():
+            targets = [obj for obj in objects if condition(obj)]
+            if targets:
+                field = fields[name]
+                model_field = cls.Meta.model._meta.get_field(field.source)
+                prefetch_related_objects(targets, cls.get_prefetch(model_field, _nested(field), field.source))
+
+    def to_representation(self, instance):
+        skipped = {name for name, condition in self.conditional_fields.items() if not condition(instance)}
+        if not skipped:
+            return super().to_representation(instance)
+
+        self._skipped_fields = skipped
+        try:
+            representation = super().to_representation(instance)
+        finally:
+            self._skipped_fields = ()
+        for name in skipped:
+            representation[name] = [] if isinstance(self.fields[name], serializers.ListSerializer) else None
+        return {name: representation[name] for name in self.fields if name in representation}
+
+    @property
+    def _readable_fields(self):
+        skipped = getattr(self, '_skipped_fields', ())
+        for field in super()._readable_fields:
+            if field.field_name not in skipped:
+                yield field
+
+
+class EagerLoadingViewMixin(SerializerTimingMixin):
+    """
+    Применяет план загрузки сериализатора вьюхи к её queryset и учитывает
+    время сериализации (``SerializerTimingMixin``). Встраивается
+    в ``filter_queryset``: его вызывают и список, и ``get_object``, а
+    ``get_queryset`` вьюхи часто переопределяют без ``super()``.
+
+    ``values_fast_path`` — только для списков (без ``get_object``): если
+    сериализатор плоский, queryset отдаёт строки ``values_list`` вместо
+    объектов модели. Выключается настройкой ``SERIALIZER_VALUES_FAST_PATH``.
+    """
+    values_fast_path = False
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if serializer_class is not None and issubclass(serializer_class, EagerLoadingMixin):
+            columns = serializer_class.get_values_columns() if self.use_values_fast_path() else None
+            if columns is not None:
+                # Аннотации (например, search_rank) остаются в выборке: по ним
+                # сортируют и строят курсор, а values_list без них их не отдаст
+                extra = [name for name in queryset.query.annotation_select if name not in columns]
+                return queryset.values_list(*columns, *extra, named=True)
+            queryset = serializer_class.setup_eager_loading(queryset)
+        return queryset
+
+    def use_values_fast_path(self):
+        return self.values_fast_path and getattr(settings, 'SERIALIZER_VALUES_FAST_PATH', True)
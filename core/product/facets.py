@@ -0,0 +1,243 @@
+"""
+Материализованные счётчики фасетов каталога.
+
+Для каждого жанра, страны и категории хранится, сколько к ним привязано
+фильмов и сколько сериалов (``FacetCount``), плюс общее число фильмов и
+сериалов. Счётчики меняются на месте одним UPDATE при изменении связей,
+типа или удалении фильма (см. ``signals``); ``rebuild_facets`` пересчитывает
+их целиком, если данные менялись в обход сигналов (``bulk_create``, SQL).
+
+``browse`` отдаёт счётчики для любой комбинации фильтров
+``MovieFacetFilter``: без фильтров (или только с ``is_film``) — из
+материализованной таблицы, с фильтрами — одним GROUP BY по таблице связей
+на фасет.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django_filters.utils import translate_validation
+
+from .models import FacetCount, Movie
+from . import cache
+
+
+# Фасет -> поле связи у Movie (оно же параметр фильтра и ключ в ответе)
+FACETS = {
+    FacetCount.GENRE: 'genres',
+    FacetCount.COUNTRY: 'country',
+    FacetCount.MOVIE_CATEGORY: 'movie_categories',
+    FacetCount.SERIES_CATEGORY: 'series_categories',
+}
+THROUGH_FACETS = {getattr(Movie, field_name).through: facet for facet, field_name in FACETS.items()}
+
+
+def get_relation(facet):
+    """Промежуточная модель связи и имена её полей фильма и значения."""
+    field = Movie._meta.get_field(FACETS[facet])
+    return field.remote_field.through, field.m2m_field_name(), field.m2m_reverse_field_name()
+
+
+def apply(changes):
+    """Прибавляет к счётчикам {(фасет, id значения, is_film): изменение}."""
+    changed = False
+    # Один порядок строк во всех транзакциях — без взаимных блокировок
+    for (facet, value_id, is_film), delta in sorted(changes.items()):
+        if not delta:
+            continue
+        changed = True
+        counts = FacetCount.objects.filter(facet=facet, value_id=value_id, is_film=is_film)
+        if counts.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(facet=facet, value_id=value_id, is_film=is_film, count=max(delta, 0))
+        except IntegrityError:
+            # Строку успела создать параллельная транзакция
+            counts.update(count=F('count') + delta)
+    if changed:
+        cache.invalidate('facet')
+
+
+def get_value_ids(movie, facet):
+    through, movie_field, value_field = get_relation(facet)
+    return through.objects.filter(**{movie_field: movie.pk}).values_list(value_field, flat=True)
+
+
+def changed_relations(instance, reverse, pk_set):
+    """(id значения, is_film) для связей, переданных в ``m2m_changed``."""
+    if not reverse:
+        return [(value_id, instance.is_film) for value_id in pk_set]
+    return [(instance.pk, is_film) for is_film in Movie.objects.filter(id__in=pk_set).values_list('is_film', flat=True)]
+
+
+def current_relations(through, instance, reverse):
+    """(id значения, is_film) для всех связей объекта — перед ``clear()``."""
+    facet = THROUGH_FACETS[through]
+    if not reverse:
+        return [(value_id, instance.is_film) for value_id in get_value_ids(instance, facet)]
+    _, movie_field, value_field = get_relation(facet)
+    is_films = through.objects.filter(**{value_field: instance.pk}).values_list(f'{movie_field}__is_film', flat=True)
+    return [(instance.pk, is_film) for is_film in is_films]
+
+
+def relations_changed(through, relations, sign):
+    facet = THROUGH_FACETS[through]
+    changes = Counter()
+    for value_id, is_film in relations:
+        changes[(facet, value_id, is_film)] += sign
+    apply(changes)
+
+
+def movie_added(movie):
+    apply({(FacetCount.TOTAL, 0, movie.is_film): 1})
+
+
+def movie_removed(movie):
+    """Вызывается до удаления: связи фильма удаляются каскадом без ``m2m_changed``."""
+    changes = Counter({(FacetCount.TOTAL, 0, movie.is_film): -1})
+    for facet in FACETS:
+        for value_id in get_value_ids(movie, facet):
+            changes[(facet, value_id, movie.is_film)] -= 1
+    apply(changes)
+
+
+def movie_type_changed(movie, was_film):
+    """Фильм стал сериалом или наоборот — переносим его из одних счётчиков в другие."""
+    keys = [(FacetCount.TOTAL, 0)]
+    for facet in FACETS:
+        keys += [(facet, value_id) for value_id in get_value_ids(movie, facet)]
+    changes = Counter()
+    for facet, value_id in keys:
+        changes[(facet, value_id, was_film)] -= 1
+        changes[(facet, value_id, movie.is_film)] += 1
+    apply(changes)
+
+
+def value_removed(facets, value_id):
+    """Жанр, страна или категория удалены вместе со связями."""
+    FacetCount.objects.filter(facet__in=facets, value_id=value_id).delete()
+    cache.invalidate('facet')
+
+
+def grouped_counts(movie_ids=None):
+    """Счётчики, посчитанные GROUP BY по фильмам и таблицам связей (все или по списку id)."""
+    movies = Movie.objects.order_by()
+    if movie_ids is not None:
+        movies = movies.filter(id__in=movie_ids)
+    counts = Counter({
+        (FacetCount.TOTAL, 0, is_film): count
+        for is_film, count in movies.values_list('is_film').annotate(count=Count('id'))
+    })
+    for facet in FACETS:
+        through, movie_field, value_field = get_relation(facet)
+        rows = through.objects.order_by()
+        if movie_ids is not None:
+            rows = rows.filter(**{f'{movie_field}__in': movie_ids})
+        grouped = rows.values_list(value_field, f'{movie_field}__is_film').annotate(count=Count('pk'))
+        for value_id, is_film, count in grouped:
+            counts[(facet, value_id, is_film)] = count
+    return counts
+
+
+def movies_added(movie_ids):
+    """Учитывает фильмы, созданные через ``bulk_create``, вместе с их связями."""
+    apply(grouped_counts(movie_ids))
+
+
+def rebuild():
+    """Пересчитывает все счётчики по текущим данным. Возвращает число строк."""
+    with transaction.atomic():
+        rows = [
+            FacetCount(facet=facet, value_id=value_id, is_film=is_film, count=count)
+            for (facet, value_id, is_film), count in grouped_counts().items()
+        ]
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(rows, batch_size=1000)
+    cache.invalidate('facet')
+    return len(rows)
+
+
+def with_counts(queryset, facet, is_film=None):
+    """Добавляет к жанрам, странам или категориям аннотацию ``facet_count``."""
+    counts = FacetCount.objects.filter(facet=facet, value_id=OuterRef('pk'))
+    if is_film is not None:
+        counts = counts.filter(is_film=is_film)
+    counts = counts.order_by().values('value_id').annotate(total=Sum('count')).values('total')
+    return queryset.annotate(facet_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+
+def stored_value_counts(facet, is_film):
+    model = Movie._meta.get_field(FACETS[facet]).related_model
+    values = (
+        with_counts(model.objects.all(), facet, is_film)
+        .filter(facet_count__gt=0)
+        .order_by('-facet_count', 'title')
+        .values_list('id', 'title', 'facet_count')
+    )
+    return [{'id': pk, 'title': title, 'count': count} for pk, title, count in values]
+
+
+def live_value_counts(facet, movie_ids):
+    through, movie_field, value_field = get_relation(facet)
+    values = (
+        through.objects.filter(**{f'{movie_field}__in': movie_ids})
+        .values(value_field, f'{value_field}__title')
+        .annotate(count=Count('pk'))
+        .order_by('-count', f'{value_field}__title')
+        .values_list(value_field, f'{value_field}__title', 'count')
+    )
+    return [{'id': pk, 'title': title, 'count': count} for pk, title, count in values]
+
+
+def browse(data, filterset_class, queryset):
+    """
+    Число результатов и счётчики фасетов для комбинации фильтров из ``data``.
+
+    Счётчики фасета считаются без фильтра по самому этому фасету: у жанров
+    видно, сколько результатов даст выбор ещё одного жанра, а не только
+    пересечение с уже выбранными.
+    """
+    filterset = filterset_class(data, queryset=queryset)
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    cleaned = filterset.form.cleaned_data
+    is_film = cleaned.get('is_film')
+    active = {name for name in filterset.filters if any(data.getlist(name))}
+    facet_params = {'is_film', *FACETS.values()}
+
+    # Значения уже проверены, поэтому фильтры применяем сами: не относящиеся
+    # к фасетам (поиск, дата) — один раз, фасетные — все, кроме считаемого
+    base = queryset
+    for name, value in cleaned.items():
+        if name not in facet_params:
+            base = filterset.filters[name].filter(base, value)
+
+    def matching_ids(exclude):
+        """id подходящих фильмов или None, если хватает материализованных счётчиков."""
+        if not active - {exclude, 'is_film'}:
+            return None
+        qs = base
+        for name in sorted(facet_params - {exclude}):
+            qs = filterset.filters[name].filter(qs, cleaned.get(name))
+        return qs.order_by().values('id')
+
+    movie_ids = matching_ids('is_film')
+    if movie_ids is None:
+        types = FacetCount.objects.filter(facet=FacetCount.TOTAL).values_list('is_film', 'count')
+    else:
+        types = Movie.objects.filter(id__in=movie_ids).order_by().values_list('is_film').annotate(count=Count('id'))
+    types = dict(types)
+    # Типы посчитаны со всеми фильтрами, кроме is_film, так что общее число — это их сумма
+    # или счётчик выбранного типа
+    total = types.get(is_film, 0) if is_film is not None else sum(types.values())
+
+    facets = {'is_film': [{'value': value, 'count': types.get(value, 0)} for value in (True, False)]}
+    for facet, name in FACETS.items():
+        movie_ids = matching_ids(name)
+        if movie_ids is None:
+            facets[name] = stored_value_counts(facet, is_film)
+        else:
+            facets[name] = live_value_counts(facet, movie_ids)
+    return {'count': total, 'facets': facets}
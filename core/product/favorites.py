@@ -0,0 +1,60 @@
+"""
+Пакетные операции с избранным.
+
+Каждая операция — фиксированное число запросов независимо от длины списка:
+добавление одним ``INSERT ... ON CONFLICT DO NOTHING``, удаление одним
+DELETE, поэтому повтор того же запроса (синхронизация после офлайна)
+ничего не ломает.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import Favorite, Movie
+
+
+def get_batch_limit():
+    return getattr(settings, 'FAVORITES_BATCH_LIMIT', 500)
+
+
+def existing_movie_ids(movie_ids):
+    """Разделяет id на существующие фильмы и отсутствующие (удалённые, чужие)."""
+    found = set(Movie.objects.filter(id__in=movie_ids).values_list('id', flat=True))
+    return [pk for pk in movie_ids if pk in found], [pk for pk in movie_ids if pk not in found]
+
+
+def delete(queryset):
+    """
+    Число удалённых записей. У ``Favorite`` нет приёмников удаления и
+    зависимых моделей, поэтому ``delete()`` — один DELETE без SELECT.
+    """
+    return queryset.delete()[0]
+
+
+def add(user_id, movie_ids):
+    Favorite.objects.bulk_create(
+        [Favorite(user_id=user_id, movie_id=movie_id) for movie_id in movie_ids],
+        ignore_conflicts=True,
+    )
+
+
+def remove(user_id, movie_ids):
+    """Возвращает число удалённых записей."""
+    return delete(Favorite.objects.filter(user_id=user_id, movie_id__in=movie_ids))
+
+
+def replace(user_id, movie_ids):
+    """Оставляет в избранном ровно ``movie_ids``. Возвращает число удалённых записей."""
+    with transaction.atomic():
+        deleted = delete(Favorite.objects.filter(user_id=user_id).exclude(movie_id__in=movie_ids))
+        add(user_id, movie_ids)
+    return deleted
+
+
+def favorited_ids(user_id, movie_ids):
+    return set(Favorite.objects.filter(user_id=user_id, movie_id__in=movie_ids).values_list('movie_id', flat=True))
+
+
+def bitmap(user_id, movie_ids):
+    """Строка из '0' и '1' в порядке ``movie_ids``: есть ли фильм в избранном."""
+    favorited = favorited_ids(user_id, movie_ids)
+    return ''.join('1' if pk in favorited else '0' for pk in movie_ids)
@@ -1,8 +1,11 @@
 from django_filters import rest_framework as filters
 from .models import Movie
+from .search import search_queryset
 
 class MovieSerialFilter(filters.FilterSet):
-    search = filters.CharFilter(field_name='title', lookup_expr='icontains')
+    search = filters.CharFilter(method='filter_search')
+    duration_min = filters.NumberFilter(field_name='duration', lookup_expr='gte')
+    duration_max = filters.NumberFilter(field_name='duration', lookup_expr='lte')
     class Meta:
         model = Movie
         fields = (
@@ -11,5 +14,15 @@ class MovieSerialFilter(filters.FilterSet):
             'created_date',
         )
 
+    def filter_search(self, queryset, name, value):
+        return search_queryset(queryset, value).order_by('search_rank')
 
 
+class MovieFacetFilter(MovieSerialFilter):
+    """Фильтры фасетного просмотра: те же, что у списков, плюс тип и категории."""
+    class Meta(MovieSerialFilter.Meta):
+        fields = MovieSerialFilter.Meta.fields + (
+            'is_film',
+            'movie_categories',
+            'series_categories',
+        )
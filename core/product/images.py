@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from . import cache
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640, 1280)
+DEFAULT_FORMATS = ('avif', 'webp', 'jpeg')
+SAVE_OPTIONS = {
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+READY_PREFIX = 'images:ready:'
+# Готовые копии не пропадают, а отсутствие перепроверяется: другой процесс
+# с кэшем в памяти не узнает, что копии уже сделаны
+READY_TIMEOUT = 24 * 3600
+
+_executor = None
+
+
+def get_widths():
+    return tuple(sorted(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def get_formats():
+    # AVIF есть не во всех сборках Pillow — берём только то, что умеем сохранять
+    supported = set(Image.registered_extensions().values())
+    return tuple(
+        fmt for fmt in getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', DEFAULT_FORMATS)
+        if SAVE_OPTIONS[fmt]['format'] in supported
+    )
+
+
+def get_pending_timeout():
+    return getattr(settings, 'IMAGE_READY_PENDING_TIMEOUT', 60)
+
+
+def derivative_name(name, width, fmt):
+    # Расширение оригинала остаётся в имени: у a.jpg и a.png разные копии
+    return f'{name}__w{width}.{EXTENSIONS[fmt]}'
+
+
+def last_derivative_name(name):
+    """
+    Последней пишется самая широкая копия последнего формата: по ней
+    судят, готовы ли все. None, если копии не делаются.
+    """
+    formats, widths = get_formats(), get_widths()
+    if not formats or not widths:
+        return None
+    return derivative_name(name, widths[-1], formats[-1])
+
+
+def ready_key(last_name):
+    return READY_PREFIX + hashlib.md5(last_name.encode()).hexdigest()
+
+
+def is_ready(name, use_cache=True):
+    """
+    Готовы ли производные картинки. Ответ кэшируется по имени файла, чтобы
+    сериализация списка не проверяла хранилище на каждой строке.
+    """
+    last_name = last_derivative_name(name)
+    if last_name is None:
+        return False
+    key = ready_key(last_name)
+    if use_cache:
+        ready = cache.get_cache().get(key)
+        if ready is not None:
+            return ready
+    ready = default_storage.exists(last_name)
+    cache.get_cache().set(key, ready, READY_TIMEOUT if ready else get_pending_timeout())
+    return ready
+
+
+def mark_ready(name):
+    last_name = last_derivative_name(name)
+    if last_name is not None:
+        cache.get_cache().set(ready_key(last_name), True, READY_TIMEOUT)
+
+
+def srcset(field_file):
+    """
+    Карта {формат: {ширина: url}} для готовых производных или None, если
+    их ещё нет (тогда клиент использует оригинал).
+    """
+    if not field_file or not is_ready(field_file.name):
+        return None
+    return {
+        fmt: {
+            str(width): default_storage.url(derivative_name(field_file.name, width, fmt))
+            for width in get_widths()
+        }
+        for fmt in get_formats()
+    }
+
+
+def generate(name):
+    source_path = default_storage.path(name)
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+        for fmt in get_formats():
+            for width in get_widths():
+                resized = image.copy()
+                # Не увеличиваем картинки уже исходной ширины
+                resized.thumbnail((width, width * 10), Image.LANCZOS)
+                if fmt == 'jpeg' and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+
+                target = default_storage.path(derivative_name(name, width, fmt))
+                tmp = target + '.tmp'
+                resized.save(tmp, **SAVE_OPTIONS[fmt])
+                os.replace(tmp, target)
+    mark_ready(name)
+
+
+def schedule(field_file):
+    """Ставит генерацию производных в фоновый пул, если их ещё нет."""
+    if not field_file or is_ready(field_file.name):
+        return None
+
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_WORKERS', 2),
+            thread_name_prefix='images',
+        )
+    return _executor.submit(_run, field_file.name)
+
+
+def _run(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Could not generate image derivatives for %s', name)
+        return
+    # В ответах появляется srcset — их ETag и кэш должны смениться
+    cache.invalidate('media')
@@ -0,0 +1,567 @@
+import io
+import json
+import logging
+import math
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from PIL import Image
+
+from product import facets, progress, ratings, search
+from product.models import (
+    Banner, Category, Country, Favorite, FilmCrew, Genre, Movie, Rating, Series, WatchProgress,
+)
+from product.ratings import rebuild_rating_aggregates
+from user.models import MyUser
+from user.serializers import ClaimsTokenObtainPairSerializer
+
+
+PASSWORD = 'benchmark'
+CHUNK = 64 * 1024
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, max(math.ceil(share * len(values)) - 1, 0))]
+
+
+def png_upload(name):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'gray').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class Catalog:
+    """id сгенерированных объектов и состояние, которое меняют запросы смеси."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.phone_counter = 0
+
+    def pick(self, name):
+        return self.rng.choice(getattr(self, name))
+
+    def next_phone(self):
+        self.phone_counter += 1
+        return f'+8{self.phone_counter:010d}'
+
+
+# Запросы смеси: имя -> (вес, роль, построитель запроса, допустимые статусы).
+# Построитель получает Catalog и пользователя, возвращает (метод, путь, параметры Client).
+# Веса — доля в типичном трафике: чтение каталога преобладает, записи редки.
+
+def movie_payload(catalog, categories_field):
+    payload = {
+        'title': f'Новый фильм {catalog.rng.randrange(10 ** 6)}',
+        'description': 'Описание',
+        'release_date': '2024-01-01',
+        'production_year': 2024,
+        'rating': catalog.rng.randint(1, 10),
+        'duration': 100,
+        'poster': png_upload('poster.png'),
+        categories_field: [catalog.pick('category_ids')],
+        'genres': [catalog.pick('genre_ids')],
+        'country': [catalog.pick('country_ids')],
+        'age_rating': '16+',
+    }
+    # Тип сериала задаёт сам маршрут add_serial
+    if categories_field == 'movie_categories':
+        payload['is_film'] = True
+    return payload
+
+
+def catalog_file(catalog):
+    record = {
+        'type': 'movie', 'title': f'Импорт {catalog.rng.randrange(10 ** 6)}', 'release_date': '2020-01-01',
+        'production_year': 2020, 'rating': 7, 'duration': 120, 'poster': 'poster_image/benchmark.png',
+        'age_rating': '16+', 'is_film': True, 'genres': ['Жанр 0'], 'country': ['Страна 0'],
+    }
+    return SimpleUploadedFile('catalog.jsonl', (json.dumps(record, ensure_ascii=False) + '\n').encode())
+
+
+ROUTES = {
+    # Главная и карточки
+    'index': (20, 'anon', lambda c, u: ('get', '/api/index/', {'data': {'limit': 20}}), {200}),
+    'index (вошедший)': (8, 'user', lambda c, u: ('get', '/api/index/', {'data': {'limit': 20}}), {200}),
+    'index, поиск': (3, 'anon', lambda c, u: ('get', '/api/index/', {'data': {'search': f'Фильм {c.rng.randrange(100)}'}}),
+                     {200}),
+    'карточка фильма': (12, 'anon', lambda c, u: ('get', f'/api/index/{c.pick("movie_ids")}/', {}), {200}),
+    'карточка серии': (3, 'anon', lambda c, u: ('get', f'/api/index/series/{c.pick("episode_ids")}/', {}), {200}),
+    'фильм (краткий)': (2, 'anon', lambda c, u: ('get', f'/api/index/movie/{c.pick("movie_ids")}/', {}), {200}),
+    'серии сериала': (4, 'anon', lambda c, u: ('get', f'/api/serial/{c.pick("serial_ids")}/series/', {}), {200}),
+    'изменение фильма': (0.2, 'staff', lambda c, u: (
+        'patch', f'/api/index/{c.pick("movie_ids")}/',
+        {'data': {'budget': c.rng.randrange(10 ** 6)}, 'content_type': 'application/json'},
+    ), {200}),
+
+    # Просмотр (по умолчанию только вошедшим, MEDIA_PLAYBACK_LOGIN_REQUIRED)
+    'просмотр фильма': (3, 'user', lambda c, u: (
+        'get', f'/api/movies/{c.pick("film_ids")}/watch/', {'HTTP_RANGE': f'bytes=0-{CHUNK - 1}'},
+    ), {206}),
+    'просмотр серии': (2, 'user', lambda c, u: (
+        'get', f'/api/series/{c.pick("episode_ids")}/watch/', {'HTTP_RANGE': f'bytes=0-{CHUNK - 1}'},
+    ), {206}),
+    'видеофайл из MEDIA_URL': (1, 'user', lambda c, u: (
+        'get', '/media/media/movie_film/benchmark.mp4', {'HTTP_RANGE': f'bytes=0-{CHUNK - 1}'},
+    ), {206}),
+    'отметка прогресса': (8, 'user', lambda c, u: (
+        'post', '/api/progress/heartbeat/',
+        {'data': {'movie': c.pick('film_ids'), 'position': c.rng.randrange(5400), 'duration': 5400},
+         'content_type': 'application/json'},
+    ), {204}),
+    'продолжить просмотр': (3, 'user', lambda c, u: ('get', '/api/progress/', {}), {200}),
+
+    # Избранное
+    'избранное': (3, 'user', lambda c, u: ('get', '/api/favorites/', {}), {200}),
+    'в избранное': (2, 'user', lambda c, u: (
+        'post', '/api/favorites/add/', {'data': {'movie': c.pick('movie_ids')}, 'content_type': 'application/json'},
+    ), {201}),
+    'из избранного': (1, 'user', lambda c, u: ('delete', f'/api/favorites/remove/{c.pick("movie_ids")}/', {}),
+                      {204, 404}),
+    'избранное пачкой': (0.5, 'user', lambda c, u: (
+        'post', '/api/favorites/batch/add/',
+        {'data': {'movies': c.rng.sample(c.movie_ids, 20)}, 'content_type': 'application/json'},
+    ), {200}),
+    'удаление пачкой': (0.3, 'user', lambda c, u: (
+        'post', '/api/favorites/batch/remove/',
+        {'data': {'movies': c.rng.sample(c.movie_ids, 20)}, 'content_type': 'application/json'},
+    ), {200}),
+    'синхронизация избранного': (0.2, 'user', lambda c, u: (
+        'post', '/api/favorites/batch/replace/',
+        {'data': {'movies': c.rng.sample(c.movie_ids, 30)}, 'content_type': 'application/json'},
+    ), {200}),
+    'отметки избранного': (4, 'user', lambda c, u: (
+        'get', '/api/favorites/status/', {'data': {'movies': ','.join(map(str, c.rng.sample(c.movie_ids, 20)))}},
+    ), {200}),
+
+    # Списки и фильтры
+    'категории фильмов': (2, 'anon', lambda c, u: ('get', '/api/movie/', {}), {200}),
+    'категории сериалов': (2, 'anon', lambda c, u: ('get', '/api/serie/', {}), {200}),
+    'жанры': (2, 'anon', lambda c, u: ('get', '/api/genres/', {}), {200}),
+    'страны': (2, 'anon', lambda c, u: ('get', '/api/countries/', {}), {200}),
+    'фильмы категории': (4, 'anon', lambda c, u: (
+        'get', f'/api/movies/category/{c.pick("category_ids")}/',
+        {'data': {'ordering': c.rng.choice(['-rating', '-created_date', 'title'])}},
+    ), {200}),
+    'сериалы категории': (3, 'anon', lambda c, u: (
+        'get', f'/api/series/category/{c.pick("category_ids")}/', {'data': {'ordering': '-rating'}},
+    ), {200}),
+    'жанр': (4, 'anon', lambda c, u: (
+        'get', f'/api/genre/{c.pick("genre_ids")}/',
+        {'data': {'is_film': c.rng.choice(['True', 'False']), 'ordering': c.rng.choice(['-rating', '-production_year'])}},
+    ), {200}),
+    'страна': (3, 'anon', lambda c, u: (
+        'get', f'/api/country/{c.pick("country_ids")}/', {'data': {'ordering': '-rating_average'}},
+    ), {200}),
+    'фасеты': (3, 'anon', lambda c, u: (
+        'get', '/api/facets/', {'data': {'genres': c.pick('genre_ids'), 'is_film': 'true'}},
+    ), {200}),
+
+    # Добавление
+    'добавление фильма': (0.1, 'staff', lambda c, u: ('post', '/api/movie_add/', {'data': movie_payload(c, 'movie_categories')}),
+                          {201}),
+    'добавление сериала': (0.1, 'staff', lambda c, u: ('post', '/api/add_serial/', {'data': movie_payload(c, 'series_categories')}),
+                           {201}),
+    'добавление серии': (0.1, 'staff', lambda c, u: (
+        'post', '/api/create_serial/',
+        {'data': {'movie_serial': c.pick('serial_ids'), 'number': str(c.rng.randrange(100)),
+                  'image': png_upload('episode.png'), 'series': SimpleUploadedFile('episode.mp4', b'\0' * 1024)}},
+    ), {201}),
+    'начало загрузки': (0.1, 'staff', lambda c, u: (
+        'post', '/api/uploads/',
+        {'data': {'movie': c.pick('movie_ids'), 'filename': 'film.mp4', 'length': 1024}, 'content_type': 'application/json'},
+    ), {201}),
+
+    # Оценки
+    'оценка': (2, 'user', lambda c, u: (
+        'post', '/api/ratings/add/',
+        {'data': {'movie': c.pick('movie_ids'), 'score': c.rng.randint(1, 10)}, 'content_type': 'application/json'},
+    ), {201, 400}),
+    'оценка (upsert)': (3, 'user', lambda c, u: (
+        'post', '/api/ratings/',
+        {'data': {'movie': c.pick('movie_ids'), 'score': c.rng.randint(1, 10)}, 'content_type': 'application/json'},
+    ), {200, 201}),
+    'изменение оценки': (1, 'user', lambda c, u: (
+        'patch', f'/api/ratings/update/{c.rng.choice(c.ratings_by_user[u.id])}/',
+        {'data': {'score': c.rng.randint(1, 10)}, 'content_type': 'application/json'},
+    ), {200}),
+
+    # Служебное
+    'статистика кэша': (0.1, 'staff', lambda c, u: ('get', '/api/cache/stats/', {}), {200}),
+    'импорт каталога': (0.1, 'staff', lambda c, u: ('post', '/api/catalog/import/', {'data': {'file': catalog_file(c)}}),
+                        {200}),
+    'экспорт каталога': (0.05, 'staff', lambda c, u: ('get', '/api/catalog/export/', {}), {200}),
+
+    # Асинхронные версии
+    'async index': (2, 'anon', lambda c, u: ('get', '/api/async/index/', {'data': {'limit': 20}}), {200}),
+    'async карточка': (2, 'anon', lambda c, u: ('get', f'/api/async/index/{c.pick("movie_ids")}/', {}), {200}),
+    'async серии': (1, 'anon', lambda c, u: ('get', f'/api/async/serial/{c.pick("serial_ids")}/series/', {}), {200}),
+    'async фильмы категории': (1, 'anon', lambda c, u: (
+        'get', f'/api/async/movies/category/{c.pick("category_ids")}/', {},
+    ), {200}),
+    'async сериалы категории': (1, 'anon', lambda c, u: (
+        'get', f'/api/async/series/category/{c.pick("category_ids")}/', {},
+    ), {200}),
+    'async жанр': (1, 'anon', lambda c, u: ('get', f'/api/async/genre/{c.pick("genre_ids")}/', {}), {200}),
+    'async страна': (1, 'anon', lambda c, u: ('get', f'/api/async/country/{c.pick("country_ids")}/', {}), {200}),
+
+    # Пользователи
+    'регистрация': (0.5, 'anon', lambda c, u: (
+        'post', '/api/user/register/',
+        {'data': {'username': 'Новый', 'phone_number': c.next_phone(), 'password': PASSWORD},
+         'content_type': 'application/json'},
+    ), {201}),
+    'вход': (1, 'anon', lambda c, u: (
+        'post', '/api/user/login/',
+        {'data': {'phone_number': c.pick('phone_numbers'), 'password': PASSWORD}, 'content_type': 'application/json'},
+    ), {200}),
+    'профиль': (2, 'user', lambda c, u: ('get', '/api/user/profile/', {}), {200}),
+    'изменение профиля': (0.5, 'user', lambda c, u: (
+        'patch', '/api/user/profile/', {'data': {'username': f'Зритель {c.rng.randrange(1000)}'},
+                                        'content_type': 'application/json'},
+    ), {200}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон API: генерирует каталог заданного размера во временной базе, '
+        'гоняет смесь запросов по всем маршрутам product и user через полный стек Django '
+        '(middleware, JWT) и печатает p50/p95/p99, число SQL-запросов и пик памяти на '
+        'запрос. С --save-baseline сохраняет результат, с --baseline сравнивает с ним и '
+        'завершается с ошибкой при регрессии.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--episodes', type=int, default=8, help='Серий у каждого сериала')
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--ratings', type=int, default=20000)
+        parser.add_argument('--favorites', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=3000, help='Всего запросов в смеси')
+        parser.add_argument('--min-per-route', type=int, default=10,
+                            help='Не меньше стольких запросов на маршрут, даже редкий')
+        parser.add_argument('--memory-samples', type=int, default=3,
+                            help='Запросов на маршрут в отдельном проходе с tracemalloc')
+        parser.add_argument('--route', action='append', help='Только эти маршруты (можно несколько раз)')
+        parser.add_argument('--with-cache', action='store_true', help='Не отключать кэш ответов')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', help='Сохранить результат в JSON')
+        parser.add_argument('--baseline', help='Сравнить с сохранённым JSON')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Допустимый рост p95 и памяти относительно базы (доля)')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Рост p95 меньше этого не считается регрессией (шум)')
+
+    def handle(self, *args, **options):
+        routes = {name: spec for name, spec in ROUTES.items() if not options['route'] or name in options['route']}
+        if not routes:
+            raise CommandError(f'Нет таких маршрутов. Доступны: {", ".join(ROUTES)}')
+        config = {
+            key: options[key]
+            for key in ('movies', 'episodes', 'users', 'ratings', 'favorites', 'requests', 'with_cache', 'seed')
+        }
+        # Предупреждения о числе запросов и 4xx/5xx попадают в отчёт, а не в консоль
+        for name in ('core.instrumentation', 'django.request'):
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        overrides = {
+            'MEDIA_ROOT': media_root,
+            'ALLOWED_HOSTS': ['*'],
+            'HLS_AUTO_ENQUEUE': False,
+            'IMAGE_DERIVATIVE_WIDTHS': (),
+        }
+        if not options['with_cache']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**overrides):
+                started = time.perf_counter()
+                catalog = self.seed(options, media_root)
+                self.stdout.write(
+                    f'Каталог: {options["movies"]} фильмов и сериалов, {len(catalog.episode_ids)} серий, '
+                    f'{options["users"]} пользователей, {options["ratings"]} оценок, '
+                    f'{options["favorites"]} избранных ({time.perf_counter() - started:.1f} с)'
+                )
+                try:
+                    results = self.run(routes, catalog, options)
+                finally:
+                    # Буферы пишут во временную базу — сбрасываем до её удаления
+                    progress.buffer.flush()
+                    ratings.buffer.flush()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.report(results)
+        failures = [f'{name}: неожиданные ответы {sorted(result["errors"])}'
+                    for name, result in results.items() if result['errors']]
+        if options['baseline']:
+            failures += self.compare(results, config, options)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as baseline:
+                json.dump({'config': config, 'routes': results}, baseline, ensure_ascii=False, indent=2)
+            self.stdout.write(f'База сохранена в {options["save_baseline"]}')
+        if failures:
+            raise CommandError('\n'.join(['Регрессии:', *failures]))
+
+    def seed(self, options, media_root):
+        rng = random.Random(options['seed'])
+        catalog = Catalog(rng)
+
+        # Один реальный видеофайл на всех — для Range-запросов просмотра
+        video = 'media/movie_film/benchmark.mp4'
+        path = f'{media_root}/{video}'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(os.urandom(4 * CHUNK))
+
+        genres = Genre.objects.bulk_create([Genre(title=f'Жанр {number}') for number in range(20)])
+        countries = Country.objects.bulk_create([Country(title=f'Страна {number}') for number in range(40)])
+        categories = Category.objects.bulk_create([Category(title=f'Категория {number}') for number in range(12)])
+        crews = FilmCrew.objects.bulk_create([
+            FilmCrew(name=f'Актёр {number}', birth_date='1980-01-01', birthplace='Город', position='Актёр', bio='')
+            for number in range(200)
+        ])
+        Banner.objects.bulk_create([Banner(title='Баннер', banner_image='banner/benchmark.jpg', is_asset=True)])
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Фильм {number}',
+                description=f'Описание фильма {number}',
+                release_date='2020-01-01',
+                production_year=1960 + rng.randrange(65),
+                rating=rng.randint(1, 10),
+                duration=rng.randint(60, 180),
+                poster='poster_image/benchmark.jpg',
+                movie=video,
+                age_rating=rng.choice(['0+', '6+', '12+', '16+', '18+']),
+                is_film=rng.random() < 0.7,
+            )
+            for number in range(options['movies'])
+        ], batch_size=1000)
+        movies = list(Movie.objects.values_list('id', 'is_film'))
+        catalog.movie_ids = [pk for pk, _ in movies]
+        catalog.film_ids = [pk for pk, is_film in movies if is_film]
+        catalog.serial_ids = [pk for pk, is_film in movies if not is_film]
+        catalog.genre_ids = [genre.id for genre in genres]
+        catalog.country_ids = [country.id for country in countries]
+        catalog.category_ids = [category.id for category in categories]
+
+        relations = {
+            'genres': ('genre_id', catalog.genre_ids, 3),
+            'country': ('country_id', catalog.country_ids, 2),
+            'movie_categories': ('category_id', catalog.category_ids, 2),
+            'series_categories': ('category_id', catalog.category_ids, 2),
+            'film_crews': ('filmcrew_id', [crew.id for crew in crews], 6),
+        }
+        for field, (column, values, per_movie) in relations.items():
+            through = getattr(Movie, field).through
+            rows = []
+            for movie_id, is_film in movies:
+                if field.endswith('categories') and (field == 'movie_categories') != is_film:
+                    continue
+                chosen = {rng.choice(values) for _ in range(per_movie)}
+                rows += [through(movie_id=movie_id, **{column: pk}) for pk in chosen]
+            through.objects.bulk_create(rows, batch_size=5000)
+
+        Series.objects.bulk_create([
+            Series(movie_serial_id=serial_id, number=str(number), image='image_serial/benchmark.jpg', series=video)
+            for serial_id in catalog.serial_ids
+            for number in range(1, options['episodes'] + 1)
+        ], batch_size=5000)
+        catalog.episode_ids = list(Series.objects.values_list('id', flat=True))
+
+        # Пароль у всех один — хэшируем его один раз
+        password = make_password(PASSWORD)
+        MyUser.objects.bulk_create([
+            MyUser(username=f'Зритель {number}', phone_number=f'+7{number:010d}', password=password)
+            for number in range(options['users'])
+        ], batch_size=1000)
+        MyUser.objects.create(username='Админ', phone_number='+79999999999', password=password, is_admin=True)
+        users = list(MyUser.objects.filter(is_admin=False))
+        catalog.phone_numbers = [user.phone_number for user in users]
+        catalog.users = users
+        catalog.staff = MyUser.objects.get(is_admin=True)
+
+        pairs = set()
+        limit = min(options['ratings'], len(users) * len(catalog.movie_ids))
+        while len(pairs) < limit:
+            pairs.add((rng.choice(users).id, rng.choice(catalog.movie_ids)))
+        Rating.objects.bulk_create([
+            Rating(user_id=user_id, movie_id=movie_id, score=rng.randint(1, 10)) for user_id, movie_id in pairs
+        ], batch_size=5000)
+        catalog.ratings_by_user = {}
+        for pk, user_id in Rating.objects.values_list('id', 'user_id'):
+            catalog.ratings_by_user.setdefault(user_id, []).append(pk)
+        # Изменять оценки приходят только те, у кого они есть
+        catalog.raters = [user for user in users if user.id in catalog.ratings_by_user]
+
+        favorites = set()
+        limit = min(options['favorites'], len(users) * len(catalog.movie_ids))
+        while len(favorites) < limit:
+            favorites.add((rng.choice(users).id, rng.choice(catalog.movie_ids)))
+        Favorite.objects.bulk_create([Favorite(user_id=u, movie_id=m) for u, m in favorites], batch_size=5000)
+
+        WatchProgress.objects.bulk_create([
+            WatchProgress(user=user, movie_id=rng.choice(catalog.film_ids), position=rng.randrange(5400),
+                          duration=5400, heartbeat_at=timezone.now())
+            for user in users[:200]
+        ], ignore_conflicts=True)
+
+        # bulk_create обходит сигналы — пересчитываем производное
+        rebuild_rating_aggregates()
+        facets.rebuild()
+        search.rebuild_index()
+
+        # Токены такие же, как выдаёт вход: с ролью и версией в claims
+        catalog.tokens = {
+            user.id: str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+            for user in users + [catalog.staff]
+        }
+        return catalog
+
+    def build(self, name, catalog):
+        """Клиентский вызов маршрута: (метод Client, путь, аргументы)."""
+        _, role, builder, _ = ROUTES[name]
+        user = None
+        if role == 'user':
+            pool = catalog.raters if name == 'изменение оценки' else catalog.users
+            user = catalog.rng.choice(pool)
+        elif role == 'staff':
+            user = catalog.staff
+        method, path, kwargs = builder(catalog, user)
+        kwargs = dict(kwargs)
+        if user is not None:
+            kwargs['HTTP_AUTHORIZATION'] = f'Bearer {catalog.tokens[user.id]}'
+        return method, path, kwargs
+
+    def call(self, client, method, path, kwargs):
+        data = kwargs.pop('data', None)
+        response = getattr(client, method)(path, data, **kwargs) if data is not None else getattr(client, method)(path, **kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        else:
+            response.content
+        response.close()
+        return response.status_code
+
+    def run(self, routes, catalog, options):
+        rng = catalog.rng
+        names = list(routes)
+        plan = [name for name in names for _ in range(options['min_per_route'])]
+        remaining = max(options['requests'] - len(plan), 0)
+        plan += rng.choices(names, weights=[routes[name][0] for name in names], k=remaining)
+        rng.shuffle(plan)
+
+        client = Client(raise_request_exception=False)
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # Прогрев: импорты, первые подключения, компиляция шаблонов
+        for name in names:
+            self.call(client, *self.build(name, catalog))
+
+        samples = {name: {'timings': [], 'queries': [], 'errors': set()} for name in names}
+        with connection.execute_wrapper(count_queries):
+            for name in plan:
+                method, path, kwargs = self.build(name, catalog)
+                queries = 0
+                started = time.perf_counter()
+                status = self.call(client, method, path, kwargs)
+                elapsed = time.perf_counter() - started
+                sample = samples[name]
+                sample['timings'].append(elapsed * 1000)
+                sample['queries'].append(queries)
+                if status not in routes[name][3]:
+                    sample['errors'].add(status)
+
+        # Память — отдельным проходом: tracemalloc сильно замедляет запросы
+        memory = {}
+        tracemalloc.start()
+        try:
+            for name in names:
+                peak = 0
+                for _ in range(options['memory_samples']):
+                    method, path, kwargs = self.build(name, catalog)
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    self.call(client, method, path, kwargs)
+                    peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+                memory[name] = peak // 1024
+        finally:
+            tracemalloc.stop()
+
+        results = {}
+        for name in names:
+            timings = sorted(samples[name]['timings'])
+            results[name] = {
+                'requests': len(timings),
+                'p50': round(percentile(timings, 0.5), 2),
+                'p95': round(percentile(timings, 0.95), 2),
+                'p99': round(percentile(timings, 0.99), 2),
+                'queries': max(samples[name]['queries']),
+                'queries_avg': round(sum(samples[name]['queries']) / len(timings), 1),
+                'memory_kb': memory[name],
+                'errors': sorted(samples[name]['errors']),
+            }
+        self.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        return results
+
+    def report(self, results):
+        width = max(len(name) for name in results)
+        self.stdout.write(
+            f'\n{"маршрут":{width}} {"запр.":>6} {"p50 мс":>8} {"p95 мс":>8} {"p99 мс":>8} '
+            f'{"SQL ср.":>8} {"SQL макс":>8} {"пик КБ":>8}'
+        )
+        for name, result in results.items():
+            line = (
+                f'{name:{width}} {result["requests"]:6} {result["p50"]:8.2f} {result["p95"]:8.2f} '
+                f'{result["p99"]:8.2f} {result["queries_avg"]:8.1f} {result["queries"]:8} {result["memory_kb"]:8}'
+            )
+            if result['errors']:
+                line += self.style.ERROR(f'  статусы {result["errors"]}')
+            self.stdout.write(line)
+        self.stdout.write(f'\nПиковый RSS процесса: {self.max_rss} МБ')
+
+    def compare(self, results, config, options):
+        with open(options['baseline'], encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('config') != config:
+            self.stdout.write(self.style.WARNING(
+                f'Параметры прогона отличаются от базы: {baseline.get("config")} — сравнение приблизительное'
+            ))
+
+        tolerance = options['tolerance']
+        failures = []
+        for name, result in results.items():
+            before = baseline['routes'].get(name)
+            if before is None:
+                continue
+            if result['queries'] > before['queries']:
+                failures.append(f'{name}: SQL-запросов {before["queries"]} -> {result["queries"]}')
+            if (result['p95'] > before['p95'] * (1 + tolerance)
+                    and result['p95'] - before['p95'] > options['min_delta_ms']):
+                failures.append(f'{name}: p95 {before["p95"]} -> {result["p95"]} мс')
+            if result['memory_kb'] > before['memory_kb'] * (1 + tolerance) and result['memory_kb'] - before['memory_kb'] > 64:
+                failures.append(f'{name}: пик памяти {before["memory_kb"]} -> {result["memory_kb"]} КБ')
+        if not failures:
+            self.stdout.write(self.style.SUCCESS(f'Регрессий относительно {options["baseline"]} нет'))
+        return failures
@@ -0,0 +1,168 @@
+import asyncio
+import io
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from product.models import Banner, Genre, Movie
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность синхронных вьюх под WSGI (пул потоков) и асинхронных '
+        'под ASGI на главной, карточке фильма и фильтре по жанру. Запросы идут напрямую в '
+        'обработчики Django, без сети. Работает во временной тестовой базе, кэш ответов отключён.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на каждый эндпоинт')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Одновременных запросов (и потоков WSGI-воркера)')
+        parser.add_argument('--db-latency', type=float, default=0.0,
+                            help='Искусственная задержка каждого SQL-запроса, мс (имитация сетевой БД)')
+
+    def handle(self, *args, movies, requests, concurrency, db_latency, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        latency = db_latency / 1000
+
+        def slow_execute(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_execute)
+
+        try:
+            movie_id, genre_id = self.seed(movies)
+            endpoints = (
+                ('главная', 'index/', 'limit=20'),
+                ('карточка', f'index/{movie_id}/', ''),
+                ('жанр', f'genre/{genre_id}/', 'page_size=20&ordering=-rating'),
+            )
+            cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            with override_settings(CACHES=cache, DEBUG=False, ALLOWED_HOSTS=['*']):
+                if latency:
+                    connection_created.connect(add_latency)
+                wsgi, asgi = get_wsgi_application(), get_asgi_application()
+                # Построчный лог метрик каждого запроса здесь только мешает
+                # (уровень ставим после django.setup() внутри get_*_application)
+                logging.getLogger('core.instrumentation').setLevel(logging.WARNING)
+                self.stdout.write(
+                    f'Фильмов: {movies}, запросов: {requests}, одновременно: {concurrency}, '
+                    f'задержка БД: {db_latency} мс'
+                )
+                for name, path, query in endpoints:
+                    sync_rps, sync_p50, sync_p95 = self.run_wsgi(wsgi, f'/api/{path}', query, requests, concurrency)
+                    async_rps, async_p50, async_p95 = asyncio.run(
+                        self.run_asgi(asgi, f'/api/async/{path}', query, requests, concurrency)
+                    )
+                    self.stdout.write(
+                        f'  {name:10} WSGI {sync_rps:8.1f} запр/с p50={sync_p50:7.1f}мс p95={sync_p95:7.1f}мс | '
+                        f'ASGI {async_rps:8.1f} запр/с p50={async_p50:7.1f}мс p95={async_p95:7.1f}мс'
+                    )
+        finally:
+            connection_created.disconnect(add_latency)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, count):
+        genre = Genre.objects.create(title='Жанр')
+        # bulk_create — чтобы сигналы не ставили генерацию картинок несуществующего файла
+        Banner.objects.bulk_create([Banner(title='Баннер', banner_image='banner/benchmark.jpg', is_asset=True)])
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Фильм {number}',
+                description='',
+                release_date='2020-01-01',
+                production_year=2020,
+                rating=number % 10,
+                duration=90,
+                poster='poster_image/benchmark.jpg',
+                age_rating='16+',
+                is_film=True,
+            )
+            for number in range(count)
+        ])
+        ids = list(Movie.objects.values_list('id', flat=True))
+        Movie.genres.through.objects.bulk_create([
+            Movie.genres.through(movie_id=pk, genre_id=genre.id) for pk in ids
+        ])
+        return ids[0], genre.id
+
+    def summary(self, timings, elapsed):
+        timings.sort()
+        return (
+            len(timings) / elapsed,
+            statistics.median(timings) * 1000,
+            timings[int(len(timings) * 0.95) - 1] * 1000,
+        )
+
+    def run_wsgi(self, application, path, query, requests, concurrency):
+        def call():
+            environ = {
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': path,
+                'QUERY_STRING': query,
+                'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'wsgi.input': io.BytesIO(),
+                'wsgi.url_scheme': 'http',
+            }
+            started = time.perf_counter()
+            result = application(environ, lambda status, headers: None)
+            b''.join(result)
+            result.close()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            started = time.perf_counter()
+            timings = list(pool.map(lambda _: call(), range(requests)))
+            return self.summary(timings, time.perf_counter() - started)
+
+    async def run_asgi(self, application, path, query, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'query_string': query.encode(),
+            'headers': [],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 0),
+        }
+
+        async def call():
+            received = asyncio.Event()
+
+            async def receive():
+                # Тело запроса отдаём один раз, дальше «клиент» просто ждёт
+                if received.is_set():
+                    await asyncio.Event().wait()
+                received.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                pass
+
+            async with semaphore:
+                started = time.perf_counter()
+                await application(dict(scope), receive, send)
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(call() for _ in range(requests)))
+        return self.summary(list(timings), time.perf_counter() - started)
@@ -0,0 +1,96 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from product.models import Movie, WatchProgress
+from product.progress import ProgressBuffer, upsert
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность отметок прогресса просмотра: запись каждой отметки '
+        'против буфера с пакетным сбросом. Работает во временной тестовой базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--movies', type=int, default=200)
+        parser.add_argument('--heartbeats', type=int, default=50000)
+        parser.add_argument('--flush-every', type=int, default=10000,
+                            help='Сколько отметок принимать между сбросами буфера')
+
+    def handle(self, *args, users, movies, heartbeats, flush_every, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user_ids, movie_ids = self.seed(users, movies)
+            rng = random.Random(0)
+            ticks = [
+                (rng.choice(user_ids), rng.choice(movie_ids), rng.randint(0, 5400))
+                for _ in range(heartbeats)
+            ]
+
+            started = time.perf_counter()
+            for user_id, movie_id, position in ticks:
+                upsert([self.entry(user_id, movie_id, position)])
+            direct = time.perf_counter() - started
+            WatchProgress.objects.all().delete()
+
+            buffer = ProgressBuffer()
+            started = time.perf_counter()
+            flushes = rows = 0
+            for number, (user_id, movie_id, position) in enumerate(ticks, 1):
+                # Без фонового потока: сбрасываем вручную, чтобы замер был воспроизводимым
+                with buffer.lock:
+                    buffer.pending[(user_id, movie_id)] = self.entry(user_id, movie_id, position)
+                if number % flush_every == 0:
+                    rows += buffer.flush()
+                    flushes += 1
+            rows += buffer.flush()
+            flushes += 1
+            buffered = time.perf_counter() - started
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'Отметок: {heartbeats}, пользователей: {users}, фильмов: {movies}')
+        self.stdout.write(f'  по одной записи: {heartbeats / direct:10.0f} отметок/с ({heartbeats} upsert)')
+        self.stdout.write(
+            f'  буфер:           {heartbeats / buffered:10.0f} отметок/с '
+            f'({flushes} сбросов, {rows} строк записано)'
+        )
+
+    def entry(self, user_id, movie_id, position):
+        return {
+            'user': user_id,
+            'movie': movie_id,
+            'series': None,
+            'position': position,
+            'duration': 5400,
+            'heartbeat_at': timezone.now(),
+        }
+
+    def seed(self, users, movies):
+        User = get_user_model()
+        User.objects.bulk_create([
+            User(username=f'bench{number}', phone_number=f'+7{number:010d}', password='!')
+            for number in range(users)
+        ])
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Фильм {number}',
+                description='',
+                release_date='2020-01-01',
+                production_year=2020,
+                rating=5,
+                duration=90,
+                poster='poster_image/benchmark.jpg',
+                age_rating='16+',
+                is_film=True,
+            )
+            for number in range(movies)
+        ])
+        return list(User.objects.values_list('id', flat=True)), list(Movie.objects.values_list('id', flat=True))
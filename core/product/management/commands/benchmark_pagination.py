@@ -0,0 +1,103 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from product.models import Genre, Movie
+from product.pagination import MovieKeysetPagination
+from product.views import GenreFilterView
+
+
+class OffsetPagination(PageNumberPagination):
+    """Прежняя постраничная выдача: COUNT и OFFSET на каждой странице."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100000
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку первой и глубокой страницы фильтра по жанру: OFFSET-пагинация '
+        'против keyset. Работает во временной тестовой базе, рабочие данные не затрагиваются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--pages', default='1,100,1000,10000', help='Номера страниц через запятую')
+        parser.add_argument('--ordering', default='-rating', help='Сортировка, как в ?ordering=')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, page_size, pages, ordering, repeat, **options):
+        pages = sorted(int(page) for page in pages.split(','))
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            genre = self.seed(pages[-1] * page_size + page_size)
+            offset_view = GenreFilterView.as_view(pagination_class=OffsetPagination)
+            keyset_view = GenreFilterView.as_view(pagination_class=MovieKeysetPagination)
+            path = f'/api/genre/{genre.id}/'
+            base = {'page_size': page_size, 'ordering': ordering}
+            queryset = Movie.objects.filter(genres__id=genre.id).order_by(
+                ordering, '-id' if ordering.startswith('-') else 'id'
+            )
+
+            self.stdout.write(f'Фильмов: {queryset.count()}, страница: {page_size}, сортировка: {ordering}')
+            cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            with override_settings(CACHES=cache, ALLOWED_HOSTS=['*']):
+                for page in pages:
+                    offset_p50, offset_p95 = self.measure(offset_view, path, {**base, 'page': page}, genre, repeat)
+                    params = dict(base)
+                    if page > 1:
+                        # Курсор глубокой страницы — последняя строка предыдущей
+                        paginator = MovieKeysetPagination()
+                        paginator.ordering = ordering
+                        params['cursor'] = paginator.make_cursor(queryset[(page - 1) * page_size - 1], reverse=False)
+                    keyset_p50, keyset_p95 = self.measure(keyset_view, path, params, genre, repeat)
+                    self.stdout.write(
+                        f'  стр. {page:6} OFFSET p50={offset_p50:8.2f}мс p95={offset_p95:8.2f}мс | '
+                        f'keyset p50={keyset_p50:8.2f}мс p95={keyset_p95:8.2f}мс'
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, count, batch_size=10000):
+        genre = Genre.objects.create(title='Жанр')
+        for offset in range(0, count, batch_size):
+            Movie.objects.bulk_create([
+                Movie(
+                    title=f'Фильм {number}',
+                    description='',
+                    release_date='2020-01-01',
+                    production_year=1950 + number % 75,
+                    rating=1 + number % 10,
+                    duration=90,
+                    poster='poster_image/benchmark.jpg',
+                    age_rating='16+',
+                    is_film=True,
+                )
+                for number in range(offset, min(offset + batch_size, count))
+            ])
+        through = Movie.genres.through
+        ids = Movie.objects.values_list('id', flat=True)
+        through.objects.bulk_create(
+            [through(movie_id=pk, genre_id=genre.id) for pk in ids.iterator()], batch_size=batch_size
+        )
+        return genre
+
+    def measure(self, view, path, params, genre, repeat):
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(repeat):
+            request = factory.get(path, params)
+            started = time.perf_counter()
+            response = view(request, genre_id=genre.id)
+            response.render()
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path} {params}: {response.status_code}')
+        timings.sort()
+        return statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]
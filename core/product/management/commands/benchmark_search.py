@@ -0,0 +1,100 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from product.models import Movie
+from product.search import rebuild_index, search_movie_ids
+
+
+SYLLABLES = (
+    'ка', 'ро', 'ми', 'ту', 'не', 'ла', 'со', 'ри', 'да', 'ве', 'по', 'зе', 'ны', 'гу', 'шо', 'ле',
+    'ba', 'ko', 'ri', 'ta', 'ne', 'lo', 'mi', 'su', 'da', 've',
+)
+
+
+def make_vocabulary(rng, size=20000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_queries(rng, vocabulary):
+    word, other, typo = rng.sample([w for w in vocabulary if len(w) >= 6], 3)
+    return (
+        word,  # точное слово
+        word[:3],  # префикс
+        f'{word} {other}',  # два слова
+        typo[:2] + typo[3:],  # опечатка
+        'отсутствует',  # нет совпадений
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку полнотекстового поиска с title__icontains на синтетическом каталоге. '
+        'Работает во временной тестовой базе, рабочие данные не затрагиваются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help='Размеры каталога через запятую')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, sizes, repeat, **options):
+        sizes = sorted(int(size) for size in sizes.split(','))
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            rng = random.Random(0)
+            vocabulary = make_vocabulary(rng)
+            queries = make_queries(rng, vocabulary)
+            created = 0
+            for size in sizes:
+                self.seed(rng, vocabulary, created, size)
+                created = size
+                rebuild_index()
+                self.report(size, queries, repeat)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, rng, vocabulary, start, stop, batch_size=5000):
+        for offset in range(start, stop, batch_size):
+            Movie.objects.bulk_create([
+                Movie(
+                    title=' '.join(rng.choices(vocabulary, k=3)),
+                    description=' '.join(rng.choices(vocabulary, k=30)),
+                    release_date='2020-01-01',
+                    production_year=rng.randint(1950, 2024),
+                    rating=rng.randint(1, 10),
+                    duration=90,
+                    poster='poster_image/benchmark.jpg',
+                    age_rating='16+',
+                    is_film=rng.random() < 0.7,
+                )
+                for _ in range(min(batch_size, stop - offset))
+            ])
+
+    def measure(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+    def report(self, size, queries, repeat):
+        self.stdout.write(f'\nКаталог: {size} фильмов')
+        for query in queries:
+            index_p50, index_p95 = self.measure(lambda: search_movie_ids(query, limit=50), repeat)
+            scan_p50, scan_p95 = self.measure(
+                lambda: list(Movie.objects.filter(title__icontains=query).order_by('-id').values_list('id', flat=True)[:50]),
+                repeat,
+            )
+            self.stdout.write(
+                f'  {query!r:20} индекс p50={index_p50:7.2f}мс p95={index_p95:7.2f}мс | '
+                f'icontains p50={scan_p50:7.2f}мс p95={scan_p95:7.2f}мс'
+            )
@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from product.models import Movie
+from product.renderers import ColumnarJSONRenderer
+from product.serializers import MovieIndexSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает сборку страницы списка фильмов: ModelSerializer по объектам модели против '
+        'быстрого пути по строкам values_list, и размер/время вывода в JSON и колоночном JSON. '
+        'Работает во временной тестовой базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--rounds', type=int, default=200)
+
+    def handle(self, *args, movies, page_size, rounds, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.seed(movies)
+            context = {'request': RequestFactory().get('/api/movies/')}
+            serializer_class = MovieIndexSerializer
+            queryset = Movie.objects.order_by('-id')
+
+            def model_page():
+                page = list(serializer_class.setup_eager_loading(queryset)[:page_size])
+                return serializer_class(page, many=True, context=context).data
+
+            def values_page():
+                page = list(queryset.values_list(*serializer_class.get_values_columns(), named=True)[:page_size])
+                return serializer_class(page, many=True, context=context).data
+
+            with override_settings(ALLOWED_HOSTS=['*']):
+                if model_page() != values_page():
+                    self.stderr.write('Быстрый путь вывел другие данные')
+                    return
+                model_time = self.measure(model_page, rounds)
+                values_time = self.measure(values_page, rounds)
+                data = {'next': None, 'previous': None, 'results': model_page()}
+
+            outputs = {}
+            for renderer in (JSONRenderer(), ColumnarJSONRenderer()):
+                outputs[renderer.format] = (
+                    self.measure(lambda: renderer.render(data), rounds),
+                    len(renderer.render(data)),
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f'Фильмов: {movies}, страница: {page_size}, повторов: {rounds}')
+        self.stdout.write(f'  ModelSerializer: {model_time * 1000:8.2f} мс/страница')
+        self.stdout.write(
+            f'  values_list:     {values_time * 1000:8.2f} мс/страница '
+            f'(x{model_time / values_time:.2f})'
+        )
+        for name, (seconds, size) in outputs.items():
+            self.stdout.write(f'  вывод {name:9}  {seconds * 1000:8.2f} мс, {size} байт')
+
+    def measure(self, func, rounds):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        return (time.perf_counter() - started) / rounds
+
+    def seed(self, movies):
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Фильм {number}',
+                description='',
+                release_date='2020-01-01',
+                production_year=2020,
+                rating=5,
+                duration=90,
+                poster=f'poster_image/benchmark{number}.jpg',
+                age_rating='16+',
+                is_film=True,
+            )
+            for number in range(movies)
+        ])
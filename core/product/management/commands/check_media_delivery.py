@@ -0,0 +1,147 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from PIL import Image
+
+from product import url_signing
+from product.delivery import BACKENDS, emulate_front_server
+from product.models import Movie, Series
+from user.models import MyUser
+from user.serializers import ClaimsTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет отдачу медиафайлов во всех режимах MEDIA_DELIVERY: ответы nginx/sendfile '
+        'прогоняются через эмуляцию фронт-сервера и должны совпасть с отдачей самим Django '
+        '(статус, Content-Range, байты). Показывает, сколько времени запрос занимает воркер. '
+        'Работает во временной тестовой базе и временном MEDIA_ROOT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=32, help='Размер тестового видеофайла')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, size_mb, repeat, **options):
+        # Ожидаемые 401/404 не должны засорять вывод
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        media_root = tempfile.mkdtemp(prefix='media-delivery-')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*'], HLS_AUTO_ENQUEUE=False,
+                                   IMAGE_DERIVATIVE_WIDTHS=()):
+                cases = self.seed(media_root, size_mb)
+                results = {backend: self.run(backend, cases, repeat) for backend in BACKENDS}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        expected = results['django']
+        failures = []
+        self.stdout.write(f'Видеофайл: {size_mb} МБ, повторов: {repeat}')
+        self.stdout.write(f'{"случай":28} ' + ' '.join(f'{backend:>18}' for backend in BACKENDS))
+        for label in cases:
+            cells = []
+            for backend in BACKENDS:
+                outcome, worker = results[backend][label]
+                if outcome != expected[label][0]:
+                    failures.append(f'{backend}: {label}: {outcome[:2]} вместо {expected[label][0][:2]}')
+                cells.append(f'{outcome[0]} {worker * 1000:10.2f} мс')
+            self.stdout.write(f'{label:28} ' + ' '.join(f'{cell:>18}' for cell in cells))
+        self.stdout.write('Время — сколько запрос держит воркер Python (без передачи фронт-сервером).')
+        if failures:
+            raise CommandError('\n'.join(['Ответы различаются:', *failures]))
+
+    def seed(self, media_root, size_mb):
+        # Настоящая картинка: сигналы постера строят её уменьшенные копии
+        poster = io.BytesIO()
+        Image.new('RGB', (64, 64)).save(poster, 'JPEG')
+        files = {
+            'media/movie_film/check.mp4': os.urandom(size_mb * 1024 * 1024),
+            'media/series/check.mp4': os.urandom(1024 * 1024),
+            'poster_image/check.jpg': poster.getvalue(),
+            'uploads/check.part': b'\0' * 1024,
+        }
+        for name, data in files.items():
+            path = os.path.join(media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(data)
+
+        fields = {
+            'description': '', 'release_date': '2020-01-01', 'production_year': 2020, 'rating': 5,
+            'duration': 90, 'poster': 'poster_image/check.jpg',
+        }
+        movie = Movie.objects.create(title='Фильм', movie='media/movie_film/check.mp4', age_rating='16+',
+                                     is_film=True, **fields)
+        adult = Movie.objects.create(title='Фильм 18+', movie='media/movie_film/check.mp4', age_rating='18+',
+                                     is_film=True, **fields)
+        serial = Movie.objects.create(title='Сериал', age_rating='12+', is_film=False, **fields)
+        series = Series.objects.create(movie_serial=serial, number='1', image='poster_image/check.jpg',
+                                       series='media/series/check.mp4')
+        hls = os.path.join(media_root, 'hls', 'movie', str(movie.id), 'master.m3u8')
+        os.makedirs(os.path.dirname(hls), exist_ok=True)
+        with open(hls, 'w') as playlist:
+            playlist.write('#EXTM3U\n')
+
+        user = MyUser.objects.create_user(phone_number='+70000000000', username='check', password='!')
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {ClaimsTokenObtainPairSerializer.get_token(user).access_token}'}
+        video = '/media/media/movie_film/check.mp4'
+        return {
+            'постер, аноним': ('/media/poster_image/check.jpg', {}),
+            'видео целиком': (video, auth),
+            'видео, Range': (video, {**auth, 'HTTP_RANGE': 'bytes=1000-1999'}),
+            'видео, несколько Range': (video, {**auth, 'HTTP_RANGE': 'bytes=0-9,100-199'}),
+            'видео, Range за концом': (video, {**auth, 'HTTP_RANGE': f'bytes={size_mb * 1024 * 1024}-'}),
+            'видео, аноним': (video, {}),
+            'подписанная ссылка, Range': (
+                f'/media/{url_signing.sign("media/movie_film/check.mp4", user.id)}', {'HTTP_RANGE': 'bytes=0-65535'}
+            ),
+            'поддельная подпись': (f'/media/signed/1.{user.id}.0.x/media/movie_film/check.mp4', {}),
+            'просмотр фильма': (f'/api/movies/{movie.id}/watch/', {**auth, 'HTTP_RANGE': 'bytes=0-65535'}),
+            'просмотр серии': (f'/api/series/{series.id}/watch/', auth),
+            'фильм 18+, аноним': (f'/api/movies/{adult.id}/watch/', {}),
+            'HLS-плейлист': (f'/media/hls/movie/{movie.id}/master.m3u8', auth),
+            'недокачанная загрузка': ('/media/uploads/check.part', auth),
+            'выход за MEDIA_ROOT': ('/media/poster_image/..%2F..%2Fmanage.py', auth),
+        }
+
+    def run(self, backend, cases, repeat):
+        """{случай: ((статус, Content-Range, байты), среднее время воркера)}."""
+        client = Client(raise_request_exception=False)
+        results = {}
+        with override_settings(MEDIA_DELIVERY=backend):
+            for label, (path, headers) in cases.items():
+                worker = 0
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    response = client.get(path, **headers)
+                    if backend == 'django':
+                        # Без фронт-сервера байты передаёт сам воркер
+                        body = self.read(response)
+                        worker += time.perf_counter() - started
+                    else:
+                        worker += time.perf_counter() - started
+                        response = emulate_front_server(response.wsgi_request, response)
+                        body = self.read(response)
+                    outcome = (response.status_code, response.get('Content-Range'), body)
+                    response.close()
+                results[label] = (outcome, worker / repeat)
+        return results
+
+    def read(self, response):
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        if response.get('Content-Type', '').startswith('multipart/byteranges'):
+            # Граница частей случайна — сравниваем без неё
+            boundary = response['Content-Type'].split('boundary=')[1].encode()
+            content = content.replace(boundary, b'')
+        return content
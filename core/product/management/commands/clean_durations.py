@@ -0,0 +1,72 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from product.models import Movie
+
+
+HOURS = re.compile(r'(\d+)\s*(?:ч|h)', re.IGNORECASE)
+MINUTES = re.compile(r'(\d+)\s*(?:м|m)', re.IGNORECASE)
+CLOCK = re.compile(r'^(\d+):(\d{1,2})(?::\d{1,2})?$')
+NUMBER = re.compile(r'\d+')
+
+
+def parse_duration(value):
+    """
+    Минуты из старого текстового значения: «120», «120 мин», «1 ч 30 мин»,
+    «1h30m», «1:30». None — если числа в строке нет.
+    """
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    clock = CLOCK.match(value)
+    if clock:
+        return int(clock[1]) * 60 + int(clock[2])
+    hours, minutes = HOURS.search(value), MINUTES.search(value)
+    if hours:
+        return int(hours[1]) * 60 + (int(minutes[1]) if minutes else 0)
+    number = NUMBER.search(value)
+    return int(number[0]) if number else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Приводит продолжительность фильмов к целому числу минут. Поле duration было строкой и стало '
+        'PositiveIntegerField; миграции в репозитории не хранятся, поэтому порядок такой: '
+        'запустить эту команду на старой схеме, затем makemigrations и migrate. На Postgres '
+        'смена типа идёт через USING duration::integer и падает на первом нечисловом значении; '
+        'SQLite пропустит строку как есть. Команда читает столбец сырым SQL, поэтому работает и '
+        'до, и после смены типа; на уже чистых данных ничего не меняет.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--default', type=int, default=0,
+                            help='Значение для строк без числа (по умолчанию 0)')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет изменено')
+
+    def handle(self, *args, default, dry_run, **options):
+        table = connection.ops.quote_name(Movie._meta.db_table)
+        column = connection.ops.quote_name(Movie._meta.get_field('duration').column)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id, {column} FROM {table}')
+            rows = cursor.fetchall()
+
+        changes = []
+        for pk, value in rows:
+            if isinstance(value, int):
+                continue
+            minutes = parse_duration(value)
+            if minutes is None:
+                self.stderr.write(f'Фильм {pk}: не разобрано {value!r}, ставим {default}')
+                minutes = default
+            if str(minutes) != str(value):
+                changes.append((pk, value, minutes))
+
+        for pk, value, minutes in changes:
+            self.stdout.write(f'Фильм {pk}: {value!r} -> {minutes}')
+        if not dry_run:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(f'UPDATE {table} SET {column} = %s WHERE id = %s',
+                                   [(minutes, pk) for pk, _, minutes in changes])
+        self.stdout.write(f'{"Будет исправлено" if dry_run else "Исправлено"} фильмов: {len(changes)}')
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.recommendations import compute_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рекомендации «похожие фильмы» (нужны numpy и scipy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=None, help='Сколько соседей хранить для каждого фильма')
+
+    def handle(self, *args, top_k, **options):
+        started = time.perf_counter()
+        total = compute_recommendations(top_k=top_k)
+        self.stdout.write(f'Посчитано фильмов: {total} за {time.perf_counter() - started:.1f} с')
@@ -0,0 +1,178 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from product.models import Category, Country, Genre, Movie, Series
+from product.pagination import MovieKeysetPagination
+from product.views import (
+    CountryFilterView, GenreFilterView, MovieCategoryFilterView, SerialListView, SeriesCategoryFilterView,
+)
+
+
+# Признаки отдельной сортировки в плане SQLite и Postgres
+SORT_MARKERS = ('TEMP B-TREE FOR ORDER BY', 'Sort Key')
+
+# (название, вьюха, параметр пути, параметры запроса, индексы — в плане должен быть хотя бы один,
+#  страница читается по порядку индекса без сортировки)
+HOT_QUERIES = (
+    ('категория фильмов, новые', MovieCategoryFilterView, 'category_id', {}, ['movie_film_id_idx'], True),
+    ('категория фильмов, по рейтингу', MovieCategoryFilterView, 'category_id', {'ordering': '-rating'},
+     ['movie_film_rating_idx'], True),
+    ('категория фильмов, по средней оценке', MovieCategoryFilterView, 'category_id',
+     {'ordering': '-rating_average'}, ['movie_film_avg_idx'], True),
+    ('категория фильмов, по дате', MovieCategoryFilterView, 'category_id', {'ordering': '-created_date'},
+     ['movie_film_created_idx'], True),
+    ('категория фильмов, по названию', MovieCategoryFilterView, 'category_id', {'ordering': 'title'},
+     ['movie_film_title_idx'], True),
+    ('категория сериалов, по рейтингу', SeriesCategoryFilterView, 'category_id', {'ordering': '-rating'},
+     ['movie_serial_rating_idx'], True),
+    ('жанр, фильмы по году', GenreFilterView, 'genre_id', {'is_film': 'True', 'ordering': '-production_year'},
+     ['movie_film_year_idx'], True),
+    ('жанр, сериалы по рейтингу, глубокая страница', GenreFilterView, 'genre_id',
+     {'is_film': 'False', 'ordering': '-rating', 'cursor': True}, ['movie_serial_rating_idx'], True),
+    ('жанр без типа, по рейтингу', GenreFilterView, 'genre_id', {'ordering': '-rating'},
+     ['product_movie_genres_genre_id'], False),
+    ('жанр, фильтр по дате создания', GenreFilterView, 'genre_id', {'created_date': True}, ['movie_created_idx'], False),
+    ('страна, фильмы по средней оценке', CountryFilterView, 'pk', {'is_film': 'True', 'ordering': '-rating_average'},
+     ['movie_film_avg_idx'], True),
+    ('серии сериала', SerialListView, 'movie_id', {}, ['series_movie_serial_idx'], True),
+)
+
+
+def build_queryset(view_class, kwarg, params, ids):
+    """Queryset страницы так, как его собирает вьюха: фильтры, план загрузки, keyset."""
+    params = dict(params)
+    if params.get('created_date'):
+        params['created_date'] = ids['created_date']
+    cursor = params.pop('cursor', False)
+    kwargs = {kwarg: ids[view_class]}
+
+    view = view_class()
+    request = view.initialize_request(APIRequestFactory().get('/', params))
+    view.request, view.args, view.kwargs, view.format_kwarg = request, (), kwargs, None
+    queryset = view.filter_queryset(view.get_queryset())
+
+    paginator = view.paginator
+    if not isinstance(paginator, MovieKeysetPagination):
+        return queryset
+    if cursor:
+        # Курсор из середины выборки — как при переходе на глубокую страницу
+        paginator.ordering = paginator.get_ordering(queryset)
+        field = paginator.ordering.lstrip('-')
+        middle = paginator.with_cursor_field(queryset, field)[queryset.count() // 2]
+        params['cursor'] = paginator.make_cursor(middle, reverse=False)
+        request = view.initialize_request(APIRequestFactory().get('/', params))
+    return paginator.prepare(queryset, request)
+
+
+def seed(count, batch_size=5000):
+    rng = random.Random(0)
+    genres = Genre.objects.bulk_create([Genre(title=f'Жанр {number}') for number in range(20)])
+    countries = Country.objects.bulk_create([Country(title=f'Страна {number}') for number in range(30)])
+    categories = Category.objects.bulk_create([Category(title=f'Категория {number}') for number in range(10)])
+    for offset in range(0, count, batch_size):
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Фильм {rng.randrange(count)}',
+                description='',
+                release_date='2020-01-01',
+                production_year=1950 + rng.randrange(75),
+                rating=rng.randint(1, 10),
+                rating_average=rng.random() * 10,
+                duration=rng.randint(60, 180),
+                poster='poster_image/benchmark.jpg',
+                age_rating='16+',
+                is_film=rng.random() < 0.7,
+            )
+            for _ in range(offset, min(offset + batch_size, count))
+        ])
+
+    movies = list(Movie.objects.values_list('id', 'is_film'))
+    relations = {
+        'genres': ('genre_id', genres, 3),
+        'country': ('country_id', countries, 2),
+        'movie_categories': ('category_id', categories, 2),
+        'series_categories': ('category_id', categories, 2),
+    }
+    for field, (column, values, per_movie) in relations.items():
+        through = getattr(Movie, field).through
+        rows = []
+        for movie_id, is_film in movies:
+            if (field == 'movie_categories') != is_film and field.endswith('categories'):
+                continue
+            # Первое значение — у каждого фильма, чтобы у него была большая выборка
+            chosen = {values[0].id} | {rng.choice(values).id for _ in range(per_movie - 1)}
+            rows += [through(movie_id=movie_id, **{column: pk}) for pk in chosen]
+        through.objects.bulk_create(rows, batch_size=batch_size)
+
+    serial_id = next(movie_id for movie_id, is_film in movies if not is_film)
+    Series.objects.bulk_create([
+        Series(movie_serial_id=movie_id, number=str(number), image='image_serial/benchmark.jpg', series='')
+        for movie_id, is_film in movies if not is_film
+        for number in range(1, 4)
+    ], batch_size=batch_size)
+
+    # Планировщику нужна статистика, иначе на свежих таблицах он выбирает наугад
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    return {
+        MovieCategoryFilterView: categories[0].id,
+        SeriesCategoryFilterView: categories[0].id,
+        GenreFilterView: genres[0].id,
+        CountryFilterView: countries[0].id,
+        SerialListView: serial_id,
+        'created_date': Movie.objects.values_list('created_date', flat=True).first().isoformat(),
+    }
+
+
+def check_plan(plan, indexes, presorted):
+    """Промахи плана: нет ни одного из индексов или вся выборка сортируется."""
+    problems = []
+    # Пустой список — тоже промах: случай без ожидаемого индекса ничего не проверяет
+    if not any(index in plan for index in indexes):
+        problems.append('нет индекса ' + ' / '.join(indexes))
+    if presorted and any(marker in plan for marker in SORT_MARKERS):
+        problems.append('сортировка всей выборки')
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает EXPLAIN горячих запросов каталога (списки по категориям, жанрам, странам и '
+        'серии сериала) в том виде, в каком их строят вьюхи, и проверяет, что каждый идёт по '
+        'ожидаемому индексу и, где нужно, читает страницу без сортировки. Работает во временной тестовой базе (SQLite или Postgres); '
+        'при промахе завершается с ошибкой. Те же случаи на меньшей выборке проверяет '
+        'product.tests.HotQueryPlanTests.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=20000)
+
+    def handle(self, *args, movies, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        failed = []
+        try:
+            ids = seed(movies)
+            self.stdout.write(f'База: {connection.vendor}, фильмов: {movies}')
+            with override_settings(ALLOWED_HOSTS=['*']):
+                for name, view_class, kwarg, params, indexes, presorted in HOT_QUERIES:
+                    plan = build_queryset(view_class, kwarg, params, ids).explain()
+                    problems = check_plan(plan, indexes, presorted)
+                    if problems:
+                        failed.append(name)
+                        status = self.style.ERROR('ПРОМАХ: ' + ', '.join(problems))
+                    else:
+                        status = self.style.SUCCESS('OK')
+                    self.stdout.write(f'\n{status} {name}')
+                    for line in plan.splitlines():
+                        self.stdout.write(f'    {line}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if failed:
+            raise CommandError(f'Запросы без ожидаемого плана: {", ".join(failed)}')
@@ -0,0 +1,31 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.catalog_io import export_csv, export_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Выгружает каталог в JSONL или CSV (потоково, пачками)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help='Путь к файлу или - для stdout')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, output, format, batch_size, **options):
+        chunks = export_csv(batch_size) if format == 'csv' else export_jsonl(batch_size)
+        started = time.perf_counter()
+        rows = -1 if format == 'csv' else 0  # без строки заголовка
+        stream = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+                rows += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f'Строк: {rows}, {rows / elapsed:.0f} строк/с' if elapsed else f'Строк: {rows}')
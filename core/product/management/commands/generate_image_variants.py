@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from product import images
+from product.signals import IMAGE_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии (WebP/AVIF/JPEG) для уже загруженных картинок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать даже готовые копии')
+
+    def handle(self, *args, force, **options):
+        generated = failed = 0
+        for model, field in IMAGE_FIELDS.items():
+            names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values_list(field, flat=True)
+            for name in names.distinct().iterator():
+                if not force and images.is_ready(name, use_cache=False):
+                    continue
+                try:
+                    images.generate(name)
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{name}: {exc}')
+                    continue
+                generated += 1
+        self.stdout.write(f'Готово: {generated}, ошибок: {failed}')
@@ -0,0 +1,32 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from product.catalog_io import import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Импортирует каталог из JSONL или CSV (потоково, пачками)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу или - для stdin')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), default=None, help='По умолчанию — по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, path, format, batch_size, **options):
+        file_format = format or ('csv' if path.endswith('.csv') else 'jsonl')
+        if path == '-':
+            stats = import_catalog(sys.stdin, file_format, batch_size)
+        else:
+            with open(path, encoding='utf-8', newline='') as stream:
+                stats = import_catalog(stream, file_format, batch_size)
+
+        result = stats.as_dict()
+        for error in result['errors']:
+            self.stderr.write(f"Строка {error['line']}: {error['error']}")
+        self.stdout.write(json.dumps(
+            {key: value for key, value in result.items() if key != 'errors'},
+            ensure_ascii=False,
+        ))
+
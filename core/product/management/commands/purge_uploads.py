@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from product.models import ChunkedUpload
+from product.uploads import get_expire_hours
+
+
+class Command(BaseCommand):
+    help = 'Удаляет незавершённые загрузки по частям, которые давно не получали кусков, вместе с их файлами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None,
+                            help='По умолчанию — UPLOAD_EXPIRE_HOURS')
+
+    def handle(self, *args, hours, **options):
+        hours = get_expire_hours() if hours is None else hours
+        expired = ChunkedUpload.objects.filter(
+            status=ChunkedUpload.UPLOADING,
+            updated_date__lt=timezone.now() - timedelta(hours=hours),
+        )
+        # delete() по объектам: файлы кусков удаляет сигнал post_delete
+        deleted, _ = expired.delete()
+        self.stdout.write(f'Удалено загрузок: {deleted}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.facets import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики фасетов (жанры, страны, категории, типы) по текущим данным'
+
+    def handle(self, *args, **options):
+        rows = rebuild()
+        self.stdout.write(f'Записано счётчиков: {rows}')
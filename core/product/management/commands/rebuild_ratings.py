@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сумму, количество и среднюю оценку у всех фильмов'
+
+    def handle(self, *args, **options):
+        updated = rebuild_rating_aggregates()
+        self.stdout.write(f'Обновлено фильмов: {updated}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from product.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересобирает поисковый индекс фильмов и сериалов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        total = rebuild_index(batch_size=batch_size)
+        self.stdout.write(f'Проиндексировано: {total}')
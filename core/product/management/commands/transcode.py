@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from product.models import StreamManifest
+from product.transcoding import process_manifest
+
+
+class Command(BaseCommand):
+    help = 'Нарезает загруженные фильмы и серии на HLS-качества (в том числе после перезапуска воркера)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, action='append', dest='ids', help='Обработать только указанные манифесты')
+
+    def handle(self, *args, ids=None, **options):
+        manifests = StreamManifest.objects.exclude(status=StreamManifest.READY)
+        if ids:
+            manifests = manifests.filter(id__in=ids)
+
+        for manifest_id in manifests.values_list('id', flat=True):
+            try:
+                manifest = process_manifest(manifest_id, resume=True)
+            except Exception as exc:
+                self.stderr.write(f'Манифест {manifest_id}: ошибка — {exc}')
+                continue
+            if manifest is not None:
+                self.stdout.write(f'Манифест {manifest_id}: готово ({manifest.renditions.count()} качеств)')
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 
@@ -34,7 +36,7 @@ class Movie(models.Model):
     release_date = models.DateField('Дата премьеры')
     production_year = models.PositiveIntegerField('Год производства')
     rating = models.PositiveSmallIntegerField('Рейтинг фильма', choices=[(i, str(i)) for i in range(1, 11)])
-    duration = models.CharField(max_length=50, verbose_name='Продолжительность (в минутах)')
+    duration = models.PositiveIntegerField('Продолжительность (в минутах)')
     poster = models.ImageField('Постер', upload_to='poster_image/')
     movie = models.FileField('Фильм', upload_to='media/movie_film/', blank=True, null=True)
     series = models.ManyToManyField('Series', blank=True, related_name='related_movies')
@@ -47,6 +49,9 @@ class Movie(models.Model):
     film_crews = models.ManyToManyField('FilmCrew', related_name='movies', blank=True)
     is_film = models.BooleanField(help_text='Отметьте, если это фильм, и снимите, если это сериал.')
     is_active = models.BooleanField('Активен', default=True)
+    rating_sum = models.PositiveIntegerField('Сумма оценок', default=0, editable=False)
+    rating_count = models.PositiveIntegerField('Количество оценок', default=0, editable=False)
+    rating_average = models.FloatField('Средняя оценка', default=0, editable=False)
     created_date = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_date = models.DateTimeField('Дата обновления', auto_now=True)
 
@@ -56,9 +61,34 @@ class Movie(models.Model):
     class Meta:
         verbose_name = 'Фильм'
         verbose_name_plural = 'Фильмы'
+        # Списки по категории, жанру и стране выбирают фильмы или сериалы и
+        # листают ключами (поле сортировки, id). Индексы частичные: условие
+        # is_film совпадает с WHERE запроса, и страница читается из индекса
+        # по порядку, без сортировки всей выборки
+        indexes = [
+            models.Index(fields=['rating', 'id'], name='movie_film_rating_idx', condition=models.Q(is_film=True)),
+            models.Index(fields=['rating_average', 'id'], name='movie_film_avg_idx', condition=models.Q(is_film=True)),
+            models.Index(fields=['production_year', 'id'], name='movie_film_year_idx', condition=models.Q(is_film=True)),
+            models.Index(fields=['created_date', 'id'], name='movie_film_created_idx', condition=models.Q(is_film=True)),
+            models.Index(fields=['title', 'id'], name='movie_film_title_idx', condition=models.Q(is_film=True)),
+            # Порядок по умолчанию (-id): без частичного индекса страница новых
+            # фильмов читается по всей таблице вперемешку с сериалами
+            models.Index(fields=['id'], name='movie_film_id_idx', condition=models.Q(is_film=True)),
+            models.Index(fields=['rating', 'id'], name='movie_serial_rating_idx', condition=models.Q(is_film=False)),
+            models.Index(fields=['rating_average', 'id'], name='movie_serial_avg_idx', condition=models.Q(is_film=False)),
+            models.Index(fields=['production_year', 'id'], name='movie_serial_year_idx', condition=models.Q(is_film=False)),
+            models.Index(fields=['created_date', 'id'], name='movie_serial_created_idx', condition=models.Q(is_film=False)),
+            models.Index(fields=['title', 'id'], name='movie_serial_title_idx', condition=models.Q(is_film=False)),
+            models.Index(fields=['id'], name='movie_serial_id_idx', condition=models.Q(is_film=False)),
+            # Фильтр created_date из MovieSerialFilter
+            models.Index(fields=['created_date'], name='movie_created_idx'),
+            # Проверка доступа к видеофайлу по его пути (product/delivery.py)
+            models.Index(fields=['movie'], name='movie_file_idx'),
+        ]
 
 class Series(models.Model):
-    movie_serial = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='series_related')
+    # Отдельный индекс FK не нужен: его заменяет составной (movie_serial, id)
+    movie_serial = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='series_related', db_index=False)
     number = models.CharField('Название серии', max_length=50)
     image = models.ImageField(upload_to='image_serial/')
     series = models.FileField('Сериалы', upload_to='media/series/')
@@ -71,6 +101,10 @@ class Series(models.Model):
     class Meta:
         verbose_name = 'Серия'
         verbose_name_plural = 'Серии'
+        indexes = [
+            models.Index(fields=['movie_serial', 'id'], name='series_movie_serial_idx'),
+            models.Index(fields=['series'], name='series_file_idx'),
+        ]
 
 
 
@@ -177,8 +211,172 @@ class Rating(models.Model):
         return f"{self.movie.title} - {self.user.username}: {self.score}"
 
 
+class StreamManifest(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'В очереди'),
+        (PROCESSING, 'Обрабатывается'),
+        (READY, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    movie = models.OneToOneField(Movie, related_name='stream_manifest', on_delete=models.CASCADE, blank=True, null=True)
+    series = models.OneToOneField(Series, related_name='stream_manifest', on_delete=models.CASCADE, blank=True, null=True)
+    source = models.CharField('Исходный файл', max_length=255)
+    master_playlist = models.CharField('Мастер-плейлист', max_length=255, blank=True)
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField('Ошибка', blank=True)
+    # Растёт при каждой новой загрузке исходника: задача нарезки прежнего
+    # поколения видит это и прекращает работу
+    generation = models.PositiveIntegerField('Поколение', default=0)
+    created_date = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_date = models.DateTimeField('Дата обновления', auto_now=True)
+
+    def __str__(self):
+        return f"{self.movie or self.series}: {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = 'HLS-манифест'
+        verbose_name_plural = 'HLS-манифесты'
+
+
+class Rendition(models.Model):
+    manifest = models.ForeignKey(StreamManifest, related_name='renditions', on_delete=models.CASCADE)
+    height = models.PositiveSmallIntegerField('Высота кадра')
+    bitrate = models.PositiveIntegerField('Битрейт (бит/с)')
+    playlist = models.CharField('Плейлист', max_length=255, blank=True)
+    segment_count = models.PositiveIntegerField('Количество сегментов', default=0)
+    status = models.CharField('Статус', max_length=20, choices=StreamManifest.STATUS_CHOICES, default=StreamManifest.PENDING)
+
+    def __str__(self):
+        return f"{self.height}p"
+
+    class Meta:
+        verbose_name = 'Качество'
+        verbose_name_plural = 'Качества'
+        unique_together = ('manifest', 'height')
+        ordering = ('height',)
+
+
+class MovieRecommendation(models.Model):
+    movie = models.OneToOneField(Movie, related_name='recommendation_list', on_delete=models.CASCADE)
+    recommended_ids = models.JSONField('Рекомендованные фильмы', default=list)
+    updated_date = models.DateTimeField('Дата обновления', auto_now=True)
+
+    def __str__(self):
+        return f"Рекомендации: {self.movie}"
+
+    class Meta:
+        verbose_name = 'Рекомендации'
+        verbose_name_plural = 'Рекомендации'
+
+
+class MovieSearchDocument(models.Model):
+    """
+    Строка полнотекстового индекса FTS5 (SQLite). Таблицу создаёт и ведёт
+    ``product.search``; модель нужна, чтобы присоединять индекс к спискам
+    фильмов. ``document`` — скрытый столбец FTS5 с именем таблицы: по нему
+    идут MATCH и bm25.
+    """
+    movie = models.OneToOneField(Movie, primary_key=True, db_column='rowid', related_name='search_document',
+                                 on_delete=models.DO_NOTHING, db_constraint=False)
+    document = models.TextField(db_column='product_movie_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'product_movie_fts'
+
+
+class WatchProgress(models.Model):
+    user = models.ForeignKey(User, related_name='watch_progress', on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, related_name='watch_progress', on_delete=models.CASCADE)
+    series = models.ForeignKey(Series, related_name='watch_progress', on_delete=models.CASCADE, blank=True, null=True)
+    position = models.PositiveIntegerField('Позиция (сек)', default=0)
+    duration = models.PositiveIntegerField('Длительность (сек)', default=0)
+    heartbeat_at = models.DateTimeField('Время отметки')
+
+    def __str__(self):
+        return f"{self.user} - {self.movie}: {self.position}/{self.duration}"
+
+    class Meta:
+        verbose_name = 'Прогресс просмотра'
+        verbose_name_plural = 'Прогресс просмотра'
+        unique_together = ('user', 'movie')
+
+
+class FacetCount(models.Model):
+    GENRE = 'genre'
+    COUNTRY = 'country'
+    MOVIE_CATEGORY = 'movie_category'
+    SERIES_CATEGORY = 'series_category'
+    # Всего фильмов или сериалов, value_id всегда 0
+    TOTAL = 'total'
+    FACET_CHOICES = (
+        (GENRE, 'Жанр'),
+        (COUNTRY, 'Страна'),
+        (MOVIE_CATEGORY, 'Категория фильмов'),
+        (SERIES_CATEGORY, 'Категория сериалов'),
+        (TOTAL, 'Всего'),
+    )
+
+    facet = models.CharField('Фасет', max_length=20, choices=FACET_CHOICES)
+    value_id = models.PositiveBigIntegerField('Значение')
+    is_film = models.BooleanField('Фильмы')
+    count = models.IntegerField('Количество', default=0)
+
+    def __str__(self):
+        return f"{self.get_facet_display()} {self.value_id} ({'фильмы' if self.is_film else 'сериалы'}): {self.count}"
+
+    class Meta:
+        verbose_name = 'Счётчик фасета'
+        verbose_name_plural = 'Счётчики фасетов'
+        unique_together = ('facet', 'value_id', 'is_film')
 
 
+class CacheTagVersion(models.Model):
+    """
+    Версия тега кэша ответов (см. product/cache.py). Хранится в базе, а не
+    в кэше: ETag и Last-Modified одинаковы во всех процессах при любом
+    бэкенде кэша. Строка появляется при первом изменении тега.
+    """
+    tag = models.CharField('Тег', max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField('Версия', default=1)
+    modified = models.DateTimeField('Изменён')
 
+    def __str__(self):
+        return f"{self.tag}: {self.version}"
 
+    class Meta:
+        verbose_name = 'Версия тега кэша'
+        verbose_name_plural = 'Версии тегов кэша'
+
+
+class ChunkedUpload(models.Model):
+    """Сессия загрузки файла фильма или серии по частям (см. product/uploads.py)."""
+    UPLOADING = 'uploading'
+    COMPLETE = 'complete'
+    STATUS_CHOICES = (
+        (UPLOADING, 'Загружается'),
+        (COMPLETE, 'Прикреплён'),
+    )
 
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='uploads', on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, related_name='uploads', on_delete=models.CASCADE, blank=True, null=True)
+    series = models.ForeignKey(Series, related_name='uploads', on_delete=models.CASCADE, blank=True, null=True)
+    filename = models.CharField('Имя файла', max_length=255)
+    length = models.PositiveBigIntegerField('Размер (байт)')
+    offset = models.PositiveBigIntegerField('Получено (байт)', default=0)
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default=UPLOADING)
+    created_date = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_date = models.DateTimeField('Дата обновления', auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename}: {self.offset}/{self.length}"
+
+    class Meta:
+        verbose_name = 'Загрузка по частям'
+        verbose_name_plural = 'Загрузки по частям'
@@ -1,6 +1,351 @@
-from rest_framework.pagination import PageNumberPagination
+import asyncio
+import datetime
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 
-class MovieSerialPagination(PageNumberPagination):
-    page_size = 1
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Время пишется с микросекундами: ``DjangoJSONEncoder`` обрезает его до
+    миллисекунд, и курсор по ``created_date`` не совпадает со своей строкой.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class MovieKeysetPagination(BasePagination):
+    """
+    Keyset-пагинация списков фильмов: страница ищется условием
+    ``(поле, id) > (значение, id)`` последней строки, без OFFSET и COUNT,
+    поэтому тысячная страница стоит столько же, сколько первая.
+
+    Порядок берётся из queryset (его задаёт ``OrderingFilter`` по
+    ``ordering_fields`` вьюхи), ``id`` добавляется для однозначности.
+    Курсор хранит значения последней строки и сам порядок. Общее число
+    записей — только по запросу: ``?count=exact`` или ``?count=approx``
+    (оценка планировщика Postgres или COUNT с потолком на других БД).
+    """
+    page_size = 20
+    max_page_size = 100
     page_size_query_param = 'page_size'
-    max_page_size = 100000
\ No newline at end of file
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_ordering = '-id'
+    # Приблизительный COUNT без Postgres досчитывает не дальше этого числа
+    approximate_count_limit = 10000
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        for item in queryset.query.order_by or queryset.model._meta.ordering:
+            if isinstance(item, str) and item.lstrip('-') not in ('id', 'pk', '?'):
+                return item
+        return self.default_ordering
+
+    def is_nullable(self, queryset, field):
+        try:
+            return queryset.model._meta.get_field(field).null
+        except FieldDoesNotExist:
+            # Аннотация (например, search_rank) — считаем, что может быть NULL
+            return field in queryset.query.annotations
+
+    def make_cursor(self, row, reverse):
+        field = self.ordering.lstrip('-')
+        payload = {'o': self.ordering, 'id': row.pk, 'r': reverse}
+        if field != 'id':
+            payload['v'] = getattr(row, field)
+        raw = json.dumps(payload, cls=CursorEncoder, separators=(',', ':'))
+        return urlsafe_b64encode(raw.encode()).decode()
+
+    def encode_cursor(self, row, reverse):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.make_cursor(row, reverse))
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+            if payload['o'] != self.ordering or not isinstance(payload['id'], int):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return payload
+
+    def with_cursor_field(self, queryset, field):
+        """
+        Значение курсора берётся из последней строки, поэтому поле сортировки
+        должно прийти в самой выборке: иначе при ``only()`` из плана загрузки
+        сериализатора оно догружается отдельным запросом, а в асинхронной
+        вьюхе такой запрос и вовсе запрещён. Строкам ``values_list`` (быстрый
+        путь сериализатора) поле дописывается в колонки.
+        """
+        if queryset._fields is not None:
+            if field in queryset._fields:
+                return queryset
+            return queryset.values_list(*queryset._fields, field, named=True)
+        names, defer = queryset.query.deferred_loading
+        if field in queryset.query.annotations:
+            return queryset
+        if defer and field in names:
+            return queryset.defer(None).defer(*(names - {field}))
+        if not defer and names and field not in names:
+            return queryset.only(*names, field)
+        return queryset
+
+    def keyset_queryset(self, queryset, cursor):
+        """Queryset строк после курсора в нужном направлении, с сортировкой."""
+        descending = self.ordering.startswith('-')
+        field = self.ordering.lstrip('-')
+        reverse = bool(cursor and cursor['r'])
+        # Назад идём в обратном порядке, а потом переворачиваем страницу
+        ascending = descending if reverse else not descending
+        lookup = 'gt' if ascending else 'lt'
+
+        if field == 'id':
+            order = ['id' if ascending else '-id']
+            condition = Q(**{f'id__{lookup}': cursor['id']}) if cursor else None
+        else:
+            queryset = self.with_cursor_field(queryset, field)
+            nullable = self.is_nullable(queryset, field)
+            # NULL всегда в конце прямого порядка
+            nulls_last = not reverse
+            if nullable:
+                nulls = {'nulls_last': True} if nulls_last else {'nulls_first': True}
+            else:
+                nulls = {}
+            expression = F(field).asc(**nulls) if ascending else F(field).desc(**nulls)
+            order = [expression, 'id' if ascending else '-id']
+            condition = None
+            if cursor:
+                value = cursor.get('v')
+                if value is None:
+                    condition = Q(**{f'{field}__isnull': True, f'id__{lookup}': cursor['id']})
+                    if not nulls_last:
+                        condition |= Q(**{f'{field}__isnull': False})
+                else:
+                    condition = Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': cursor['id']})
+                    # Лишнее по смыслу условие-диапазон: по нему индекс (поле, id)
+                    # начинает чтение с курсора, а не с начала
+                    condition &= Q(**{f'{field}__{lookup}e': value})
+                    if nullable and nulls_last:
+                        condition |= Q(**{f'{field}__isnull': True})
+
+        if condition is not None:
+            queryset = queryset.filter(condition)
+        return queryset.order_by(*order)[:self.page_size + 1]
+
+    def prepare(self, queryset, request):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.cursor = self.decode_cursor(request)
+        self.count = self.count_is_approximate = None
+        self.count_mode = request.query_params.get(self.count_query_param)
+        return self.keyset_queryset(queryset, self.cursor)
+
+    def finish(self, rows):
+        reverse = bool(self.cursor and self.cursor['r'])
+        has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        if reverse:
+            page.reverse()
+
+        self.next_link = self.previous_link = None
+        if page:
+            if has_more or reverse:
+                self.next_link = self.encode_cursor(page[-1], reverse=False)
+            if (has_more and reverse) or (self.cursor and not reverse):
+                self.previous_link = self.encode_cursor(page[0], reverse=True)
+        return page
+
+    def count_queryset(self, queryset):
+        queryset = queryset.order_by()
+        if self.count_mode == 'exact':
+            self.count, self.count_is_approximate = queryset.count(), False
+        elif self.count_mode == 'approx':
+            self.count, self.count_is_approximate = self.approximate_count(queryset)
+
+    def approximate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows']), True
+        count = queryset[:self.approximate_count_limit].count()
+        return count, count >= self.approximate_count_limit
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.prepare(queryset, request))
+        if self.count_mode:
+            self.count_queryset(queryset)
+        return self.finish(rows)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """То же через асинхронный ORM; COUNT — только по ``?count=``."""
+        page_queryset = await sync_to_async(self.prepare)(queryset, request)
+        tasks = [self.afetch(page_queryset)]
+        if self.count_mode:
+            tasks.append(sync_to_async(self.count_queryset)(queryset))
+        rows, *_ = await asyncio.gather(*tasks)
+        return self.finish(rows)
+
+    async def afetch(self, queryset):
+        return [obj async for obj in queryset]
+
+    def get_paginated_response(self, data):
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count
+            response['count_is_approximate'] = self.count_is_approximate
+        response['next'] = self.next_link
+        response['previous'] = self.previous_link
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'description': 'Только при ?count=exact|approx'},
+                'count_is_approximate': {'type': 'boolean'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы (из ссылок next/previous)',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Размер страницы, до {self.max_page_size}',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'exact — точное число записей, approx — оценка',
+                'schema': {'type': 'string', 'enum': ['exact', 'approx']},
+            },
+        ]
+
+
+class IndexSectionPagination:
+    """
+    Курсорная пагинация разделов главной страницы по ключу ``-id``, а при
+    поиске — по ``(search_rank, id)``, чтобы страницы шли по релевантности.
+
+    У каждого раздела свой курсор (``<section>_cursor``), ``limit`` общий.
+    Стоимость страницы не зависит от размера каталога: запрос идёт по
+    ключу без OFFSET и COUNT.
+    """
+    limit_query_param = 'limit'
+    default_limit = 20
+    max_limit = 100
+    rank_field = 'search_rank'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, request):
+        self.request = request
+
+    def is_enabled(self):
+        return self.limit_query_param in self.request.query_params
+
+    def is_ranked(self, queryset):
+        return self.rank_field in queryset.query.annotations
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def encode_cursor(self, *key):
+        # Ранг дробный, поэтому разделитель — не точка
+        return urlsafe_b64encode(':'.join(map(str, key)).encode()).decode()
+
+    def decode_cursor(self, cursor, *types):
+        """Ключ курсора, приведённый к ``types``: (float, int) для ранга и id."""
+        try:
+            parts = urlsafe_b64decode(cursor.encode()).decode().split(':')
+            if len(parts) != len(types):
+                raise ValueError
+            key = [kind(part) for kind, part in zip(types, parts)]
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not all(math.isfinite(value) for value in key):
+            raise NotFound(self.invalid_cursor_message)
+        return key
+
+    def get_section_queryset(self, queryset, section, ranked=False):
+        cursor = self.request.query_params.get(f'{section}_cursor')
+        if ranked:
+            queryset = queryset.order_by(self.rank_field, 'id')
+            if cursor:
+                rank, pk = self.decode_cursor(cursor, float, int)
+                queryset = queryset.filter(
+                    Q(**{f'{self.rank_field}__gt': rank}) | Q(**{self.rank_field: rank, 'id__gt': pk})
+                )
+        else:
+            queryset = queryset.order_by('-id')
+            if cursor:
+                queryset = queryset.filter(id__lt=self.decode_cursor(cursor, int)[0])
+        return queryset[:self.get_limit() + 1]
+
+    def get_section_page(self, page, ranked=False):
+        limit = self.get_limit()
+        if len(page) > limit:
+            page = page[:limit]
+            last = page[-1]
+            key = (getattr(last, self.rank_field), last.id) if ranked else (last.id,)
+            return page, self.encode_cursor(*key)
+        return page, None
+
+    def paginate_section(self, queryset, section):
+        """Возвращает (объекты страницы, курсор следующей страницы или None)."""
+        ranked = self.is_ranked(queryset)
+        return self.get_section_page(list(self.get_section_queryset(queryset, section, ranked)), ranked)
+
+    async def apaginate_section(self, queryset, section):
+        """То же, что ``paginate_section``, через асинхронный ORM."""
+        ranked = self.is_ranked(queryset)
+        queryset = self.get_section_queryset(queryset, section, ranked)
+        return self.get_section_page([obj async for obj in queryset], ranked)
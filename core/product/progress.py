@@ -0,0 +1,166 @@
+"""
+Прогресс просмотра с объединением записей.
+
+Плеер шлёт отметки каждые несколько секунд. Отметки копятся в памяти
+процесса (по одной на пользователя и фильм — последняя побеждает) и раз в
+``WATCH_PROGRESS_FLUSH_INTERVAL`` секунд пишутся одним upsert на пачку.
+
+Upsert обновляет строку только если отметка новее сохранённой, поэтому
+порядок сброса между воркерами не важен. При штатной остановке буфер
+сбрасывается через atexit; при падении теряется не больше одного
+интервала, а ``final`` (пауза, закрытие плеера) пишется сразу.
+
+Отметки не проверяются при приёме: фильмы и серии проверяются пачкой при
+записи, отметки для удалённых или чужих серий отбрасываются.
+"""
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .buffering import CoalescingBuffer
+from .models import Movie, Series, WatchProgress
+
+
+logger = logging.getLogger(__name__)
+
+UPSERT_BATCH_SIZE = 500
+# Досмотренное до этой доли не показываем в «Продолжить просмотр»
+FINISHED_RATIO = 0.95
+
+
+def get_flush_interval():
+    return getattr(settings, 'WATCH_PROGRESS_FLUSH_INTERVAL', 10)
+
+
+def upsert(entries):
+    """
+    Пишет отметки пачками ``INSERT ... ON CONFLICT DO UPDATE ... WHERE``:
+    более старая отметка не перезапишет более новую.
+    """
+    if not entries:
+        return
+    meta = WatchProgress._meta
+    fields = [meta.get_field(name) for name in ('user', 'movie', 'series', 'position', 'duration', 'heartbeat_at')]
+    columns = [field.column for field in fields]
+    table = connection.ops.quote_name(meta.db_table)
+    quoted = [connection.ops.quote_name(column) for column in columns]
+    updates = ', '.join(f'{column} = excluded.{column}' for column in quoted[2:])
+    heartbeat = quoted[-1]
+
+    for start in range(0, len(entries), UPSERT_BATCH_SIZE):
+        chunk = entries[start:start + UPSERT_BATCH_SIZE]
+        placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(chunk))
+        params = []
+        for entry in chunk:
+            params += [field.get_db_prep_value(entry[field.name], connection) for field in fields]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(quoted)}) VALUES {placeholders} '
+                f'ON CONFLICT ({quoted[0]}, {quoted[1]}) DO UPDATE SET {updates} '
+                f'WHERE excluded.{heartbeat} > {table}.{heartbeat}',
+                params,
+            )
+
+
+def existing(entries):
+    """
+    Оставляет отметки, у которых есть фильм и серия принадлежит этому
+    фильму — по запросу на фильмы и на серии на всю пачку.
+    """
+    movie_ids = set(Movie.objects.filter(pk__in={entry['movie'] for entry in entries}).values_list('pk', flat=True))
+    series_ids = {entry['series'] for entry in entries if entry['series']}
+    series = dict(Series.objects.filter(pk__in=series_ids).values_list('pk', 'movie_serial_id')) if series_ids else {}
+    valid = []
+    for entry in entries:
+        if entry['movie'] not in movie_ids or entry['series'] and series.get(entry['series']) != entry['movie']:
+            logger.warning('Dropped watch progress for missing movie %s', entry['movie'])
+            continue
+        valid.append(entry)
+    return valid
+
+
+class ProgressBuffer(CoalescingBuffer):
+    thread_name = 'watch-progress-flush'
+
+    def get_flush_interval(self):
+        return get_flush_interval()
+
+    def record(self, user_id, movie_id, series_id, position, duration, final=False):
+        entry = {
+            'user': user_id,
+            'movie': movie_id,
+            'series': series_id,
+            'position': position,
+            'duration': duration,
+            'heartbeat_at': timezone.now(),
+        }
+        key = (user_id, movie_id)
+        if final:
+            self.discard(key)
+            try:
+                self.write([entry])
+            except DatabaseError as exc:
+                # База недоступна — отметка уйдёт со следующим сбросом
+                logger.warning('Watch progress write failed, buffering: %s', exc)
+                self.put(key, entry)
+            return
+        self.put(key, entry)
+
+    def get(self, user_id):
+        """Ещё не записанные отметки пользователя: {movie_id: entry}."""
+        with self.lock:
+            return {movie_id: entry for (uid, movie_id), entry in self.pending.items() if uid == user_id}
+
+    def write(self, entries):
+        entries = existing(entries)
+        try:
+            with transaction.atomic():
+                upsert(entries)
+        except IntegrityError:
+            # Фильм или серию удалили после проверки — пишем по одной, пропуская битые
+            for entry in entries:
+                try:
+                    with transaction.atomic():
+                        upsert([entry])
+                except IntegrityError:
+                    logger.warning('Dropped watch progress for missing movie %s', entry['movie'])
+
+
+buffer = ProgressBuffer()
+
+
+def continue_watching(user, limit=20):
+    """
+    Недосмотренные фильмы и сериалы пользователя, последние сверху,
+    с учётом отметок, которые ещё лежат в буфере этого процесса.
+    """
+    pending = buffer.get(user.id)
+    rows = {
+        row.movie_id: row
+        for row in WatchProgress.objects.filter(user=user)
+        .exclude(position__gte=F('duration') * FINISHED_RATIO, duration__gt=0)
+        .select_related('movie', 'series')
+        .order_by('-heartbeat_at')[:limit]
+    }
+    # Отметки в буфере ещё не проверены — подгружаем их фильмы и серии разом
+    entries = {entry['movie']: entry for entry in existing(list(pending.values()))}
+    movies = Movie.objects.in_bulk([movie_id for movie_id in entries if movie_id not in rows])
+    series = Series.objects.in_bulk([entry['series'] for entry in entries.values() if entry['series']])
+    for movie_id, entry in entries.items():
+        row = rows.get(movie_id) or WatchProgress(user=user, movie=movies[movie_id])
+        row.series = series.get(entry['series'])
+        row.position = entry['position']
+        row.duration = entry['duration']
+        row.heartbeat_at = entry['heartbeat_at']
+        rows[movie_id] = row
+
+    rows = [row for row in rows.values() if not is_finished(row)]
+    rows.sort(key=lambda row: row.heartbeat_at, reverse=True)
+    return rows[:limit]
+
+
+def is_finished(progress):
+    return progress.duration > 0 and progress.position >= progress.duration * FINISHED_RATIO
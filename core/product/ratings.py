@@ -0,0 +1,185 @@
+import logging
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Avg, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+
+from .buffering import CoalescingBuffer
+from .models import Movie, Rating
+from . import cache
+
+
+logger = logging.getLogger(__name__)
+
+
+def apply_rating_change(movie_id, score_delta, count_delta):
+    """
+    Атомарно меняет сумму и количество оценок фильма одним UPDATE и
+    пересчитывает среднюю по новым значениям.
+    """
+    # В UPDATE правая часть видит старые значения столбцов, поэтому
+    # среднее считаем из тех же выражений, а не из обновлённых полей
+    new_sum = F('rating_sum') + score_delta
+    new_count = F('rating_count') + count_delta
+    average = Coalesce(
+        Cast(new_sum, FloatField()) / Cast(NullIf(new_count, Value(0)), FloatField()),
+        Value(0.0),
+    )
+    Movie.objects.filter(id=movie_id).update(rating_sum=new_sum, rating_count=new_count, rating_average=average)
+
+
+def rating_added(rating):
+    apply_rating_change(rating.movie_id, rating.score, 1)
+
+
+def rating_removed(rating):
+    apply_rating_change(rating.movie_id, -rating.score, -1)
+
+
+def rating_changed(old_movie_id, old_score, rating):
+    if old_movie_id == rating.movie_id:
+        if old_score != rating.score:
+            apply_rating_change(rating.movie_id, rating.score - old_score, 0)
+        return
+    apply_rating_change(old_movie_id, -old_score, -1)
+    rating_added(rating)
+
+
+def rebuild_rating_aggregates(queryset=None):
+    """Пересчитывает агрегаты оценок для фильмов одним UPDATE с подзапросами."""
+    ratings = Rating.objects.filter(movie=OuterRef('pk')).order_by().values('movie')
+    queryset = Movie.objects.all() if queryset is None else queryset
+    return queryset.update(
+        rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('score')).values('total')), Value(0)),
+        rating_count=Coalesce(Subquery(ratings.annotate(total=Count('id')).values('total')), Value(0)),
+        rating_average=Coalesce(
+            Subquery(ratings.annotate(average=Avg('score')).values('average')),
+            Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+
+
+# Приём оценок: upsert пачками и буфер для всплесков
+
+UPSERT_BATCH_SIZE = 500
+
+
+def is_buffered():
+    return getattr(settings, 'RATING_BUFFERED_WRITES', False)
+
+
+def get_flush_interval():
+    return getattr(settings, 'RATING_FLUSH_INTERVAL', 2)
+
+
+def apply_rating_changes(changes):
+    """Прибавляет к агрегатам {movie_id: (изменение суммы, изменение количества)}."""
+    # Один порядок строк во всех транзакциях — без взаимных блокировок
+    for movie_id, (score_delta, count_delta) in sorted(changes.items()):
+        if score_delta or count_delta:
+            apply_rating_change(movie_id, score_delta, count_delta)
+
+
+def upsert(entries):
+    """
+    Записывает оценки ``[{'user': id, 'movie': id, 'score': n}]`` через
+    ``INSERT ... ON CONFLICT DO UPDATE`` и обновляет агрегаты фильмов на
+    разницу со старыми оценками. Повторы пары (пользователь, фильм) — последняя
+    побеждает. Возвращает множество пар, для которых оценка создана.
+    """
+    entries = list({(entry['user'], entry['movie']): entry for entry in entries}.values())
+    created = set()
+    for start in range(0, len(entries), UPSERT_BATCH_SIZE):
+        with transaction.atomic():
+            created |= upsert_chunk(entries[start:start + UPSERT_BATCH_SIZE])
+    return created
+
+
+def upsert_chunk(entries):
+    pairs = [(entry['user'], entry['movie']) for entry in entries]
+    # Старые оценки под блокировкой: до коммита их никто не поменяет
+    existing = Rating.objects.select_for_update().filter(
+        reduce(or_, (Q(user_id=user_id, movie_id=movie_id) for user_id, movie_id in pairs))
+    ).order_by('movie_id', 'user_id').values_list('user_id', 'movie_id', 'score')
+    old_scores = {(user_id, movie_id): score for user_id, movie_id, score in existing}
+
+    meta = Rating._meta
+    fields = [meta.get_field(name) for name in ('movie', 'user', 'score', 'created_date', 'updated_date')]
+    table = connection.ops.quote_name(meta.db_table)
+    movie, user, score, created_date, updated_date = [connection.ops.quote_name(field.column) for field in fields]
+    now = timezone.now()
+    params = []
+    for entry in entries:
+        values = (entry['movie'], entry['user'], entry['score'], now, now)
+        params += [field.get_db_prep_value(value, connection) for field, value in zip(fields, values)]
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s)'] * len(entries))
+    with connection.cursor() as cursor:
+        # Вставленная строка — та, у которой даты создания и обновления совпадают
+        cursor.execute(
+            f'INSERT INTO {table} ({movie}, {user}, {score}, {created_date}, {updated_date}) VALUES {placeholders} '
+            f'ON CONFLICT ({movie}, {user}) DO UPDATE SET {score} = excluded.{score}, '
+            f'{updated_date} = excluded.{updated_date} '
+            f'RETURNING {movie}, {user}, {created_date} = {updated_date}',
+            params,
+        )
+        rows = cursor.fetchall()
+
+    scores = {(entry['user'], entry['movie']): entry['score'] for entry in entries}
+    changes = {}
+    created = set()
+    raced = set()
+    for movie_id, user_id, inserted in rows:
+        pair = (user_id, movie_id)
+        new_score = scores[pair]
+        if pair in old_scores:
+            delta = (new_score - old_scores[pair], 0)
+        elif inserted:
+            delta = (new_score, 1)
+            created.add(pair)
+        else:
+            # Оценку успела вставить параллельная транзакция — старое значение
+            # неизвестно, агрегаты фильма пересчитаем целиком
+            raced.add(movie_id)
+            continue
+        score_delta, count_delta = changes.get(movie_id, (0, 0))
+        changes[movie_id] = (score_delta + delta[0], count_delta + delta[1])
+
+    apply_rating_changes(changes)
+    if raced:
+        rebuild_rating_aggregates(Movie.objects.filter(id__in=raced))
+    cache.invalidate('rating', *{f'movie:{movie_id}' for movie_id, _, _ in rows})
+    return created
+
+
+class RatingBuffer(CoalescingBuffer):
+    """
+    Оценки, собранные за ``RATING_FLUSH_INTERVAL`` секунд, пишутся одним
+    upsert: повторные оценки одного фильма за интервал схлопываются, а
+    агрегат каждого фильма обновляется один раз на пачку.
+    """
+    thread_name = 'rating-flush'
+
+    def get_flush_interval(self):
+        return get_flush_interval()
+
+    def record(self, user_id, movie_id, score):
+        self.put((user_id, movie_id), {'user': user_id, 'movie': movie_id, 'score': score})
+
+    def write(self, entries):
+        try:
+            upsert(entries)
+        except IntegrityError:
+            # Фильм или пользователя успели удалить — пишем по одной, пропуская битые
+            for entry in entries:
+                try:
+                    upsert([entry])
+                except IntegrityError:
+                    logger.warning('Dropped rating for missing movie %s', entry['movie'])
+
+
+buffer = RatingBuffer()
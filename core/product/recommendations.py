@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .cache import invalidate
+from .models import Movie, MovieRecommendation, Favorite, Rating
+
+
+# Вклад каждого сигнала в итоговую близость фильмов
+DEFAULT_WEIGHTS = {
+    'categories': 1.0,
+    'genres': 1.5,
+    'country': 0.5,
+    'film_crews': 1.0,
+    'favorites': 2.0,
+    'ratings': 2.0,
+}
+# Оценка, начиная с которой считаем, что фильм пользователю понравился
+LIKED_SCORE = 7
+
+
+def get_top_k():
+    return getattr(settings, 'RECOMMENDATIONS_TOP_K', 20)
+
+
+def get_recommendations(movie, limit=None):
+    """
+    Рекомендации к фильму из заранее посчитанного списка: два запроса
+    независимо от размера каталога. Пока список не посчитан — фильмы из
+    тех же категорий.
+    """
+    limit = limit or get_top_k()
+    entry = MovieRecommendation.objects.filter(movie=movie).values_list('recommended_ids', flat=True).first()
+    if entry is None:
+        categories = movie.movie_categories.all() | movie.series_categories.all()
+        return Movie.objects.filter(
+            Q(movie_categories__in=categories) | Q(series_categories__in=categories)
+        ).exclude(id=movie.id).distinct()[:limit]
+
+    ids = entry[:limit]
+    if not ids:
+        return Movie.objects.none()
+    order = Case(*[When(id=pk, then=Value(pos)) for pos, pk in enumerate(ids)], output_field=IntegerField())
+    return Movie.objects.filter(id__in=ids, is_active=True).order_by(order)
+
+
+def _feature_pairs(movie_index):
+    """Пары (индекс фильма, ключ признака) для каждой группы признаков."""
+    through = {
+        'categories': [
+            (Movie.movie_categories.through, 'category_id'),
+            (Movie.series_categories.through, 'category_id'),
+        ],
+        'genres': [(Movie.genres.through, 'genre_id')],
+        'country': [(Movie.country.through, 'country_id')],
+        'film_crews': [(Movie.film_crews.through, 'filmcrew_id')],
+    }
+    groups = {}
+    for name, tables in through.items():
+        pairs = []
+        for model, column in tables:
+            pairs += model.objects.values_list('movie_id', column)
+        groups[name] = pairs
+    groups['favorites'] = list(Favorite.objects.values_list('movie_id', 'user_id'))
+    groups['ratings'] = list(Rating.objects.filter(score__gte=LIKED_SCORE).values_list('movie_id', 'user_id'))
+
+    return {
+        name: [(movie_index[movie_id], key) for movie_id, key in pairs if movie_id in movie_index]
+        for name, pairs in groups.items()
+    }
+
+
+def build_feature_matrix(movie_ids, weights=None):
+    """
+    Разреженная матрица «фильм × признак», где строки каждой группы
+    нормированы и умножены на корень из веса группы. Тогда скалярное
+    произведение строк — взвешенная сумма косинусных близостей по группам.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    weights = weights or DEFAULT_WEIGHTS
+    movie_index = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+    blocks = []
+    for name, pairs in _feature_pairs(movie_index).items():
+        if not pairs or not weights.get(name):
+            continue
+        rows, keys = zip(*set(pairs))
+        _, columns = np.unique(np.array(keys), return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (np.array(rows), columns)),
+            shape=(len(movie_ids), columns.max() + 1),
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        scale = np.sqrt(weights[name]) / norms
+        blocks.append(sparse.diags(scale.astype(np.float32)) @ matrix)
+
+    if not blocks:
+        return sparse.csr_matrix((len(movie_ids), 0), dtype=np.float32)
+    return sparse.hstack(blocks, format='csr')
+
+
+def top_k_neighbors(features, top_k, block_size=256):
+    """
+    Для каждой строки возвращает индексы top_k самых близких строк.
+    Считается блоками, чтобы не держать в памяти всю матрицу N × N.
+    """
+    import numpy as np
+
+    features_t = features.T.tocsc()
+    total = features.shape[0]
+    result = []
+    for start in range(0, total, block_size):
+        stop = min(start + block_size, total)
+        scores = (features[start:stop] @ features_t).toarray()
+        scores[np.arange(stop - start), np.arange(start, stop)] = 0
+        k = min(top_k, total - 1)
+        if k <= 0:
+            result += [[] for _ in range(stop - start)]
+            continue
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind='stable')
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        for row, row_scores in zip(candidates, candidate_scores):
+            result.append(row[row_scores > 0].tolist())
+    return result
+
+
+def compute_recommendations(top_k=None, weights=None, batch_size=1000):
+    """Пересчитывает списки рекомендаций для всех активных фильмов."""
+    top_k = top_k or get_top_k()
+    movie_ids = list(Movie.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+    features = build_feature_matrix(movie_ids, weights)
+    neighbors = top_k_neighbors(features, top_k)
+
+    entries = [
+        MovieRecommendation(movie_id=movie_id, recommended_ids=[movie_ids[i] for i in row])
+        for movie_id, row in zip(movie_ids, neighbors)
+    ]
+    with transaction.atomic():
+        MovieRecommendation.objects.exclude(movie__is_active=True).delete()
+        MovieRecommendation.objects.bulk_create(
+            entries,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['movie'],
+            update_fields=['recommended_ids', 'updated_date'],
+        )
+    invalidate('recommendation')
+    return len(entries)
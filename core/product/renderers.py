@@ -0,0 +1,36 @@
+"""
+Колоночный JSON для списков: имена полей один раз, строки — массивами.
+
+``{"results": [{"id": 1, "title": "…"}, …]}`` превращается в
+``{"results": {"columns": ["id", "title"], "rows": [[1, "…"], …]}}``.
+Преобразуются список верхнего уровня и списки объектов в значениях
+верхнего уровня (страница ``results``, разделы главной); вложенные данные
+внутри строк остаются как есть. Пустые списки и списки не объектов
+(например, id) не меняются: по ним колонки не вывести.
+
+Формат выбирается клиентом: ``Accept: application/vnd.columnar+json`` или
+``?format=columnar``; без этого ответы остаются обычным JSON.
+"""
+from rest_framework.renderers import JSONRenderer
+
+
+def to_columns(items):
+    """Список одинаковых по ключам объектов — в колонки; остальное без изменений."""
+    if not items or not isinstance(items[0], dict):
+        return items
+    columns = list(items[0])
+    if any(not isinstance(item, dict) or item.keys() != items[0].keys() for item in items):
+        return items
+    return {'columns': columns, 'rows': [[item[column] for column in columns] for item in items]}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list):
+            data = to_columns(data)
+        elif isinstance(data, dict):
+            data = {key: to_columns(value) if isinstance(value, list) else value for key, value in data.items()}
+        return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,294 @@
+"""
+Полнотекстовый поиск фильмов по названию, описанию, съёмочной группе,
+жанрам и странам.
+
+Бэкенд выбирается по базе: FTS5 с ранжированием bm25 на SQLite, tsvector
+с GIN-индексом и ts_rank на PostgreSQL, ``icontains`` по названию на
+остальных (и при ``SEARCH_INDEX_ENABLED = False``). Слова запроса ищутся
+по началу. Опечатки (``SEARCH_TYPO_TOLERANCE``) исправляются только на
+SQLite — по словарю FTS5; PostgreSQL и ``icontains`` ищут без исправления,
+у них ``typo_tolerant = False``.
+
+Поиск встраивается в queryset вызывающего: на SQLite индекс присоединяется
+к списку (``MovieSearchDocument``), на PostgreSQL совпадения отбираются
+подзапросом к индексу. Ранг (``search_rank``) считается только для строк,
+прошедших фильтры списка (жанр, страна, категория), поэтому в
+отфильтрованном списке находятся все совпадения, а не только попавшие в
+общий топ, и ни списка id, ни CASE по ним в запросе нет.
+"""
+import difflib
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Func, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Movie, MovieSearchDocument
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def collect_documents(movie_ids):
+    """
+    Собирает тексты для индекса одним запросом на каждую связь:
+    {id: (title, description, crew, genres, countries)}.
+    """
+    documents = {
+        movie_id: [title, description, [], [], []]
+        for movie_id, title, description in Movie.objects.filter(id__in=movie_ids).values_list('id', 'title', 'description')
+    }
+    relations = (
+        (2, Movie.film_crews.through, 'filmcrew__name'),
+        (3, Movie.genres.through, 'genre__title'),
+        (4, Movie.country.through, 'country__title'),
+    )
+    for position, through, field in relations:
+        for movie_id, value in through.objects.filter(movie_id__in=documents).values_list('movie_id', field):
+            documents[movie_id][position].append(value)
+
+    return {
+        movie_id: (title, description, ' '.join(crew), ' '.join(genres), ' '.join(countries))
+        for movie_id, (title, description, crew, genres, countries) in documents.items()
+    }
+
+
+class SQLiteFTSBackend:
+    """Индекс в виртуальной таблице FTS5 (``MovieSearchDocument``), ранжирование по bm25."""
+    typo_tolerant = True
+    table = MovieSearchDocument._meta.db_table
+    vocab_table = 'product_movie_fts_vocab'
+    # Веса колонок: название, описание, съёмочная группа, жанры, страны
+    weights = (10.0, 1.0, 3.0, 2.0, 2.0)
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "title, description, crew, genres, countries, "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.vocab_table} USING fts5vocab({self.table}, 'row')"
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def index(self, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in documents])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, description, crew, genres, countries) '
+                'VALUES (%s, %s, %s, %s, %s, %s)',
+                [(pk, *fields) for pk, fields in documents.items()],
+            )
+
+    def remove(self, movie_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in movie_ids])
+
+    def _terms(self, cursor, prefix, limit=-1):
+        cursor.execute(
+            f'SELECT term FROM {self.vocab_table} WHERE term >= %s AND term < %s LIMIT %s',
+            [prefix, prefix + '\uffff', limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _expand(self, cursor, token):
+        # Если в словаре нет ни одного слова с таким началом, пробуем
+        # исправить опечатку по похожим словам с той же первой буквой
+        if not is_typo_tolerance_enabled() or len(token) < 4 or self._terms(cursor, token, limit=1):
+            return [token]
+        candidates = self._terms(cursor, token[0])
+        return difflib.get_close_matches(token, candidates, n=3, cutoff=0.75) or [token]
+
+    def rank(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        with connection.cursor() as cursor:
+            groups = []
+            for token in tokens:
+                terms = self._expand(cursor, token)
+                groups.append('(' + ' OR '.join(f'"{term}"*' for term in terms) + ')')
+        # Индекс присоединяется к queryset: MATCH выбирает совпадения по
+        # индексу, фильтры списка применяются к ним же, bm25 считается один раз
+        document = F('search_document__document')
+        match = Func(document, Value(' AND '.join(groups)), arg_joiner=' MATCH ', template='%(expressions)s',
+                     output_field=BooleanField())
+        rank = Func(document, *[Value(weight) for weight in self.weights], function='bm25',
+                    output_field=FloatField())
+        # isnull=False делает соединение INNER: через LEFT JOIN FTS5 MATCH не применит
+        return queryset.filter(match, search_document__isnull=False).annotate(search_rank=rank)
+
+
+class SearchRank(Func):
+    """
+    Ранг фильма по запросу для PostgreSQL — коррелированный подзапрос к
+    индексу по id строки (меньше — релевантнее). id передаётся выражением, поэтому
+    псевдоним таблицы верный и тогда, когда queryset стал подзапросом.
+    """
+    output_field = FloatField()
+
+    def __init__(self, sql, params):
+        super().__init__(F('pk'))
+        self.sql, self.params = sql, params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        return '(' + self.sql.format(pk=pk_sql) + ')', [*self.params, *pk_params]
+
+
+class PostgresSearchBackend:
+    """Индекс в таблице с tsvector и GIN-индексом, ранжирование по ts_rank. Без исправления опечаток."""
+    typo_tolerant = False
+    table = 'product_movie_search'
+    config = 'simple'
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'movie_id bigint PRIMARY KEY REFERENCES product_movie (id) ON DELETE CASCADE, '
+                'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.table}_document_idx ON {self.table} USING GIN (document)'
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+    def index(self, documents):
+        config = self.config
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (movie_id, document) VALUES (%s, '
+                f"setweight(to_tsvector('{config}', %s), 'A') || "
+                f"setweight(to_tsvector('{config}', %s), 'D') || "
+                f"setweight(to_tsvector('{config}', %s), 'B') || "
+                f"setweight(to_tsvector('{config}', %s || ' ' || %s), 'C')) "
+                'ON CONFLICT (movie_id) DO UPDATE SET document = EXCLUDED.document',
+                [(pk, *fields) for pk, fields in documents.items()],
+            )
+
+    def remove(self, movie_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE movie_id = ANY(%s)', [list(movie_ids)])
+
+    def rank(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        table, config = self.table, self.config
+        # ts_rank растёт с релевантностью, а search_rank сортируется по возрастанию
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT movie_id FROM {table} WHERE document @@ to_tsquery('{config}', %s)", [tsquery])
+        ).annotate(search_rank=SearchRank(
+            f"SELECT -ts_rank(document, to_tsquery('{config}', %s)) FROM {table} WHERE movie_id = {{pk}}", [tsquery]
+        ))
+
+
+class IContainsBackend:
+    """Запасной вариант для баз без полнотекстового поиска. Без исправления опечаток."""
+    typo_tolerant = False
+
+    def ensure_index(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def index(self, documents):
+        pass
+
+    def remove(self, movie_ids):
+        pass
+
+    def rank(self, queryset, query):
+        if not query.strip():
+            return None
+        # Без ранжирования: новые фильмы выше
+        return queryset.filter(title__icontains=query).annotate(search_rank=-F('id') * 1.0)
+
+
+_prepared_databases = set()
+
+
+def get_backend():
+    if not getattr(settings, 'SEARCH_INDEX_ENABLED', True):
+        return IContainsBackend()
+    if connection.vendor == 'sqlite':
+        backend = SQLiteFTSBackend()
+    elif connection.vendor == 'postgresql':
+        backend = PostgresSearchBackend()
+    else:
+        return IContainsBackend()
+
+    # Таблица индекса создаётся после migrate, но на уже развёрнутой базе
+    # её может ещё не быть — проверяем один раз на процесс
+    database = connection.settings_dict['NAME']
+    if database not in _prepared_databases:
+        backend.ensure_index()
+        _prepared_databases.add(database)
+    return backend
+
+
+def is_typo_tolerance_enabled():
+    return getattr(settings, 'SEARCH_TYPO_TOLERANCE', True)
+
+
+def update_index(movie_ids):
+    movie_ids = list(movie_ids)
+    if movie_ids:
+        get_backend().index(collect_documents(movie_ids))
+
+
+def remove_from_index(movie_ids):
+    get_backend().remove(list(movie_ids))
+
+
+def rebuild_index(batch_size=1000):
+    backend = get_backend()
+    backend.ensure_index()
+    backend.clear()
+    total = 0
+    ids = Movie.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    batch = []
+    for movie_id in ids:
+        batch.append(movie_id)
+        if len(batch) >= batch_size:
+            backend.index(collect_documents(batch))
+            total += len(batch)
+            batch = []
+    if batch:
+        backend.index(collect_documents(batch))
+        total += len(batch)
+    return total
+
+
+def search_movie_ids(query, limit=50):
+    """Идентификаторы фильмов по запросу, от самых релевантных."""
+    queryset = search_queryset(Movie.objects.all(), query).order_by('search_rank', 'id')
+    return list(queryset.values_list('id', flat=True)[:limit])
+
+
+def search_queryset(queryset, query):
+    """
+    Оставляет в queryset только найденные фильмы и добавляет аннотацию
+    ``search_rank`` (меньше — релевантнее) для сортировки.
+    """
+    ranked = get_backend().rank(queryset, query)
+    if ranked is None:
+        # Аннотация нужна и пустому запросу: вызывающие сортируют по ней
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return ranked
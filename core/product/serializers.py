@@ -1,26 +1,81 @@
 # serializers.py
-from django.db.models import Avg
+import os
+
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Movie, Series, Category, Genre, Country, Banner, FilmCrew, Favorite, Rating
+from .models import Movie, Series, Category, Genre, Country, Banner, FilmCrew, Favorite, Rating, StreamManifest, WatchProgress, ChunkedUpload
+from .images import srcset
+from .eager import EagerLoadingMixin
+from . import delivery, favorites, uploads
+
+
+def get_title(instance):
+    """Фильм (сериал), к которому относится видео фильма или серии, или None для неактивной серии."""
+    if isinstance(instance, Series):
+        return instance.movie_serial if instance.is_active else None
+    return instance
+
+
+def get_signed_url(context, name, instance, depth=0):
+    """Подписанная ссылка на файл ``name`` для пользователя запроса из контекста или None."""
+    title = get_title(instance)
+    if title is None:
+        return None
+    return delivery.signed_url(context.get('request'), name, title, depth)
+
+
+def get_manifest_url(obj, context):
+    manifest = getattr(obj, 'stream_manifest', None)
+    if manifest is None or manifest.status != StreamManifest.READY:
+        return None
+    # Подписывается весь каталог нарезки: плейлисты ссылаются на куски относительно
+    depth = manifest.master_playlist.count('/')
+    signed = get_signed_url(context, manifest.master_playlist, obj, depth)
+    return signed or settings.MEDIA_URL + manifest.master_playlist
+
+
+class SignedFileField(serializers.FileField):
+    """Видеофайл фильма или серии: подписанная ссылка с ограниченным сроком, если смотреть можно."""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        signed = get_signed_url(self.context, value.name, value.instance)
+        if signed is None:
+            return super().to_representation(value)
+        return self.context['request'].build_absolute_uri(signed)
+
+
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """Уменьшенные копии картинки: {формат: {ширина: url}} или None."""
 
+    def to_representation(self, value):
+        return srcset(value)
+
+
+class BannerIndexSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    banner_image_srcset = ImageSrcsetField(source='banner_image')
 
-class BannerIndexSerializer(serializers.ModelSerializer):
     class Meta:
         model = Banner
         fields = ('__all__')
 
 
-class MovieIndexSerializer(serializers.ModelSerializer):
+class MovieIndexSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    poster_srcset = ImageSrcsetField(source='poster')
+
     class Meta:
         model = Movie
         fields = (
             'id',
             'title',
-            'poster'
+            'poster',
+            'poster_srcset',
         )
 
 
-class CategoriesDetailSerializer(serializers.ModelSerializer):
+class CategoriesDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Category
@@ -30,7 +85,7 @@ class CategoriesDetailSerializer(serializers.ModelSerializer):
         )
 
 
-class GenreDetailSerializer(serializers.ModelSerializer):
+class GenreDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = (
@@ -39,12 +94,12 @@ class GenreDetailSerializer(serializers.ModelSerializer):
         )
 
 
-class FilmCrewDetailSerializer(serializers.ModelSerializer):
+class FilmCrewDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = FilmCrew
         fields = ['name', 'position']
 
-class CountryDetailSerializer(serializers.ModelSerializer):
+class CountryDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Country
         fields = (
@@ -52,24 +107,44 @@ class CountryDetailSerializer(serializers.ModelSerializer):
             'title'
         )
 
-class SerialDetailSerializer(serializers.ModelSerializer):
+class SerialDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    series = SignedFileField(read_only=True)
+    watch_url = serializers.SerializerMethodField()
+    manifest_url = serializers.SerializerMethodField()
+
+    # Для подписи ссылок: активна ли серия и можно ли смотреть сериал
+    eager_only = ('is_active', 'movie_serial__is_active', 'movie_serial__age_rating')
+    eager_select_related = ('stream_manifest', 'movie_serial')
+
     class Meta:
         model = Series
         fields = (
             'id',
             'series',
             'number',
+            'watch_url',
+            'manifest_url',
         )
-class SeriesListSerializer(serializers.ModelSerializer):
+
+    def get_watch_url(self, obj):
+        signed = get_signed_url(self.context, obj.series.name, obj) if obj.series else None
+        return signed or reverse('series-watch', kwargs={'pk': obj.id})
+
+    def get_manifest_url(self, obj):
+        return get_manifest_url(obj, self.context)
+class SeriesListSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    image_srcset = ImageSrcsetField(source='image')
+
     class Meta:
         model = Series
         fields = (
             'id',
             'image',
+            'image_srcset',
             'number'
         )
 
-class MovieSerialDetailSerializer(serializers.ModelSerializer):
+class MovieSerialDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     genres = GenreDetailSerializer(many=True)
     movie_categories = CategoriesDetailSerializer(many=True)
     series_categories = CategoriesDetailSerializer(many=True)
@@ -77,7 +152,15 @@ class MovieSerialDetailSerializer(serializers.ModelSerializer):
     country = CountryDetailSerializer(many=True)
     average_rating = serializers.SerializerMethodField()
     watch_url = serializers.SerializerMethodField()
+    manifest_url = serializers.SerializerMethodField()
 
+    eager_only = ('is_film', 'rating_average', 'is_active', 'movie')
+    eager_select_related = ('stream_manifest',)
+    # Фильму нужны только категории фильмов, сериалу — категории сериалов
+    conditional_fields = {
+        'movie_categories': lambda movie: movie.is_film,
+        'series_categories': lambda movie: not movie.is_film,
+    }
 
     class Meta:
         model = Movie
@@ -96,31 +179,26 @@ class MovieSerialDetailSerializer(serializers.ModelSerializer):
             'genres',
             'country',
             'average_rating',
-            'watch_url'
+            'watch_url',
+            'manifest_url',
         )
 
     def get_average_rating(self, obj):
-        average = obj.ratings.aggregate(average=Avg('score'))['average']
-        return average if average is not None else 0
-
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-
-        if instance.is_film:
-            representation['series_categories'] = []
-
-        else:
-            representation['movie_categories'] = []
-
-        return representation
+        return obj.rating_average
 
     def get_watch_url(self, obj):
         if obj.is_film:
-            return f"/movies/{obj.id}/watch/"
+            signed = get_signed_url(self.context, obj.movie.name, obj) if obj.movie else None
+            return signed or reverse('movie-watch', kwargs={'pk': obj.id})
         else:
-            return f"/movies/{obj.id}/series/"
+            return reverse('series-list', kwargs={'movie_id': obj.id})
+
+    def get_manifest_url(self, obj):
+        return get_manifest_url(obj, self.context)
 
 class MovieDetail(serializers.ModelSerializer):
+    movie = SignedFileField(read_only=True)
+
     class Meta:
         model = Movie
         fields = (
@@ -148,7 +226,7 @@ class MovieSerialDetailUpdate(serializers.ModelSerializer):
         )
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Favorite
         fields = (
@@ -160,21 +238,42 @@ class FavoriteSerializer(serializers.ModelSerializer):
         return favorite
 
 
-class CategoryIndexSerializer(serializers.ModelSerializer):
+class FavoriteBatchSerializer(serializers.Serializer):
+    movies = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=True)
+
+    def validate_movies(self, value):
+        limit = favorites.get_batch_limit()
+        if len(value) > limit:
+            raise serializers.ValidationError(f'Не больше {limit} фильмов за запрос.')
+        # Порядок сохраняем, повторы убираем
+        return list(dict.fromkeys(value))
+
+
+class CategoryIndexSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    # Аннотация из материализованных счётчиков фасетов
+    count = serializers.IntegerField(source='facet_count', read_only=True)
+
     class Meta:
         model = Category
         fields = (
             'id',
             'title',
+            'count',
         )
 
 
-class GenreListSerializer(serializers.ModelSerializer):
+class GenreListSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    genre_img_srcset = ImageSrcsetField(source='genre_img')
+    count = serializers.IntegerField(source='facet_count', read_only=True)
+
     class Meta:
         model = Genre
         fields = ('__all__')
 
-class CountryListSerializer(serializers.ModelSerializer):
+class CountryListSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    country_img_srcset = ImageSrcsetField(source='country_img')
+    count = serializers.IntegerField(source='facet_count', read_only=True)
+
     class Meta:
         model = Country
         fields = ('__all__')
@@ -206,7 +305,9 @@ class SerialCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Series
         fields = (
+            'movie_serial',
             'number',
+            'image',
             'series'
         )
 class AddSerialCreateSerializer(serializers.ModelSerializer):
@@ -259,8 +360,61 @@ class RatingSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class RatingUpsertSerializer(serializers.Serializer):
+    movie = serializers.IntegerField(min_value=1)
+    score = serializers.IntegerField(min_value=1, max_value=10)
 
 
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChunkedUpload
+        fields = ('id', 'movie', 'series', 'filename', 'length', 'offset', 'status', 'created_date')
+        read_only_fields = ('offset', 'status', 'created_date')
+
+    def validate_filename(self, value):
+        # Только имя: каталог задаёт upload_to поля
+        name = os.path.basename(value.replace('\\', '/'))
+        if not name or name in ('.', '..'):
+            raise serializers.ValidationError('Некорректное имя файла')
+        return name
+
+    def validate_length(self, value):
+        if not 0 < value <= uploads.get_max_length():
+            raise serializers.ValidationError(f'Размер должен быть от 1 до {uploads.get_max_length()} байт')
+        return value
+
+    def validate(self, attrs):
+        if bool(attrs.get('movie')) == bool(attrs.get('series')):
+            raise serializers.ValidationError('Укажите либо фильм, либо серию')
+        return attrs
+
+
+class WatchHeartbeatSerializer(serializers.Serializer):
+    movie = serializers.IntegerField()
+    series = serializers.IntegerField(required=False, allow_null=True)
+    position = serializers.IntegerField(min_value=0)
+    duration = serializers.IntegerField(min_value=0)
+    final = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        # Фильм и серию не читаем на каждую отметку: они проверяются пачкой
+        # при записи (progress.existing)
+        if attrs['duration'] and attrs['position'] > attrs['duration']:
+            attrs['position'] = attrs['duration']
+        return attrs
+
+
+class ContinueWatchingSerializer(serializers.ModelSerializer):
+    movie = MovieIndexSerializer()
+    series_number = serializers.CharField(source='series.number', default=None)
 
-
-
+    class Meta:
+        model = WatchProgress
+        fields = (
+            'movie',
+            'series',
+            'series_number',
+            'position',
+            'duration',
+            'heartbeat_at',
+        )
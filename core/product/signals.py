@@ -0,0 +1,229 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Movie, Series, Category, Genre, Country, FilmCrew, Banner, Rating, FacetCount, StreamManifest, ChunkedUpload
+from . import cache, facets, images, ratings, search, transcoding, uploads
+
+
+@receiver(post_save, sender=Movie)
+def schedule_movie_transcoding(sender, instance, raw=False, **kwargs):
+    if not raw and instance.is_film:
+        transcoding.schedule(instance, instance.movie)
+
+
+@receiver(post_save, sender=Series)
+def schedule_series_transcoding(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transcoding.schedule(instance, instance.series)
+
+
+# Поисковый индекс
+
+def ensure_search_index(sender, **kwargs):
+    search.get_backend().ensure_index()
+
+
+@receiver(post_save, sender=Movie)
+def index_movie(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.update_index([instance.id])
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie(sender, instance, **kwargs):
+    search.remove_from_index([instance.id])
+
+
+def related_movies(instance):
+    return instance.movies if isinstance(instance, FilmCrew) else instance.movie_set
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+@receiver(m2m_changed, sender=Movie.country.through)
+@receiver(m2m_changed, sender=Movie.film_crews.through)
+def reindex_movie_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            search.update_index([instance.id])
+    elif action == 'pre_clear':
+        # После clear() связей уже нет, поэтому фильмы запоминаем заранее
+        instance._search_movie_ids = list(related_movies(instance).values_list('id', flat=True))
+    elif action == 'post_clear':
+        search.update_index(instance.__dict__.pop('_search_movie_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        search.update_index(pk_set)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=FilmCrew)
+def reindex_related_movies(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.update_index(related_movies(instance).values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Country)
+@receiver(pre_delete, sender=FilmCrew)
+def remember_related_movies(sender, instance, **kwargs):
+    instance._search_movie_ids = list(related_movies(instance).values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=FilmCrew)
+def reindex_after_relation_delete(sender, instance, **kwargs):
+    search.update_index(instance.__dict__.pop('_search_movie_ids', []))
+
+
+# Агрегаты оценок: добавление и изменение учитываются во вьюхах,
+# удаление (в том числе каскадное) — здесь
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_aggregates(sender, instance, **kwargs):
+    ratings.rating_removed(instance)
+
+
+# Счётчики фасетов
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+@receiver(m2m_changed, sender=Movie.country.through)
+@receiver(m2m_changed, sender=Movie.movie_categories.through)
+@receiver(m2m_changed, sender=Movie.series_categories.through)
+def update_relation_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # После clear() связей уже нет, поэтому запоминаем их заранее
+        instance.__dict__.setdefault('_facet_relations', {})[sender] = facets.current_relations(
+            sender, instance, reverse
+        )
+    elif action == 'post_clear':
+        relations = instance.__dict__.get('_facet_relations', {}).pop(sender, [])
+        facets.relations_changed(sender, relations, -1)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        relations = facets.changed_relations(instance, reverse, pk_set)
+        facets.relations_changed(sender, relations, 1 if action == 'post_add' else -1)
+
+
+@receiver(pre_save, sender=Movie)
+def remember_movie_type(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding or (update_fields is not None and 'is_film' not in update_fields):
+        return
+    instance._facet_was_film = Movie.objects.filter(pk=instance.pk).values_list('is_film', flat=True).first()
+
+
+@receiver(post_save, sender=Movie)
+def update_movie_facets(sender, instance, created, **kwargs):
+    was_film = instance.__dict__.pop('_facet_was_film', None)
+    if created:
+        facets.movie_added(instance)
+    elif was_film is not None and was_film != instance.is_film:
+        facets.movie_type_changed(instance, was_film)
+
+
+@receiver(pre_delete, sender=Movie)
+def remove_movie_from_facets(sender, instance, **kwargs):
+    facets.movie_removed(instance)
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Category)
+def remove_facet_value(sender, instance, **kwargs):
+    names = {
+        Genre: [FacetCount.GENRE],
+        Country: [FacetCount.COUNTRY],
+        Category: [FacetCount.MOVIE_CATEGORY, FacetCount.SERIES_CATEGORY],
+    }
+    facets.value_removed(names[sender], instance.pk)
+
+
+# Кэш ответов: каждое изменение сбрасывает только свой тег
+
+CACHE_TAGS = {
+    Series: 'series',
+    Category: 'category',
+    Genre: 'genre',
+    Country: 'country',
+    FilmCrew: 'filmcrew',
+    Banner: 'banner',
+    # Готовый HLS-манифест меняет manifest_url в ответах
+    StreamManifest: 'media',
+}
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def invalidate_movie_cache(sender, instance, **kwargs):
+    cache.invalidate('movie', f'movie:{instance.id}')
+
+
+def invalidate_catalog_cache(sender, **kwargs):
+    cache.invalidate(CACHE_TAGS[sender])
+
+
+# Приёмники подключаются к своим моделям, а не ко всем: приёмник post_delete
+# без sender отключил бы быстрое удаление (без SELECT) во всём проекте
+for model in CACHE_TAGS:
+    post_save.connect(invalidate_catalog_cache, sender=model)
+    post_delete.connect(invalidate_catalog_cache, sender=model)
+
+
+RELATION_CACHE_TAGS = {
+    Series.categories.through: 'series',
+    Movie.series.through: 'movie',
+    Movie.movie_categories.through: 'movie',
+    Movie.series_categories.through: 'movie',
+    Movie.genres.through: 'movie',
+    Movie.country.through: 'movie',
+    Movie.film_crews.through: 'movie',
+}
+
+
+def invalidate_relations_cache(sender, action, **kwargs):
+    if action.startswith('post_'):
+        cache.invalidate(RELATION_CACHE_TAGS[sender])
+
+
+for through in RELATION_CACHE_TAGS:
+    m2m_changed.connect(invalidate_relations_cache, sender=through)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_rating_cache(sender, instance, **kwargs):
+    cache.invalidate('rating', f'movie:{instance.movie_id}')
+
+
+# Уменьшенные копии картинок
+
+IMAGE_FIELDS = {
+    Movie: 'poster',
+    Banner: 'banner_image',
+    Series: 'image',
+    Category: 'image',
+    Genre: 'genre_img',
+    Country: 'country_img',
+    FilmCrew: 'image',
+}
+
+
+def schedule_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    field_file = getattr(instance, IMAGE_FIELDS[sender])
+    if field_file:
+        transaction.on_commit(lambda: images.schedule(field_file))
+
+
+for model in IMAGE_FIELDS:
+    post_save.connect(schedule_image_derivatives, sender=model)
+
+
+# Загрузки по частям: отменённая или удалённая вместе с фильмом сессия
+# не оставляет недокачанный файл
+
+@receiver(post_delete, sender=ChunkedUpload)
+def remove_upload_part(sender, instance, **kwargs):
+    if instance.status == ChunkedUpload.UPLOADING:
+        transaction.on_commit(lambda: uploads.remove_part(instance))
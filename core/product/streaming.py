@@ -0,0 +1,208 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import get_random_string
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+MAX_RANGES = 16
+
+
+def get_chunk_size():
+    return getattr(settings, 'MEDIA_STREAM_CHUNK_SIZE', 64 * 1024)
+
+
+def file_etag(stat):
+    # Сильный ETag из времени изменения и размера — без чтения файла
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range вида ``bytes=0-99,200-,-500``.
+
+    Возвращает список пар (start, end) включительно, пустой список, если ни
+    один диапазон не попадает в файл (416), или None, если заголовок
+    некорректен и его нужно проигнорировать (отдаём весь файл).
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        start, sep, end = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                # Суффикс: последние N байт
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        if start > end:
+            return None
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _merge_ranges(ranges)
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) == date
+
+
+class RangeFile:
+    """
+    Файл, ограниченный одним диапазоном байт.
+
+    Отдаёт ``fileno()``, поэтому ``wsgi.file_wrapper`` сервера (например,
+    gunicorn) передаёт диапазон через sendfile начиная с текущей позиции и
+    не больше Content-Length. Без file_wrapper Django читает его блоками
+    через ``read()``, который не выходит за конец диапазона.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _read_range(file, start, end, chunk_size):
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = file.read(min(chunk_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _multipart_ranges(file, ranges, size, content_type, boundary, chunk_size):
+    try:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            yield from _read_range(file, start, end, chunk_size)
+        yield f'\r\n--{boundary}--\r\n'.encode()
+    finally:
+        file.close()
+
+
+def _multipart_length(ranges, size, content_type, boundary):
+    length = len(f'\r\n--{boundary}--\r\n')
+    for start, end in ranges:
+        length += len(
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        )
+        length += end - start + 1
+    return length
+
+
+def stream_file(request, field_file):
+    """Отдаёт файл из FileField, см. ``stream_path``."""
+    return stream_path(request, field_file.path)
+
+
+def stream_path(request, path):
+    """
+    Отдаёт файл с поддержкой Range, If-Range и ETag.
+
+    Без Range (или если If-Range не совпал) — 200 со всем файлом, один
+    диапазон — 206 с Content-Range, несколько — 206 multipart/byteranges.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = stat.st_mtime
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    ranges = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and if_range_passes(request, etag, last_modified):
+        ranges = parse_range_header(range_header, size)
+
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif not ranges:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response.block_size = get_chunk_size()
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(
+            RangeFile(open(path, 'rb'), start, end - start + 1),
+            content_type=content_type,
+            status=206,
+        )
+        response.block_size = get_chunk_size()
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        boundary = get_random_string(32)
+        response = StreamingHttpResponse(
+            _multipart_ranges(open(path, 'rb'), ranges, size, content_type, boundary, get_chunk_size()),
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            status=206,
+        )
+        response['Content-Length'] = _multipart_length(ranges, size, content_type, boundary)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
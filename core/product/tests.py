@@ -1,3 +1,1271 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models.fields.files import FieldFile
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from rest_framework.exceptions import NotFound
+
+from user import authentication
+from user.models import MyUser
+from user.serializers import ClaimsTokenObtainPairSerializer
+
+from core.instrumentation import QueryBudgetExceeded
+
+from . import facets, images, progress, ratings, search, serializers, transcoding, uploads, url_signing, views
+from .catalog_io import export_csv, import_catalog
+from .delivery import find_title
+from .management.commands import explain_queries
+from .renderers import ColumnarJSONRenderer
+from .models import (
+    Category, ChunkedUpload, Country, FacetCount, Favorite, FilmCrew, Genre, Movie, Rating, Series, StreamManifest,
+    WatchProgress,
+)
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class SearchWithoutHitsTests(TestCase):
+    """Поиск без совпадений и пустой поиск отдают пустые списки, а не 500."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Категория', image='category_img/c.jpg')
+        cls.genre = Genre.objects.create(title='Жанр', genre_img='genre_img/g.jpg')
+        cls.country = Country.objects.create(title='Страна', country_img='country_img/c.jpg')
+        movie = Movie.objects.create(
+            title='Фильм', description='', release_date='2020-01-01', production_year=2020, rating=5,
+            duration=90, poster='poster_image/p.jpg', age_rating='16+', is_film=True,
+        )
+        movie.movie_categories.add(cls.category)
+        movie.series_categories.add(cls.category)
+        movie.genres.add(cls.genre)
+        movie.country.add(cls.country)
+
+    def get_urls(self):
+        lists = [
+            f'movies/category/{self.category.id}/',
+            f'series/category/{self.category.id}/',
+            f'genre/{self.genre.id}/',
+            f'country/{self.country.id}/',
+        ]
+        return ['/api/index/', '/api/async/index/', '/api/facets/',
+                *[f'/api/{path}' for path in lists], *[f'/api/async/{path}' for path in lists]]
+
+    def test_no_hits(self):
+        for url in self.get_urls():
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, {'search': 'zzzqx'}).status_code, 200)
+
+    def test_empty_query(self):
+        for url in self.get_urls():
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, {'search': ''}).status_code, 200)
+
+    def test_no_hits_is_empty(self):
+        data = self.client.get('/api/index/', {'search': 'zzzqx'}).json()
+        self.assertEqual((data['movies'], data['serials']), ([], []))
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class CatalogImportErrorsTests(TestCase):
+    """Плохая строка импорта попадает в отчёт, а остальные записываются."""
+
+    def movie(self, **fields):
+        record = {
+            'title': 'Фильм', 'description': '', 'release_date': '2020-01-01', 'production_year': 2020,
+            'rating': 7, 'duration': 120, 'poster': 'poster_image/1.jpeg', 'age_rating': '16+', 'is_film': True,
+        }
+        return json.dumps({**record, **fields})
+
+    def run_import(self, lines, batch_size=1000):
+        return import_catalog(io.StringIO('\n'.join(lines)), batch_size=batch_size).as_dict()
+
+    def test_bad_rows_reported_per_line(self):
+        stats = self.run_import([
+            self.movie(title='Первый'),
+            '[1, 2]',
+            self.movie(is_film='false', title='Сериал'),
+            self.movie(budget='много'),
+            self.movie(duration=-5),
+            self.movie(genres='Драма'),
+            self.movie(title='Последний'),
+        ])
+        self.assertEqual([error['line'] for error in stats['errors']], [2, 4, 5, 6])
+        self.assertEqual(
+            sorted(Movie.objects.values_list('title', 'is_film')),
+            [('Первый', True), ('Последний', True), ('Сериал', False)],
+        )
+
+    def test_failed_batch_retried_row_by_row(self):
+        bulk_create = Movie.objects.bulk_create
+
+        def failing_bulk_create(objs, *args, **kwargs):
+            if any(movie.title == 'Сбой' for movie in objs):
+                raise IntegrityError('CHECK constraint failed')
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Movie.objects, 'bulk_create', side_effect=failing_bulk_create):
+            stats = self.run_import([self.movie(title=f'Фильм {number}') for number in range(5)]
+                                    + [self.movie(title='Сбой')], batch_size=10)
+        self.assertEqual([error['line'] for error in stats['errors']], [6])
+        self.assertEqual(Movie.objects.count(), 5)
+
+    def test_lookups_created_with_their_batch(self):
+        bulk_create = Movie.objects.bulk_create
+
+        def failing_bulk_create(objs, *args, **kwargs):
+            if any(movie.title == 'Сбой' for movie in objs):
+                raise IntegrityError('CHECK constraint failed')
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Movie.objects, 'bulk_create', side_effect=failing_bulk_create):
+            stats = self.run_import([
+                self.movie(title='Первый', genres=['Новый']),
+                self.movie(title='Сбой', genres=['Новый', 'Только у сбоя'], country=['Нигде']),
+                self.movie(title='Второй', genres=['Новый'], categories=['Новинки']),
+            ], batch_size=10)
+        self.assertEqual([error['line'] for error in stats['errors']], [2])
+        self.assertEqual(list(Genre.objects.values_list('title', flat=True)), ['Новый'])
+        self.assertFalse(Country.objects.exists())
+        self.assertEqual(stats['created'], {'genre': 1, 'category': 1, 'movie': 2, 'series': 0})
+        self.assertEqual(Movie.objects.get(title='Второй').genres.get().title, 'Новый')
+
+    def test_lookup_names_validated(self):
+        stats = self.run_import([self.movie(genres=['Ж' * 101]), self.movie(title='Второй', country=['Страна'])])
+        self.assertEqual([error['line'] for error in stats['errors']], [1])
+        self.assertFalse(Genre.objects.exists())
+        self.assertEqual(list(Country.objects.values_list('title', flat=True)), ['Страна'])
+
+    def test_csv_round_trip_keeps_film_crews(self):
+        crew = FilmCrew.objects.create(name='Иван Иванов', birth_date='1970-01-01', birthplace='Москва',
+                                       position='Режиссёр')
+        movie = create_movie('Фильм с группой')
+        movie.film_crews.add(crew)
+        exported = ''.join(export_csv())
+        Movie.objects.all().delete()
+        FilmCrew.objects.all().delete()
+
+        stats = import_catalog(io.StringIO(exported), 'csv').as_dict()
+        self.assertEqual(stats['errors'], [])
+        crew = FilmCrew.objects.get()
+        self.assertEqual((crew.name, crew.birthplace, crew.position), ('Иван Иванов', 'Москва', 'Режиссёр'))
+        self.assertEqual(list(Movie.objects.get().film_crews.all()), [crew])
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class ConditionalResponseTests(TestCase):
+    """ETag и Last-Modified из версий тегов в базе — при любом бэкенде кэша."""
+
+    def assertNotModified(self, url):
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        cache.clear()
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        return response['ETag']
+
+    def test_not_modified(self):
+        for url in ('/api/genres/', '/api/index/'):
+            with self.subTest(url=url):
+                self.assertNotModified(url)
+
+    def test_write_changes_validators(self):
+        etag = self.assertNotModified('/api/genres/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Genre.objects.create(title='Новый', genre_img='genre_img/n.jpg')
+        # Версия в базе: кэш процесса её не хранит
+        cache.clear()
+        response = self.client.get('/api/genres/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+
+class ReuploadingTranscoder(transcoding.FakeTranscoder):
+    """Посреди нарезки первого качества исходник загружают заново."""
+    movie = None
+
+    def transcode(self, source, target_dir, height, bitrate):
+        count = super().transcode(source, target_dir, height, bitrate)
+        if self.movie is not None:
+            movie, ReuploadingTranscoder.movie = self.movie, None
+            movie.movie.name = 'movies/second.mp4'
+            transcoding.schedule(movie, movie.movie)
+        return count
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=(), HLS_LADDER=((144, 1), (360, 2)),
+                   HLS_TRANSCODER='product.tests.ReuploadingTranscoder')
+class TranscodingGenerationTests(TestCase):
+    """Повторная загрузка во время нарезки не портит нарезку нового файла."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        os.makedirs(os.path.join(media_root.name, 'movies'))
+        for name in ('first.mp4', 'second.mp4'):
+            with open(os.path.join(media_root.name, 'movies', name), 'wb') as video:
+                video.write(b'0' * 10)
+        self.media_root = media_root.name
+
+    def test_superseded_job_bails_out(self):
+        movie = Movie.objects.create(
+            title='Фильм', description='', release_date='2020-01-01', production_year=2020, rating=5,
+            duration=90, poster='poster_image/p.jpg', age_rating='16+', is_film=True, movie='movies/first.mp4',
+        )
+        manifest = movie.stream_manifest
+        ReuploadingTranscoder.movie = movie
+
+        self.assertIsNone(transcoding.process_manifest(manifest.id))
+        manifest.refresh_from_db()
+        self.assertEqual((manifest.source, manifest.generation, manifest.status),
+                         ('movies/second.mp4', 2, StreamManifest.PENDING))
+        self.assertEqual(set(manifest.renditions.values_list('status', flat=True)), {StreamManifest.PENDING})
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'hls', 'movie', str(movie.id), 'v1')))
+
+        manifest = transcoding.process_manifest(manifest.id)
+        self.assertEqual((manifest.status, manifest.master_playlist),
+                         (StreamManifest.READY, f'hls/movie/{movie.id}/v2/master.m3u8'))
+        self.assertEqual(manifest.renditions.filter(status=StreamManifest.READY).count(), 2)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'hls', 'movie', str(movie.id))), ['v2'])
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class MediaAccessTests(TestCase):
+    """Видео защищено по имени в базе, а не по каталогу, куда его положили."""
+
+    @classmethod
+    def setUpTestData(cls):
+        fields = {
+            'description': '', 'release_date': '2020-01-01', 'production_year': 2020, 'rating': 5,
+            'duration': 90, 'poster': 'poster_image/p.jpg', 'age_rating': '16+',
+        }
+        cls.film = Movie.objects.create(title='Фильм', is_film=True, movie='imported/film.mp4', **fields)
+        serial = Movie.objects.create(title='Сериал', is_film=False, **fields)
+        Series.objects.create(movie_serial=serial, number='1', image='image_serial/1.jpg', series='imported/1.bin')
+        Series.objects.create(movie_serial=serial, number='2', image='image_serial/2.jpg', series='imported/2.bin',
+                              is_active=False)
+        cls.serial = serial
+
+    def test_imported_paths_are_protected(self):
+        self.assertEqual(find_title('imported/film.mp4'), self.film)
+        self.assertEqual(find_title('imported/1.bin'), self.serial)
+        self.assertEqual(self.client.get('/media/imported/film.mp4').status_code, 401)
+
+    def test_unknown_and_inactive_videos_are_denied(self):
+        for name in ('imported/2.bin', 'other/film.mp4', 'other/master.m3u8', 'media/movie_film/film.bin'):
+            with self.subTest(name=name), self.assertRaises(NotFound):
+                find_title(name)
+
+    def test_other_files_are_public(self):
+        self.assertIsNone(find_title('poster_image/p.jpg'))
+        self.assertIsNone(find_title('docs/rules.pdf'))
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class IndexSearchPaginationTests(TestCase):
+    """Страницы главной с поиском идут в порядке релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for title in ('Другое', 'Звёздный путь', 'Звёздные войны', 'Путь', 'Звёздный десант', 'Звезда'):
+            Movie.objects.create(
+                title=title, description='', release_date='2020-01-01', production_year=2020, rating=5,
+                duration=90, poster='poster_image/p.jpg', age_rating='16+', is_film=True,
+            )
+        search.rebuild_index()
+
+    def walk(self, url):
+        titles, params = [], {'search': 'звёздный', 'limit': 1}
+        while True:
+            data = self.client.get(url, params).json()
+            titles += [movie['title'] for movie in data['movies']]
+            if not data['movies_next']:
+                return titles
+            params['movies_cursor'] = data['movies_next']
+
+    def test_pages_follow_relevance(self):
+        expected = [Movie.objects.get(pk=pk).title for pk in search.search_movie_ids('звёздный')]
+        self.assertGreater(len(expected), 1)
+        for url in ('/api/index/', '/api/async/index/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.walk(url), expected)
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class AsyncMovieDetailTests(TestCase):
+    """Асинхронная карточка фильма грузится по тому же плану, что и синхронная."""
+
+    def test_same_queries_as_sync(self):
+        movie = Movie.objects.create(
+            title='Фильм', description='', release_date='2020-01-01', production_year=2020, rating=5,
+            duration=90, poster='poster_image/p.jpg', age_rating='16+', is_film=True,
+        )
+        counts = []
+        for url in (f'/api/index/{movie.id}/', f'/api/async/index/{movie.id}/'):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(IMAGE_DERIVATIVE_WIDTHS=(16,), IMAGE_DERIVATIVE_FORMATS=('jpeg',))
+class ImageDerivativesTests(TestCase):
+    """Копии картинок различают расширение оригинала, а готовность берётся из кэша."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        cache.clear()
+        for name, color in (('a.jpg', 'red'), ('a.png', 'blue')):
+            Image.new('RGB', (32, 32), color).save(os.path.join(media_root.name, name))
+
+    def test_extensions_do_not_collide(self):
+        self.assertNotEqual(images.derivative_name('a.jpg', 16, 'jpeg'), images.derivative_name('a.png', 16, 'jpeg'))
+        images.generate('a.jpg')
+        self.assertTrue(images.is_ready('a.jpg'))
+        self.assertFalse(images.is_ready('a.png'))
+
+    def test_readiness_is_cached(self):
+        images.generate('a.jpg')
+        with mock.patch.object(images.default_storage, 'exists', wraps=images.default_storage.exists) as exists:
+            self.assertIsNotNone(images.srcset(FieldFile(None, mock.Mock(storage=None), 'a.jpg')))
+            self.assertFalse(images.is_ready('a.png'))
+            self.assertFalse(images.is_ready('a.png'))
+        self.assertEqual(exists.call_count, 1)
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class SearchFilteredListTests(TestCase):
+    """Поиск в отфильтрованном списке ранжирует совпадения внутри фильтра, без списка id."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(title='Жанр', genre_img='genre_img/g.jpg')
+        # Вне жанра — совпадения сильнее, чем внутри
+        for number in range(5):
+            create_movie(f'Звезда звезда {number}', description='звезда')
+        cls.by_title = create_movie('Звезда', description='')
+        cls.by_description = create_movie('Фильм', description='далёкая звезда')
+        for movie in (cls.by_title, cls.by_description):
+            movie.genres.add(cls.genre)
+        search.rebuild_index()
+
+    def test_matches_inside_filter(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(f'/api/genre/{self.genre.id}/', {'search': 'звезда'}).json()
+        self.assertEqual([movie['title'] for movie in data['results']], ['Звезда', 'Фильм'])
+        self.assertFalse(any('CASE WHEN' in query['sql'] for query in queries))
+
+    def test_facet_count_inside_filter(self):
+        data = self.client.get('/api/facets/', {'search': 'звезда', 'genres': self.genre.id}).json()
+        self.assertEqual(data['count'], 2)
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class ColumnarRendererTests(TestCase):
+    """Колонки — только для списков объектов; остальное остаётся как было."""
+
+    def render(self, data):
+        return json.loads(ColumnarJSONRenderer().render(data))
+
+    def test_empty_list(self):
+        self.assertEqual(self.render({'movies': [], 'missing': []}), {'movies': [], 'missing': []})
+        self.assertEqual(self.render([]), [])
+
+    def test_id_list(self):
+        self.assertEqual(self.render({'movies': [1, 2], 'missing': [3]}), {'movies': [1, 2], 'missing': [3]})
+
+    def test_paginated_results(self):
+        Genre.objects.create(title='Драма', genre_img='genre_img/d.jpg')
+        Genre.objects.create(title='Комедия', genre_img='genre_img/k.jpg')
+        response = self.client.get('/api/genres/', HTTP_ACCEPT='application/vnd.columnar+json')
+        plain = self.client.get('/api/genres/').json()
+        data = response.json()
+        if isinstance(plain, dict):
+            plain, data = plain['results'], data['results']
+        self.assertEqual(data['columns'], list(plain[0]))
+        self.assertEqual(data['rows'], [list(row.values()) for row in plain])
+
+    def test_keyset_page(self):
+        data = self.render({'next': None, 'previous': None, 'results': [{'id': 2, 'title': 'б'}, {'id': 1, 'title': 'а'}]})
+        self.assertEqual(data['results'], {'columns': ['id', 'title'], 'rows': [[2, 'б'], [1, 'а']]})
+        self.assertIsNone(data['next'])
+
+
+def create_movie(title='Фильм', **fields):
+    return Movie.objects.create(**{
+        'title': title, 'description': '', 'release_date': '2020-01-01', 'production_year': 2020, 'rating': 5,
+        'duration': 90, 'poster': 'poster_image/p.jpg', 'age_rating': '16+', 'is_film': True, **fields,
+    })
+
+
+def auth_headers(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {ClaimsTokenObtainPairSerializer.get_token(user).access_token}'}
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class RatingUpsertTests(TestCase):
+    """Оценки upsert'ом: созданная или изменённая, агрегаты на разницу, буфер."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            MyUser.objects.create_user(phone_number=f'+7000000010{number}', username='u', password='!')
+            for number in range(2)
+        ]
+        cls.movies = [create_movie(f'Фильм {number}') for number in range(2)]
+
+    def aggregates(self, movie):
+        movie.refresh_from_db()
+        return movie.rating_sum, movie.rating_count, movie.rating_average
+
+    def post(self, user, movie, score):
+        return self.client.post('/api/ratings/', {'movie': movie.id, 'score': score},
+                                content_type='application/json', **auth_headers(user))
+
+    def test_created_then_updated(self):
+        movie = self.movies[0]
+        self.assertEqual(self.post(self.users[0], movie, 6).status_code, 201)
+        self.assertEqual(self.post(self.users[1], movie, 8).status_code, 201)
+        self.assertEqual(self.aggregates(movie), (14, 2, 7.0))
+        self.assertEqual(self.post(self.users[0], movie, 10).status_code, 200)
+        self.assertEqual(self.aggregates(movie), (18, 2, 9.0))
+
+    def test_last_wins(self):
+        user, movie = self.users[0], self.movies[0]
+        created = ratings.upsert([
+            {'user': user.id, 'movie': movie.id, 'score': 3},
+            {'user': user.id, 'movie': movie.id, 'score': 9},
+            {'user': user.id, 'movie': self.movies[1].id, 'score': 4},
+        ])
+        self.assertEqual(created, {(user.id, movie.id), (user.id, self.movies[1].id)})
+        self.assertEqual(Rating.objects.get(user=user, movie=movie).score, 9)
+        self.assertEqual(self.aggregates(movie), (9, 1, 9.0))
+
+    def test_buffered_flush(self):
+        buffer = ratings.RatingBuffer()
+        user = self.users[0]
+        buffer.record(user.id, self.movies[0].id, 2)
+        buffer.record(user.id, self.movies[0].id, 7)
+        buffer.record(user.id, self.movies[1].id, 5)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(Rating.objects.get(user=user, movie=self.movies[0]).score, 7)
+        self.assertEqual(self.aggregates(self.movies[0]), (7, 1, 7.0))
+
+    def test_failed_flush_keeps_entries(self):
+        buffer = ratings.RatingBuffer()
+        user = self.users[0]
+        buffer.record(user.id, self.movies[0].id, 2)
+        buffer.record(user.id, self.movies[1].id, 3)
+        with mock.patch.object(ratings, 'upsert', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        # Пока сброс падал, пришла новая оценка — она новее и остаётся
+        buffer.record(user.id, self.movies[0].id, 8)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(
+            sorted(Rating.objects.filter(user=user).values_list('movie_id', 'score')),
+            [(self.movies[0].id, 8), (self.movies[1].id, 3)],
+        )
+
+
+class WatchProgressTests(TestCase):
+    """Отметки прогресса: объединение в буфере, сразу записанный final и «Продолжить просмотр»."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone_number='+70000000200', username='u', password='!')
+        cls.film = create_movie('Фильм')
+        cls.serial = create_movie('Сериал', is_film=False)
+        cls.series = Series.objects.create(movie_serial=cls.serial, number='1', image='image_serial/1.jpg',
+                                           series='imported/1.bin')
+
+    def setUp(self):
+        # Свой буфер на тест и без фонового потока — сбрасываем вручную
+        self.buffer = progress.ProgressBuffer()
+        patcher = mock.patch.object(progress, 'buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer.start = mock.Mock()
+
+    def heartbeat(self, movie, position, series=None, final=False, duration=100):
+        data = {'movie': movie, 'series': series, 'position': position, 'duration': duration, 'final': final}
+        return self.client.post('/api/progress/heartbeat/', data, content_type='application/json',
+                                **auth_headers(self.user))
+
+    def test_heartbeats_coalesce_without_reads(self):
+        # Отметка не читает фильм: проверка откладывается до сброса
+        self.heartbeat(self.film.id, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.heartbeat(self.film.id, 5).status_code, 204)
+        self.heartbeat(self.serial.id, 7, series=self.series.id)
+        self.assertFalse(WatchProgress.objects.exists())
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            sorted(WatchProgress.objects.values_list('movie_id', 'series_id', 'position')),
+            [(self.film.id, None, 5), (self.serial.id, self.series.id, 7)],
+        )
+
+    def test_flush_drops_missing_and_foreign_series(self):
+        missing = Movie.objects.order_by('-pk').first().pk + 100
+        self.heartbeat(missing, 3)
+        self.heartbeat(self.film.id, 4, series=self.series.id)
+        self.heartbeat(self.serial.id, 5, series=self.series.id)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(list(WatchProgress.objects.values_list('movie_id', 'position')), [(self.serial.id, 5)])
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_final_is_written_at_once(self):
+        self.heartbeat(self.film.id, 10)
+        self.assertEqual(self.heartbeat(self.film.id, 20, final=True).status_code, 204)
+        self.assertEqual(WatchProgress.objects.get(movie=self.film).position, 20)
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_final_for_missing_movie(self):
+        missing = Movie.objects.order_by('-pk').first().pk + 100
+        self.assertEqual(self.heartbeat(missing, 20, final=True).status_code, 204)
+        self.assertFalse(WatchProgress.objects.exists())
+
+    def test_final_kept_when_write_fails(self):
+        with mock.patch.object(progress, 'upsert', side_effect=OperationalError('database is locked')):
+            self.assertEqual(self.heartbeat(self.film.id, 20, final=True).status_code, 204)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(WatchProgress.objects.get(movie=self.film).position, 20)
+
+    def test_continue_watching_merges_pending(self):
+        self.heartbeat(self.film.id, 30, final=True)
+        self.heartbeat(self.film.id, 40)
+        self.heartbeat(self.serial.id, 10, series=self.series.id)
+        # Досмотренное не показываем
+        self.heartbeat(create_movie('Досмотренный').id, 99)
+        missing = Movie.objects.order_by('-pk').first().pk + 100
+        self.heartbeat(missing, 5)
+        response = self.client.get('/api/progress/', **auth_headers(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['movie']['id'], row['series_number'], row['position']) for row in response.json()],
+            [(self.serial.id, '1', 10), (self.film.id, None, 40)],
+        )
+
+
+class HotQueryPlanTests(TestCase):
+    """
+    Горячие списки каталога идут по своим индексам без сортировки всей
+    выборки — те же случаи, что печатает ``manage.py explain_queries``.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = explain_queries.seed(2000)
+
+    def check_plans(self):
+        for name, view_class, kwarg, params, indexes, presorted in explain_queries.HOT_QUERIES:
+            with self.subTest(name):
+                plan = explain_queries.build_queryset(view_class, kwarg, params, self.ids).explain()
+                self.assertEqual(explain_queries.check_plan(plan, indexes, presorted), [], plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'нужен SQLite')
+    def test_sqlite_plans(self):
+        self.check_plans()
+
+    @skipUnless(connection.vendor == 'postgresql', 'Postgres не настроен')
+    def test_postgres_plans(self):
+        self.check_plans()
+
+
+class CleanDurationsTests(TestCase):
+    """Старые текстовые продолжительности приводятся к минутам перед сменой типа столбца."""
+
+    def test_text_values(self):
+        values = {'120': 120, ' 95 мин': 95, '1 ч 30 мин': 90, '2h': 120, '1:45': 105, 'нет данных': 0}
+        movies = {create_movie(text): minutes for text, minutes in values.items()}
+        with connection.cursor() as cursor:
+            # SQLite хранит строку в целочисленном столбце как есть — как в старой схеме
+            cursor.executemany('UPDATE product_movie SET duration = %s WHERE id = %s',
+                               [(text, movie.id) for movie, text in zip(movies, values)])
+        call_command('clean_durations', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual({movie.id: movie.duration for movie in Movie.objects.all()},
+                         {movie.id: minutes for movie, minutes in movies.items()})
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    """Вьюхи укладываются в объявленный query_budget; строгий режим превращает превышение в ошибку."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone_number='+70000000300', username='u', password='!')
+        genres = Genre.objects.bulk_create([Genre(title=f'Жанр {number}', genre_img='genre_img/g.jpg') for number in range(2)])
+        countries = Country.objects.bulk_create([Country(title='Страна', country_img='country_img/c.jpg')])
+        categories = Category.objects.bulk_create([Category(title='Категория', image='category_img/c.jpg')])
+        crews = FilmCrew.objects.bulk_create([
+            FilmCrew(name=f'Актёр {number}', birth_date='1980-01-01', birthplace='', position='Актёр')
+            for number in range(2)
+        ])
+        cls.movies = []
+        for number in range(3):
+            movie = create_movie(f'Фильм {number}')
+            movie.genres.set(genres)
+            movie.country.set(countries)
+            movie.movie_categories.set(categories)
+            movie.film_crews.set(crews)
+            cls.movies.append(movie)
+            Favorite.objects.create(user=cls.user, movie=movie)
+        cls.serial = create_movie('Сериал', is_film=False)
+        cls.series = [
+            Series.objects.create(movie_serial=cls.serial, number=str(number), image='image_serial/1.jpg',
+                                  series='imported/1.bin')
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_within_budget(self):
+        urls = (f'/api/index/{self.movies[0].id}/', f'/api/index/series/{self.series[0].id}/',
+                f'/api/serial/{self.serial.id}/series/', '/api/favorites/', '/api/genres/', '/api/movie/')
+        for url in urls:
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url, **auth_headers(self.user)).status_code, 200)
+
+    def test_strict_budget_raises(self):
+        with mock.patch.object(views.SeriesDetailView, 'query_budget', 1):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(f'/api/index/series/{self.series[0].id}/')
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=(), MEDIA_DELIVERY='django')
+class RangeStreamingTests(TestCase):
+    """Просмотр отдаёт диапазоны: один, несколько (multipart), 416 и If-Range."""
+
+    data = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone_number='+70000000400', username='u', password='!')
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        os.makedirs(os.path.join(media_root.name, 'movies'))
+        with open(os.path.join(media_root.name, 'movies', 'film.mp4'), 'wb') as video:
+            video.write(self.data)
+        self.movie = create_movie(movie='movies/film.mp4')
+
+    def watch(self, **headers):
+        response = self.client.get(f'/api/movies/{self.movie.id}/watch/', **auth_headers(self.user), **headers)
+        if response.streaming:
+            response.body = b''.join(response.streaming_content)
+            response.close()
+        return response
+
+    def test_single_range(self):
+        response = self.watch(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.body, self.data[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Cache-Control'], 'private')
+
+    def test_open_and_suffix_ranges(self):
+        self.assertEqual(self.watch(HTTP_RANGE='bytes=1020-').body, self.data[1020:])
+        self.assertEqual(self.watch(HTTP_RANGE='bytes=-4').body, self.data[-4:])
+        # Пересекающиеся диапазоны сливаются в один
+        response = self.watch(HTTP_RANGE='bytes=0-5,3-9')
+        self.assertEqual((response['Content-Range'], response.body), ('bytes 0-9/1024', self.data[:10]))
+
+    def test_multipart(self):
+        response = self.watch(HTTP_RANGE='bytes=0-1,100-103')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        self.assertEqual(int(response['Content-Length']), len(response.body))
+        parts = response.body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        self.assertIn(b'Content-Range: bytes 0-1/1024\r\n\r\n' + self.data[:2] + b'\r\n', parts[1])
+        self.assertIn(b'Content-Range: bytes 100-103/1024\r\n\r\n' + self.data[100:104] + b'\r\n', parts[2])
+
+    def test_unsatisfiable_and_invalid(self):
+        response = self.watch(HTTP_RANGE='bytes=2000-3000')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+        # Некорректный заголовок игнорируется — весь файл
+        response = self.watch(HTTP_RANGE='bytes=9-1')
+        self.assertEqual((response.status_code, response.body), (200, self.data))
+
+    def test_if_range(self):
+        full = self.watch()
+        self.assertEqual((full.status_code, full['Accept-Ranges']), (200, 'bytes'))
+        for if_range, status in ((full['ETag'], 206), (full['Last-Modified'], 206),
+                                 ('"stale"', 200), ('W/' + full['ETag'], 200)):
+            with self.subTest(if_range=if_range):
+                response = self.watch(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=if_range)
+                self.assertEqual(response.status_code, status)
+        self.assertEqual(self.watch(HTTP_IF_NONE_MATCH=full['ETag']).status_code, 304)
+
+    def test_login_required(self):
+        self.assertEqual(self.client.get(f'/api/movies/{self.movie.id}/watch/').status_code, 401)
+
+
+class RatingAggregateTests(TestCase):
+    """Сумма, количество и средняя оценка фильма меняются на разницу при добавлении, изменении и удалении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            MyUser.objects.create_user(phone_number=f'+7000000050{number}', username='u', password='!')
+            for number in range(2)
+        ]
+        cls.movies = [create_movie(f'Фильм {number}') for number in range(2)]
+
+    def aggregates(self, movie):
+        movie.refresh_from_db()
+        return movie.rating_sum, movie.rating_count, movie.rating_average
+
+    def add(self, user, movie, score):
+        return self.client.post('/api/ratings/add/', {'movie': movie.id, 'score': score},
+                                content_type='application/json', **auth_headers(user))
+
+    def test_add(self):
+        movie = self.movies[0]
+        self.assertEqual(self.add(self.users[0], movie, 4).status_code, 201)
+        self.assertEqual(self.add(self.users[1], movie, 7).status_code, 201)
+        self.assertEqual(self.aggregates(movie), (11, 2, 5.5))
+        # Повторная оценка отклоняется и агрегаты не трогает
+        self.assertEqual(self.add(self.users[0], movie, 10).status_code, 400)
+        self.assertEqual(self.aggregates(movie), (11, 2, 5.5))
+
+    def test_update(self):
+        first, second = self.movies
+        self.add(self.users[0], first, 4)
+        self.add(self.users[1], first, 8)
+        rating = Rating.objects.get(user=self.users[0])
+        url = f'/api/ratings/update/{rating.id}/'
+        response = self.client.patch(url, {'score': 10}, content_type='application/json', **auth_headers(self.users[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.aggregates(first), (18, 2, 9.0))
+        # Перенос оценки на другой фильм
+        self.client.patch(url, {'movie': second.id}, content_type='application/json', **auth_headers(self.users[0]))
+        self.assertEqual(self.aggregates(first), (8, 1, 8.0))
+        self.assertEqual(self.aggregates(second), (10, 1, 10.0))
+
+    def test_delete(self):
+        movie = self.movies[0]
+        self.add(self.users[0], movie, 3)
+        self.add(self.users[1], movie, 9)
+        Rating.objects.get(user=self.users[0]).delete()
+        self.assertEqual(self.aggregates(movie), (9, 1, 9.0))
+        # Каскадное удаление вместе с пользователем
+        self.users[1].delete()
+        self.assertEqual(self.aggregates(movie), (0, 0, 0.0))
+
+    def test_rebuild_matches_incremental(self):
+        for user, movie, score in ((0, 0, 2), (1, 0, 5), (0, 1, 6)):
+            self.add(self.users[user], self.movies[movie], score)
+        before = [self.aggregates(movie) for movie in self.movies]
+        Movie.objects.update(rating_sum=0, rating_count=0, rating_average=0)
+        ratings.rebuild_rating_aggregates()
+        self.assertEqual([self.aggregates(movie) for movie in self.movies], before)
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class EagerLoadingQueryTests(TestCase):
+    """Число запросов карточки и списков не зависит от числа строк и связей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone_number='+70000000600', username='u', password='!')
+        cls.genre, = Genre.objects.bulk_create([Genre(title='Жанр', genre_img='genre_img/g.jpg')])
+        cls.country, = Country.objects.bulk_create([Country(title='Страна', country_img='country_img/c.jpg')])
+        cls.category, = Category.objects.bulk_create([Category(title='Категория', image='category_img/c.jpg')])
+        cls.serial = create_movie('Сериал', is_film=False)
+        cls.serial.series_categories.add(cls.category)
+        cls.film = cls.add_movies(2)[0]
+        cls.add_episodes(1)
+
+    @classmethod
+    def add_movies(cls, count):
+        crews = FilmCrew.objects.bulk_create([
+            FilmCrew(name=f'Актёр {number}', birth_date='1980-01-01', birthplace='', position='Актёр')
+            for number in range(count)
+        ])
+        movies = []
+        for number in range(count):
+            movie = create_movie(f'Фильм {number}')
+            movie.genres.add(cls.genre)
+            movie.country.add(cls.country)
+            movie.movie_categories.add(cls.category)
+            movie.film_crews.set(crews)
+            Favorite.objects.create(user=cls.user, movie=movie)
+            movies.append(movie)
+        return movies
+
+    @classmethod
+    def add_episodes(cls, count):
+        start = cls.serial.series_related.count()
+        Series.objects.bulk_create([
+            Series(movie_serial=cls.serial, number=str(start + number), image='image_serial/1.jpg', series='')
+            for number in range(count)
+        ])
+
+    def count_queries(self, url):
+        # Версии токенов кэшируются в памяти процесса: каждый запрос платит проверку
+        cache.clear()
+        authentication.versions.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, **auth_headers(self.user)).status_code, 200)
+        return len(queries)
+
+    def get_urls(self):
+        return (
+            f'/api/index/{self.film.id}/', f'/api/async/index/{self.film.id}/', '/api/index/',
+            f'/api/genre/{self.genre.id}/', f'/api/country/{self.country.id}/',
+            f'/api/movies/category/{self.category.id}/', f'/api/series/category/{self.category.id}/',
+            f'/api/serial/{self.serial.id}/series/', '/api/favorites/', '/api/movie/', '/api/genres/',
+        )
+
+    def test_counts_do_not_grow_with_rows(self):
+        before = {url: self.count_queries(url) for url in self.get_urls()}
+        self.add_movies(6)
+        self.add_episodes(5)
+        after = {url: self.count_queries(url) for url in self.get_urls()}
+        self.assertEqual(after, before)
+
+    def test_detail_page_of_movies(self):
+        # Список карточек: запросов столько же, сколько связей, а не строк
+        counts = []
+        for extra in (0, 6):
+            self.add_movies(extra)
+            queryset = serializers.MovieSerialDetailSerializer.setup_eager_loading(Movie.objects.all())
+            with CaptureQueriesContext(connection) as queries:
+                serializers.MovieSerialDetailSerializer(queryset, many=True).data
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_film_detail_skips_series_categories(self):
+        # Рекомендации ищут и по series_categories; здесь важна только подгрузка категорий
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/index/{self.film.id}/')
+        prefetches = [query['sql'] for query in queries if query['sql'].startswith('SELECT "product_category"')]
+        self.assertEqual(len(prefetches), 1)
+        self.assertIn('movie_categories', prefetches[0])
+        self.assertNotIn('series_categories', prefetches[0])
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class KeysetPaginationTests(TestCase):
+    """Keyset-страницы не теряют и не повторяют строки с одинаковым значением сортировки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone_number='+70000000700', username='u', password='!')
+        cls.genre, = Genre.objects.bulk_create([Genre(title='Жанр', genre_img='genre_img/g.jpg')])
+        # Годы с повторами: страницы по 2 строки режут группы одинаковых значений
+        for number, year in enumerate((2001, 2003, 2001, 2002, 2003, 2001, 2002)):
+            create_movie(f'Фильм {number}', production_year=year).genres.add(cls.genre)
+
+    def get(self, url, params=None):
+        cache.clear()
+        response = self.client.get(url, params, **auth_headers(self.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, link):
+        pages = []
+        while link:
+            data = self.get(link)
+            pages.append([movie['id'] for movie in data['results']])
+            link = data['next']
+        return pages
+
+    def expected(self, ordering):
+        return list(Movie.objects.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
+                    .values_list('id', flat=True))
+
+    def test_walk_over_ties(self):
+        for prefix in ('/api/', '/api/async/'):
+            for ordering in ('production_year', '-production_year'):
+                with self.subTest(prefix=prefix, ordering=ordering):
+                    first = self.get(f'{prefix}genre/{self.genre.id}/', {'ordering': ordering, 'page_size': 2})
+                    self.assertIsNone(first['previous'])
+                    pages = [[movie['id'] for movie in first['results']]] + self.walk(first['next'])
+                    self.assertEqual([pk for page in pages for pk in page], self.expected(ordering))
+                    self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+
+    def test_previous_links_return_same_pages(self):
+        url = f'/api/genre/{self.genre.id}/'
+        pages, data = [], self.get(url, {'ordering': '-production_year', 'page_size': 2})
+        while True:
+            pages.append(data)
+            if not data['next']:
+                break
+            data = self.get(data['next'])
+
+        # С последней страницы назад: те же страницы в обратном порядке, у первой нет previous
+        back = [pages[-1]]
+        while back[-1]['previous']:
+            back.append(self.get(back[-1]['previous']))
+        self.assertEqual([page['results'] for page in reversed(back)], [page['results'] for page in pages])
+        self.assertIsNone(back[-1]['previous'])
+        self.assertIsNotNone(back[-1]['next'])
+
+    def test_cursor_of_other_ordering_is_rejected(self):
+        url = f'/api/genre/{self.genre.id}/'
+        cursor = self.get(url, {'ordering': 'production_year', 'page_size': 2})['next'].split('cursor=')[1]
+        response = self.client.get(url, {'ordering': '-production_year', 'cursor': cursor}, **auth_headers(self.user))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url, {'cursor': 'мусор'}, **auth_headers(self.user))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class FacetCountTests(TestCase):
+    """Счётчики фасетов меняются на месте и совпадают с пересчётом GROUP BY."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genres = Genre.objects.bulk_create([
+            Genre(title=title, genre_img='genre_img/g.jpg') for title in ('Драма', 'Комедия')
+        ])
+        cls.country, = Country.objects.bulk_create([Country(title='Страна', country_img='country_img/c.jpg')])
+        cls.category, = Category.objects.bulk_create([Category(title='Категория', image='category_img/c.jpg')])
+        cls.film = create_movie('Фильм')
+        cls.film.genres.add(*cls.genres)
+        cls.film.country.add(cls.country)
+        cls.film.movie_categories.add(cls.category)
+        cls.serial = create_movie('Сериал', is_film=False)
+        cls.serial.genres.add(cls.genres[0])
+
+    def assertMatchesRebuild(self):
+        stored = {
+            (row.facet, row.value_id, row.is_film): row.count
+            for row in FacetCount.objects.exclude(count=0)
+        }
+        self.assertEqual(stored, dict(facets.grouped_counts()))
+
+    def stored_count(self, facet, value_id, is_film):
+        return FacetCount.objects.filter(facet=facet, value_id=value_id, is_film=is_film).values_list(
+            'count', flat=True
+        ).first() or 0
+
+    def test_type_flip_moves_counts(self):
+        drama = self.genres[0].id
+        self.assertEqual(self.stored_count(FacetCount.GENRE, drama, True), 1)
+        self.film.is_film = False
+        self.film.save()
+        self.assertEqual(self.stored_count(FacetCount.GENRE, drama, True), 0)
+        self.assertEqual(self.stored_count(FacetCount.GENRE, drama, False), 2)
+        self.assertEqual(self.stored_count(FacetCount.TOTAL, 0, False), 2)
+        self.assertMatchesRebuild()
+
+        # Сохранение без is_film ничего не переносит
+        self.film.is_film = True
+        self.film.save(update_fields=['title'])
+        self.assertEqual(self.stored_count(FacetCount.GENRE, drama, False), 2)
+
+    def test_value_delete_drops_counts(self):
+        drama = self.genres[0].id
+        self.genres[0].delete()
+        self.category.delete()
+        self.assertFalse(FacetCount.objects.filter(value_id=drama, facet=FacetCount.GENRE).exists())
+        self.assertFalse(FacetCount.objects.filter(
+            value_id=self.category.id, facet__in=[FacetCount.MOVIE_CATEGORY, FacetCount.SERIES_CATEGORY]
+        ).exists())
+        self.assertMatchesRebuild()
+
+    def test_movie_delete_and_clear(self):
+        self.film.genres.clear()
+        self.assertMatchesRebuild()
+        self.film.delete()
+        self.assertMatchesRebuild()
+
+    def test_cached_browse_waits_for_commit(self):
+        def type_counts():
+            counts = self.client.get('/api/facets/').json()['facets']['is_film']
+            return {item['value']: item['count'] for item in counts}
+
+        cache.clear()
+        self.assertEqual(type_counts(), {True: 1, False: 1})
+        # Среди отложенных вызовов и генерация превью постера — она здесь не нужна
+        with mock.patch.object(images, 'schedule'):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.film.is_film = False
+                self.film.save()
+                # Счётчики уже в транзакции, но кэш ответа сбрасывается только после коммита
+                self.assertEqual(self.stored_count(FacetCount.TOTAL, 0, False), 2)
+                self.assertEqual(type_counts(), {True: 1, False: 1})
+            self.assertTrue(callbacks)
+            for callback in callbacks:
+                callback()
+        self.assertEqual(type_counts(), {True: 0, False: 2})
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=(), FAVORITES_BATCH_LIMIT=10)
+class FavoriteBatchTests(TestCase):
+    """Пакетное избранное: повтор безопасен, число запросов не зависит от длины списка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone_number='+70000000800', username='u', password='!')
+        cls.other = MyUser.objects.create_user(phone_number='+70000000801', username='o', password='!')
+        cls.movies = [create_movie(f'Фильм {number}') for number in range(6)]
+        cls.ids = [movie.id for movie in cls.movies]
+        cls.missing = max(cls.ids) + 100
+        Favorite.objects.create(user=cls.other, movie=cls.movies[5])
+
+    def post(self, operation, movies):
+        return self.client.post(
+            f'/api/favorites/batch/{operation}/', {'movies': movies}, content_type='application/json',
+            **auth_headers(self.user),
+        )
+
+    def favorite_ids(self, user=None):
+        return set(Favorite.objects.filter(user=user or self.user).values_list('movie_id', flat=True))
+
+    def test_add_skips_missing_and_repeats(self):
+        movies = [self.ids[1], self.missing, self.ids[0], self.ids[1]]
+        for _ in range(2):
+            response = self.post('add', movies)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'movies': [self.ids[1], self.ids[0]], 'missing': [self.missing]})
+        self.assertEqual(self.favorite_ids(), {self.ids[0], self.ids[1]})
+
+    def test_query_count_does_not_depend_on_size(self):
+        counts = []
+        for movies in (self.ids[:1], self.ids):
+            authentication.versions.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post('add', movies).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_remove(self):
+        self.post('add', self.ids[:3])
+        response = self.post('remove', [self.ids[0], self.ids[5], self.missing])
+        self.assertEqual(response.json(), {'removed': 1})
+        self.assertEqual(self.favorite_ids(), set(self.ids[1:3]))
+        self.assertEqual(self.favorite_ids(self.other), {self.ids[5]})
+
+    def test_replace_keeps_exactly_list(self):
+        self.post('add', self.ids[:3])
+        response = self.post('replace', [self.ids[2], self.ids[4], self.missing])
+        self.assertEqual(response.json(), {
+            'movies': [self.ids[2], self.ids[4]], 'missing': [self.missing], 'removed': 2,
+        })
+        self.assertEqual(self.favorite_ids(), {self.ids[2], self.ids[4]})
+        self.assertEqual(self.favorite_ids(self.other), {self.ids[5]})
+
+        self.assertEqual(self.post('replace', []).json()['removed'], 2)
+        self.assertEqual(self.favorite_ids(), set())
+
+    def test_status_bitmap(self):
+        self.post('add', [self.ids[0], self.ids[2]])
+        movies = [self.ids[2], self.ids[1], self.ids[5], self.ids[0], self.missing]
+        response = self.client.get(
+            '/api/favorites/status/', {'movies': ','.join(map(str, movies))}, **auth_headers(self.user)
+        )
+        self.assertEqual(response.json(), {'movies': movies, 'bitmap': '10010'})
+
+        # Вся страница — один запрос к избранному
+        authentication.versions.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/favorites/status/', {'movies': movies}, **auth_headers(self.user))
+        self.assertEqual(sum('product_favorite' in query['sql'] for query in queries), 1)
+
+        response = self.client.get('/api/favorites/status/', {'movies': 'x'}, **auth_headers(self.user))
+        self.assertEqual(response.status_code, 400)
+
+    def test_limit_and_auth(self):
+        self.assertEqual(self.post('add', list(range(1, 12))).status_code, 400)
+        response = self.client.post('/api/favorites/batch/add/', {'movies': [self.ids[0]]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.favorite_ids(), set())
+
+
+@override_settings(HLS_AUTO_ENQUEUE=False, IMAGE_DERIVATIVE_WIDTHS=())
+class ChunkedUploadTests(TestCase):
+    """Загрузка по частям: конфликт смещения, контрольная сумма и сборка файла."""
+
+    data = bytes(range(256)) * 8
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = MyUser.objects.create_superuser(phone_number='+70000000900', username='m', password='!')
+        cls.other = MyUser.objects.create_superuser(phone_number='+70000000901', username='o', password='!')
+        cls.movie = create_movie()
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        response = self.client.post('/api/uploads/', {
+            'movie': self.movie.id, 'filename': 'film.mp4', 'length': len(self.data),
+        }, content_type='application/json', **auth_headers(self.manager))
+        self.assertEqual(response.status_code, 201)
+        self.upload = ChunkedUpload.objects.get(pk=response.json()['id'])
+        self.url = f'/api/uploads/{self.upload.pk}/'
+
+    def patch(self, offset, chunk, checksum=None, user=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum:
+            headers['HTTP_UPLOAD_CHECKSUM'] = checksum
+        return self.client.patch(self.url, chunk, content_type='application/offset+octet-stream',
+                                 **headers, **auth_headers(user or self.manager))
+
+    def sha256(self, chunk):
+        return f'sha256 {base64.b64encode(hashlib.sha256(chunk).digest()).decode()}'
+
+    def part_size(self):
+        return os.path.getsize(uploads.part_path(self.upload))
+
+    def offset(self):
+        return self.client.head(self.url, **auth_headers(self.manager))['Upload-Offset']
+
+    def test_offset_conflict(self):
+        response = self.patch(0, self.data[:1000], self.sha256(self.data[:1000]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '1000')
+
+        # Повтор того же куска и прыжок вперёд — 409, принятые байты не тронуты
+        for offset in (0, 1500):
+            with self.subTest(offset=offset):
+                response = self.patch(offset, self.data[offset:offset + 100])
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json(), {'detail': 'Ожидалось смещение 1000'})
+        self.assertEqual((self.offset(), self.part_size()), ('1000', 1000))
+
+    def test_checksum_mismatch(self):
+        self.patch(0, self.data[:1000])
+        response = self.patch(1000, self.data[1000:1500], self.sha256(b'other'))
+        self.assertEqual(response.status_code, 460)
+        # Кусок с неверной суммой отброшен целиком
+        self.assertEqual((self.offset(), self.part_size()), ('1000', 1000))
+
+        self.assertEqual(self.patch(1000, self.data[1000:1500], 'crc32 AAAA').status_code, 400)
+        self.assertEqual(self.patch(1000, self.data[1000:1500], 'sha256 не-base64').status_code, 400)
+        self.assertEqual(self.patch(1000, self.data[1000:1500], self.sha256(self.data[1000:1500])).status_code, 204)
+        self.assertEqual(self.offset(), '1500')
+
+    def test_finalize(self):
+        self.assertEqual(self.patch(0, self.data[:1500]).status_code, 204)
+        self.assertEqual(self.patch(1500, self.data[1500:] + b'x').status_code, 413)
+        response = self.client.post(f'{self.url}finalize/', **auth_headers(self.manager))
+        self.assertEqual(response.status_code, 409)
+
+        self.assertEqual(self.patch(1500, self.data[1500:]).status_code, 204)
+        for _ in range(2):
+            response = self.client.post(f'{self.url}finalize/', **auth_headers(self.manager))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['status'], ChunkedUpload.COMPLETE)
+        self.movie.refresh_from_db()
+        with self.movie.movie.open('rb') as video:
+            self.assertEqual(video.read(), self.data)
+        self.assertFalse(os.path.exists(uploads.part_path(self.upload)))
+        self.assertEqual(self.patch(len(self.data), b'x').status_code, 409)
+
+    def test_foreign_upload(self):
+        self.assertEqual(self.patch(0, self.data[:10], user=self.other).status_code, 404)
+        response = self.client.patch(self.url, self.data[:10], content_type='application/octet-stream',
+                                     HTTP_UPLOAD_OFFSET='0', **auth_headers(self.manager))
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.offset(), '0')
+
+
+@override_settings(MEDIA_URL_TTL=3600, MEDIA_URL_TTL_STEP=600, MEDIA_URL_SIGNING_KEYS=['new', 'old'])
+class SignedUrlTests(TestCase):
+    """Подписанные ссылки: срок, подделка любой части токена и смена ключей."""
+
+    name = 'hls/movie/5/master.m3u8'
+    now = 1_700_000_000
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        os.makedirs(os.path.join(media_root.name, 'hls', 'movie', '5'))
+        for name in ('master.m3u8', 'segment1.ts'):
+            with open(os.path.join(media_root.name, 'hls', 'movie', '5', name), 'wb') as file:
+                file.write(b'#EXTM3U')
+
+    def token(self, path):
+        return path[len(url_signing.SIGNED_PREFIX):].partition('/')[0]
+
+    def test_expiry(self):
+        expires = url_signing.get_expiry(self.now)
+        # Не меньше TTL и кратно шагу: ссылки внутри шага совпадают
+        self.assertEqual(expires % 600, 0)
+        self.assertTrue(self.now + 3600 <= expires < self.now + 3600 + 600)
+        self.assertEqual(url_signing.get_expiry(self.now + 1), expires)
+
+        token = self.token(url_signing.sign(self.name, 7, expires=expires))
+        self.assertEqual(url_signing.verify(token, self.name, now=expires - 1), expires)
+        self.assertIsNone(url_signing.verify(token, self.name, now=expires))
+
+    def test_tampered_token(self):
+        expires = url_signing.get_expiry(self.now)
+        token = self.token(url_signing.sign(self.name, 7, expires=expires))
+        self.assertEqual(url_signing.verify(token, self.name, now=self.now), expires)
+        _, _, _, given = token.split('.')
+        forged = 'A' if given[0] != 'A' else 'B'
+        for tampered in (
+            f'{expires + 600}.7.0.{given}',
+            f'{expires}.8.0.{given}',
+            f'{expires}.7.1.{given}',
+            f'{expires}.7.0.{forged}{given[1:]}',
+            f'{expires}.7.0.{given}ё',
+            f'{expires}.7.0',
+            'мусор',
+        ):
+            with self.subTest(token=tampered):
+                self.assertIsNone(url_signing.verify(tampered, self.name, now=self.now))
+        self.assertIsNone(url_signing.verify(token, 'hls/movie/5/other.m3u8', now=self.now))
+
+    def test_directory_scope(self):
+        token = self.token(url_signing.sign(self.name, 7, depth=3, expires=url_signing.get_expiry(self.now)))
+        self.assertIsNotNone(url_signing.verify(token, 'hls/movie/5/segment1.ts', now=self.now))
+        self.assertIsNone(url_signing.verify(token, 'hls/movie/6/segment1.ts', now=self.now))
+        self.assertIsNone(url_signing.verify(token, 'hls/movie/5', now=self.now))
+
+    def test_key_rotation(self):
+        expires = url_signing.get_expiry(self.now)
+        with override_settings(MEDIA_URL_SIGNING_KEYS=['old']):
+            token = self.token(url_signing.sign(self.name, 7, expires=expires))
+        self.assertEqual(url_signing.verify(token, self.name, now=self.now), expires)
+        with override_settings(MEDIA_URL_SIGNING_KEYS=['new']):
+            self.assertIsNone(url_signing.verify(token, self.name, now=self.now))
+
+    def test_media_view(self):
+        path = url_signing.sign(self.name, 7, depth=3)
+        segment = path.replace('master.m3u8', 'segment1.ts')
+        for url in (path, segment):
+            with self.subTest(url=url):
+                response = self.client.get(f'/media/{url}')
+                self.assertEqual(response.status_code, 200)
+                self.assertRegex(response['Cache-Control'], r'^public, max-age=\d+$')
+                self.assertLessEqual(int(response['Cache-Control'].rsplit('=', 1)[1]), 3600 + 600)
+                response.close()
+
+        expires = int(self.token(path).split('.')[0])
+        with mock.patch('time.time', return_value=expires):
+            self.assertEqual(self.client.get(f'/media/{path}').status_code, 403)
+        tampered = path.replace('.7.', '.8.', 1)
+        self.assertEqual(self.client.get(f'/media/{tampered}').status_code, 403)
+        self.assertEqual(self.client.get(f'/media/{path}'.replace('/5/', '/6/')).status_code, 403)
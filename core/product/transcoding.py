@@ -0,0 +1,253 @@
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import StreamManifest, Rendition
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LADDER = (
+    (144, 150_000),
+    (360, 800_000),
+    (720, 2_800_000),
+    (1080, 5_000_000),
+)
+
+_executor = None
+
+
+def get_ladder():
+    return getattr(settings, 'HLS_LADDER', DEFAULT_LADDER)
+
+
+def get_transcoder():
+    path = getattr(settings, 'HLS_TRANSCODER', 'product.transcoding.FFmpegTranscoder')
+    return import_string(path)()
+
+
+class Superseded(Exception):
+    """Исходник загрузили заново, пока шла нарезка прежнего."""
+
+
+def title_dir(manifest):
+    if manifest.movie_id:
+        return os.path.join('hls', 'movie', str(manifest.movie_id))
+    return os.path.join('hls', 'series', str(manifest.series_id))
+
+
+def output_dir(manifest):
+    # У каждого поколения своя папка: задача прежнего поколения, ещё не
+    # заметившая замену, не пишет в файлы новой
+    return os.path.join(title_dir(manifest), f'v{manifest.generation}')
+
+
+def remove_old_generations(manifest):
+    """Убирает нарезки прежних поколений (и старую раскладку без поколений)."""
+    parent = os.path.join(settings.MEDIA_ROOT, title_dir(manifest))
+    for name in os.listdir(parent):
+        # Папки новее текущей — задача следующей загрузки, их не трогаем
+        if name.startswith('v') and name[1:].isdigit() and int(name[1:]) >= manifest.generation:
+            continue
+        path = os.path.join(parent, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+class FFmpegTranscoder:
+    segment_duration = 6
+
+    def transcode(self, source, target_dir, height, bitrate):
+        subprocess.run(
+            [
+                getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'), '-y', '-v', 'error',
+                '-i', source,
+                '-vf', f'scale=-2:{height}',
+                '-c:v', 'libx264', '-b:v', str(bitrate),
+                '-maxrate', str(bitrate), '-bufsize', str(bitrate * 2),
+                '-c:a', 'aac', '-b:a', '64k' if height <= 360 else '128k',
+                '-f', 'hls',
+                '-hls_time', str(self.segment_duration),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(target_dir, 'seg_%05d.ts'),
+                os.path.join(target_dir, 'index.m3u8'),
+            ],
+            check=True,
+            capture_output=True,
+        )
+        return len([name for name in os.listdir(target_dir) if name.endswith('.ts')])
+
+
+class FakeTranscoder:
+    """
+    Заглушка для локальной разработки: режет исходный файл на сегменты
+    фиксированного размера без перекодирования и пишет к ним плейлист.
+    """
+    segment_size = 1024 * 1024
+    segment_duration = 6
+
+    def transcode(self, source, target_dir, height, bitrate):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{self.segment_duration}',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        count = 0
+        with open(source, 'rb') as src:
+            while chunk := src.read(self.segment_size):
+                name = f'seg_{count:05d}.ts'
+                with open(os.path.join(target_dir, name), 'wb') as dst:
+                    dst.write(chunk)
+                lines += [f'#EXTINF:{self.segment_duration}.0,', name]
+                count += 1
+        lines.append('#EXT-X-ENDLIST')
+        with open(os.path.join(target_dir, 'index.m3u8'), 'w') as playlist:
+            playlist.write('\n'.join(lines) + '\n')
+        return count
+
+
+def schedule(instance, field_file):
+    """
+    Ставит загруженный файл фильма или серии в очередь на нарезку.
+
+    Если файл не менялся с прошлой нарезки, ничего не делает. Иначе
+    начинается новое поколение манифеста; задача прежнего, если она ещё
+    идёт, заметит это на ближайшем качестве и остановится. Строки качеств
+    не удаляются, а сбрасываются на месте — под работающей задачей их нет
+    смысла убирать.
+    """
+    if not field_file:
+        return None
+
+    lookup = {'movie': instance} if instance._meta.model_name == 'movie' else {'series': instance}
+    manifest, created = StreamManifest.objects.get_or_create(defaults={'source': field_file.name}, **lookup)
+    if not created and manifest.source == field_file.name:
+        return manifest
+
+    StreamManifest.objects.filter(pk=manifest.pk).update(
+        source=field_file.name, master_playlist='', status=StreamManifest.PENDING, error='',
+        generation=F('generation') + 1, updated_date=timezone.now(),
+    )
+    manifest.refresh_from_db()
+
+    ladder = dict(get_ladder())
+    manifest.renditions.exclude(height__in=ladder).delete()
+    manifest.renditions.update(playlist='', segment_count=0, status=StreamManifest.PENDING)
+    existing = set(manifest.renditions.values_list('height', flat=True))
+    Rendition.objects.bulk_create([
+        Rendition(manifest=manifest, height=height, bitrate=bitrate)
+        for height, bitrate in ladder.items() if height not in existing
+    ])
+
+    if getattr(settings, 'HLS_AUTO_ENQUEUE', True):
+        transaction.on_commit(lambda: enqueue(manifest.id))
+    return manifest
+
+
+def enqueue(manifest_id):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'HLS_WORKERS', 2),
+            thread_name_prefix='transcode',
+        )
+    return _executor.submit(_run, manifest_id)
+
+
+def _run(manifest_id):
+    try:
+        process_manifest(manifest_id)
+    except Exception:
+        logger.exception('Transcoding of manifest %s failed', manifest_id)
+    finally:
+        close_old_connections()
+
+
+def process_manifest(manifest_id, resume=False):
+    """
+    Нарезает все неготовые качества манифеста и пишет мастер-плейлист.
+
+    Каждое качество собирается во временной папке и переносится на место
+    только целиком, поэтому после перезапуска воркера уже готовые качества
+    не пересобираются. ``resume=True`` подхватывает манифесты, застрявшие в
+    статусе «Обрабатывается».
+
+    Все записи в базу проверяют поколение манифеста: если исходник
+    загрузили заново, задача убирает свою папку и возвращает None.
+    """
+    claimable = [StreamManifest.PENDING, StreamManifest.FAILED]
+    if resume:
+        claimable.append(StreamManifest.PROCESSING)
+    claimed = StreamManifest.objects.filter(id=manifest_id, status__in=claimable).update(
+        status=StreamManifest.PROCESSING
+    )
+    if not claimed:
+        return None
+
+    manifest = StreamManifest.objects.get(id=manifest_id)
+    generation = manifest.generation
+    current = StreamManifest.objects.filter(id=manifest_id, generation=generation)
+    transcoder = get_transcoder()
+    source = os.path.join(settings.MEDIA_ROOT, manifest.source)
+    base_dir = output_dir(manifest)
+
+    try:
+        for rendition in manifest.renditions.exclude(status=StreamManifest.READY):
+            if not current.exists():
+                raise Superseded()
+            relative_dir = os.path.join(base_dir, f'{rendition.height}p')
+            target_dir = os.path.join(settings.MEDIA_ROOT, relative_dir)
+            tmp_dir = target_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            segment_count = transcoder.transcode(source, tmp_dir, rendition.height, rendition.bitrate)
+
+            shutil.rmtree(target_dir, ignore_errors=True)
+            os.replace(tmp_dir, target_dir)
+            updated = Rendition.objects.filter(pk=rendition.pk, manifest__generation=generation).update(
+                playlist=os.path.join(relative_dir, 'index.m3u8'),
+                segment_count=segment_count,
+                status=StreamManifest.READY,
+            )
+            if not updated:
+                raise Superseded()
+    except Superseded:
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, base_dir), ignore_errors=True)
+        logger.info('Manifest %s generation %s superseded', manifest_id, generation)
+        return None
+    except Exception as exc:
+        current.update(status=StreamManifest.FAILED, error=str(exc), updated_date=timezone.now())
+        raise
+
+    master_playlist = write_master_playlist(base_dir, manifest.renditions.all())
+    if not current.update(master_playlist=master_playlist, status=StreamManifest.READY, updated_date=timezone.now()):
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, base_dir), ignore_errors=True)
+        return None
+    manifest.refresh_from_db()
+    remove_old_generations(manifest)
+    return manifest
+
+
+def write_master_playlist(base_dir, renditions):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition in renditions:
+        lines += [
+            f'#EXT-X-STREAM-INF:BANDWIDTH={rendition.bitrate},NAME="{rendition.height}p"',
+            f'{rendition.height}p/index.m3u8',
+        ]
+    relative_path = os.path.join(base_dir, 'master.m3u8')
+    with open(os.path.join(settings.MEDIA_ROOT, relative_path), 'w') as master:
+        master.write('\n'.join(lines) + '\n')
+    return relative_path
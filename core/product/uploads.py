@@ -0,0 +1,218 @@
+"""
+Возобновляемая загрузка файлов фильмов и серий по частям (в духе tus).
+
+1. ``POST uploads/`` — сессия: куда прикрепить файл (фильм или серия), имя
+   и размер.
+2. ``PATCH uploads/<id>/`` — очередной кусок: тело
+   ``application/offset+octet-stream``, ``Upload-Offset`` — сколько байт уже
+   принято, по желанию ``Upload-Checksum: <алгоритм> <base64>``. Кусок
+   пишется на диск блоками прямо из потока запроса, без буферизации в
+   памяти; при несовпадении суммы или оборванном теле файл обрезается до
+   прежнего смещения. ``HEAD uploads/<id>/`` после обрыва связи говорит,
+   с какого байта продолжать.
+3. ``POST uploads/<id>/finalize/`` — когда все байты получены, файл
+   переносится в ``upload_to`` поля и прикрепляется к ``Movie.movie`` или
+   ``Series.series`` одной транзакцией; дальше обычные сигналы ставят его
+   на нарезку HLS.
+
+Пока кусок пишется, файл сессии заблокирован (``flock``): параллельный
+PATCH той же сессии получает 423, а не перемешивает данные.
+"""
+import base64
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChunkedUpload
+
+
+UPLOAD_DIR = 'uploads/'
+BLOCK_SIZE = 1024 * 1024
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+
+class UploadError(ValueError):
+    """Ошибка протокола загрузки; ``status`` — код ответа."""
+    status = 400
+
+
+class OffsetConflict(UploadError):
+    status = 409
+
+
+class ChunkTooLarge(UploadError):
+    status = 413
+
+
+class UploadLocked(UploadError):
+    status = 423
+
+
+class ChecksumMismatch(UploadError):
+    # Код из расширения checksum протокола tus
+    status = 460
+
+
+def get_max_length():
+    return getattr(settings, 'UPLOAD_MAX_LENGTH', 50 * 1024 ** 3)
+
+
+def get_chunk_max_size():
+    return getattr(settings, 'UPLOAD_CHUNK_MAX_SIZE', 64 * 1024 ** 2)
+
+
+def get_expire_hours():
+    return getattr(settings, 'UPLOAD_EXPIRE_HOURS', 24)
+
+
+def part_path(upload):
+    return default_storage.path(f'{UPLOAD_DIR}{upload.pk}.part')
+
+
+def create_part(upload):
+    """Пустой файл, в который будут дописываться куски."""
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def remove_part(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def parse_checksum(header):
+    """``Upload-Checksum: sha256 <base64>`` -> (алгоритм, digest) или None без заголовка."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f'Алгоритм контрольной суммы не поддерживается: {algorithm or "-"}')
+    try:
+        return algorithm, base64.b64decode(value.strip(), validate=True)
+    except ValueError:
+        # И неверный base64 (binascii.Error), и не-ASCII символы в заголовке
+        raise UploadError('Контрольная сумма должна быть в base64')
+
+
+@contextmanager
+def locked_part(upload):
+    try:
+        part = open(part_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise OffsetConflict('Файл загрузки не найден, начните загрузку заново')
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadLocked('Кусок этой загрузки уже принимается')
+        yield part
+
+
+def write_chunk(upload, offset, stream, size, checksum=None):
+    """
+    Дописывает ``size`` байт из ``stream`` начиная с ``offset`` и возвращает
+    новое смещение. Смещение в базе меняется только после fsync, поэтому
+    оно никогда не указывает дальше данных на диске.
+    """
+    if upload.status != ChunkedUpload.UPLOADING:
+        raise OffsetConflict('Загрузка уже завершена')
+    if size > get_chunk_max_size():
+        raise ChunkTooLarge(f'Кусок больше {get_chunk_max_size()} байт')
+    if offset + size > upload.length:
+        raise ChunkTooLarge('Кусок выходит за объявленный размер файла')
+    hasher = hashlib.new(checksum[0]) if checksum else None
+
+    with locked_part(upload) as part:
+        # Смещение перечитываем под блокировкой: его мог сдвинуть другой процесс
+        current = ChunkedUpload.objects.filter(pk=upload.pk).values_list('offset', flat=True).get()
+        if offset != current:
+            raise OffsetConflict(f'Ожидалось смещение {current}')
+        # Хвост от оборванного раньше куска не учтён в offset — отбрасываем
+        part.truncate(offset)
+        part.seek(offset)
+        received = 0
+        try:
+            while received < size:
+                block = stream.read(min(BLOCK_SIZE, size - received)) if stream is not None else b''
+                if not block:
+                    break
+                part.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+                received += len(block)
+            if received < size:
+                raise UploadError(f'Получено {received} байт из {size}')
+            if hasher is not None and hasher.digest() != checksum[1]:
+                raise ChecksumMismatch('Контрольная сумма куска не совпала')
+            part.flush()
+            os.fsync(part.fileno())
+        except BaseException:
+            part.truncate(offset)
+            raise
+        ChunkedUpload.objects.filter(pk=upload.pk).update(offset=offset + size, updated_date=timezone.now())
+
+    upload.offset = offset + size
+    return upload.offset
+
+
+def get_target(upload):
+    """(объект, имя поля), к которому прикрепляется файл."""
+    if upload.movie_id is not None:
+        return upload.movie, 'movie'
+    return upload.series, 'series'
+
+
+def move_part(upload, instance, field_name):
+    """
+    Переносит собранный файл под свободное имя в ``upload_to`` поля и
+    возвращает это имя. Жёсткая ссылка не перезапишет файл, который
+    параллельно занял то же имя.
+    """
+    field = instance._meta.get_field(field_name)
+    source = part_path(upload)
+    while True:
+        name = default_storage.get_available_name(field.generate_filename(instance, upload.filename))
+        target = default_storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            continue
+        os.remove(source)
+        return name
+
+
+def finalize(upload):
+    """
+    Прикрепляет полностью загруженный файл к фильму или серии. Повторный
+    вызов для уже прикреплённой загрузки ничего не делает.
+    """
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().select_related('movie', 'series').get(pk=upload.pk)
+        if upload.status == ChunkedUpload.COMPLETE:
+            return upload
+        if upload.offset != upload.length:
+            raise OffsetConflict(f'Получено {upload.offset} из {upload.length} байт')
+
+        instance, field_name = get_target(upload)
+        with locked_part(upload):
+            name = move_part(upload, instance, field_name)
+        try:
+            setattr(instance, field_name, name)
+            instance.save(update_fields=[field_name])
+            upload.status = ChunkedUpload.COMPLETE
+            upload.save(update_fields=['status', 'updated_date'])
+        except BaseException:
+            # Файл возвращается на место — загрузку можно завершить ещё раз
+            os.replace(default_storage.path(name), part_path(upload))
+            raise
+    return upload
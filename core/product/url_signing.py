@@ -0,0 +1,126 @@
+"""
+Подписанные ссылки на медиафайлы с ограниченным сроком жизни.
+
+Ссылка выглядит как ``MEDIA_URL + 'signed/<токен>/<путь файла>'``, где
+токен — ``<истекает>.<id пользователя>.<глубина>.<подпись>``, а подпись —
+HMAC-SHA256 от области, срока и пользователя. Область — сам файл
+(глубина 0) или каталог из первых ``глубина`` частей пути: так ссылка на
+HLS-плейлист ``hls/movie/5/master.m3u8`` подписывает весь ``hls/movie/5/``,
+и относительные ссылки плейлиста на куски наследуют токен.
+
+Проверка — только HMAC и время, без базы и сессии, сравнение подписи за
+постоянное время. Поэтому её может повторить и CDN: путь файла после
+токена не меняется, и край может кэшировать файл по пути без токена, сам
+проверяя подпись теми же ключами ``MEDIA_URL_SIGNING_KEYS``. Если край
+подпись не проверяет, он кэширует по полному URL: ответ помечен
+``public`` ровно до истечения ссылки.
+
+Срок округляется вверх до шага ``MEDIA_URL_TTL_STEP``: все ссылки одного
+пользователя на один файл в пределах шага совпадают, их кэшируют и
+браузер, и край, и кэш ответов API. Отзыв — короткий срок жизни и смена
+ключа: новый ключ ставится первым в ``MEDIA_URL_SIGNING_KEYS``, старые
+ссылки перестают проверяться, когда его убирают из списка.
+"""
+import base64
+import hashlib
+import hmac
+import time
+
+from django.conf import settings
+
+
+SIGNED_PREFIX = 'signed/'
+# Байт HMAC в ссылке: 128 бит хватает, а URL короче
+SIGNATURE_SIZE = 16
+
+
+def is_enabled():
+    return getattr(settings, 'MEDIA_SIGNED_URLS', True)
+
+
+def get_ttl():
+    return getattr(settings, 'MEDIA_URL_TTL', 4 * 3600)
+
+
+def get_ttl_step():
+    return getattr(settings, 'MEDIA_URL_TTL_STEP', 600)
+
+
+def get_keys():
+    """Ключи проверки; первым подписываются новые ссылки."""
+    keys = getattr(settings, 'MEDIA_URL_SIGNING_KEYS', None)
+    if keys:
+        return [key.encode() if isinstance(key, str) else key for key in keys]
+    # Без своих ключей — производные от SECRET_KEY, с его запасными ключами
+    secrets = [settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', ())]
+    return [hashlib.sha256(f'product.url_signing:{secret}'.encode()).digest() for secret in secrets]
+
+
+def get_expiry(now=None):
+    """Срок ссылки, выданной сейчас: не меньше ``MEDIA_URL_TTL`` и кратен шагу."""
+    step = get_ttl_step()
+    expires = int(now if now is not None else time.time()) + get_ttl()
+    return -(-expires // step) * step if step else expires
+
+
+def get_scope(name, depth):
+    """Файл (``depth=0``) или каталог из первых ``depth`` частей пути ``name``."""
+    if not depth:
+        return name
+    parts = name.split('/')
+    if depth >= len(parts):
+        return None
+    return '/'.join(parts[:depth]) + '/'
+
+
+def signature(key, scope, expires, user_id):
+    message = f'{scope}\n{expires}\n{user_id}'.encode()
+    digest = hmac.new(key, message, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def sign(name, user_id, depth=0, expires=None):
+    """
+    Подписанный путь (относительно MEDIA_URL) к файлу ``name``; при
+    ``depth`` — ко всему каталогу из первых ``depth`` частей пути.
+    """
+    expires = expires or get_expiry()
+    scope = get_scope(name, depth)
+    token = f'{expires}.{user_id}.{depth}.{signature(get_keys()[0], scope, expires, user_id)}'
+    return f'{SIGNED_PREFIX}{token}/{name}'
+
+
+def verify(token, name, now=None):
+    """
+    Срок действия токена (unix, сек), если он подписывает файл ``name``
+    и ещё не истёк, иначе None. ``name`` — уже нормализованный путь.
+    """
+    try:
+        expires, user_id, depth, given = token.split('.', 3)
+        expires, user_id, depth = int(expires), int(user_id), int(depth)
+    except ValueError:
+        return None
+    if expires <= (now if now is not None else time.time()) or depth < 0 or not given.isascii():
+        return None
+    scope = get_scope(name, depth)
+    if scope is None:
+        return None
+    # Все ключи проверяются всегда — время ответа не выдаёт, какой подошёл
+    valid = False
+    for key in get_keys():
+        valid |= hmac.compare_digest(signature(key, scope, expires, user_id), given)
+    return expires if valid else None
+
+
+def get_user_id(request):
+    """Кому выдаётся ссылка: id пользователя или 0 для анонима."""
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else 0
+
+
+def get_request_scope(request):
+    """
+    Чем различаются подписанные ссылки в ответах на запрос: пользователь и
+    срок. Входит в ключ кэша ответа и ETag вьюх с такими ссылками.
+    """
+    return f'{get_user_id(request)}:{get_expiry()}' if is_enabled() else ''
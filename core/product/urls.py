@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 urlpatterns = [
     path('index/', views.MovieSerialIndexView.as_view()),
     path('index/<int:pk>/', views.MovieDetailView.as_view()),
@@ -7,10 +7,24 @@ urlpatterns = [
     path('index/movie/<int:pk>/', views.MovieDetailViews.as_view(), name='series-detail'),
     path('serial/<int:movie_id>/series/', views.SerialListView.as_view(), name='series-list'),
 
+    # Просмотр (потоковая отдача с поддержкой Range)
+
+    path('movies/<int:pk>/watch/', views.MovieStreamView.as_view(), name='movie-watch'),
+    path('series/<int:pk>/watch/', views.SeriesStreamView.as_view(), name='series-watch'),
+
+    # Прогресс просмотра
+
+    path('progress/heartbeat/', views.WatchHeartbeatView.as_view()),
+    path('progress/', views.ContinueWatchingView.as_view()),
+
 
     path('favorites/add/', views.AddFavoriteMovieView.as_view(), name='add_favorite'),
     path('favorites/remove/<int:movie_id>/', views.RemoveFavoriteMovieView.as_view(), name='remove_favorite'),
     path('favorites/', views.FavoriteListView.as_view()),
+    path('favorites/batch/add/', views.FavoriteBatchView.as_view(operation='add')),
+    path('favorites/batch/remove/', views.FavoriteBatchView.as_view(operation='remove')),
+    path('favorites/batch/replace/', views.FavoriteBatchView.as_view(operation='replace')),
+    path('favorites/status/', views.FavoriteStatusView.as_view()),
 
   
     # Фильмы по категориям, жанрам и странам
@@ -24,16 +38,43 @@ urlpatterns = [
     path('series/category/<int:category_id>/', views.SeriesCategoryFilterView.as_view()),
     path('genre/<int:genre_id>/', views.GenreFilterView.as_view()),
     path('country/<int:pk>/', views.CountryFilterView.as_view()),
+    path('facets/', views.FacetBrowseView.as_view()),
 
     # добавление
 
     path('movie_add/', views.AddMovieCreateView.as_view()),
     path('create_serial/', views.SerialCreateView.as_view()),
     path('add_serial/', views.AddSerialCreateView.as_view()),
+
+    # Загрузка файлов фильмов и серий по частям
+
+    path('uploads/', views.ChunkedUploadCreateView.as_view()),
+    path('uploads/<uuid:pk>/', views.ChunkedUploadView.as_view()),
+    path('uploads/<uuid:pk>/finalize/', views.ChunkedUploadFinalizeView.as_view()),
     
     # Рейтинг
 
+    path('ratings/', views.RatingUpsertView.as_view()),
     path('ratings/add/', views.AddRatingView.as_view()),
-    path('ratings/update/<int:pk>/', views.UpdateRatingView.as_view())
+    path('ratings/update/<int:pk>/', views.UpdateRatingView.as_view()),
+
+    # Статистика кэша ответов
+
+    path('cache/stats/', views.ResponseCacheStatsView.as_view()),
+
+    # Импорт и экспорт каталога
+
+    path('catalog/import/', views.CatalogImportView.as_view()),
+    path('catalog/export/', views.CatalogExportView.as_view()),
+
+    # Асинхронные версии нагруженных эндпоинтов (для запуска под ASGI)
+
+    path('async/index/', async_views.AsyncMovieSerialIndexView.as_view()),
+    path('async/index/<int:pk>/', async_views.AsyncMovieDetailView.as_view()),
+    path('async/serial/<int:movie_id>/series/', async_views.AsyncSerialListView.as_view()),
+    path('async/movies/category/<int:category_id>/', async_views.AsyncMovieCategoryFilterView.as_view()),
+    path('async/series/category/<int:category_id>/', async_views.AsyncSeriesCategoryFilterView.as_view()),
+    path('async/genre/<int:genre_id>/', async_views.AsyncGenreFilterView.as_view()),
+    path('async/country/<int:pk>/', async_views.AsyncCountryFilterView.as_view()),
 
 ]
@@ -1,25 +1,39 @@
-from django.db.models import Q
+import io
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.http import StreamingHttpResponse
 from rest_framework import generics, status, permissions
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.permissions import IsAuthenticated
 
 from django_filters import rest_framework as filters
 from rest_framework.filters import OrderingFilter, SearchFilter
-from .pagination import MovieSerialPagination
+from .pagination import MovieKeysetPagination, IndexSectionPagination
 
-from .models import Movie, Category, Banner, Genre, Country, Series, Favorite, FilmCrew, Rating
+from .models import Movie, Category, Banner, Genre, Country, Series, Favorite, FilmCrew, Rating, FacetCount, ChunkedUpload
 from .serializers import (
     MovieIndexSerializer, CategoryIndexSerializer, BannerIndexSerializer, GenreListSerializer, CountryListSerializer,
     AddMovieCreateSerializerCreate, MovieSerialDetailSerializer, FavoriteSerializer, SerialCreateSerializer,
     RatingSerializer, MovieSerialDetailUpdate, AddSerialCreateSerializer, SerialDetailSerializer, MovieDetail,
-    SeriesListSerializer
+    SeriesListSerializer, WatchHeartbeatSerializer, ContinueWatchingSerializer, FavoriteBatchSerializer,
+    RatingUpsertSerializer, ChunkedUploadSerializer,
 )
-from .filters import MovieSerialFilter
+from .filters import MovieSerialFilter, MovieFacetFilter
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from .permissions import IsAdminOrManager
+from .search import search_queryset
+from .ratings import rating_added, rating_changed
+from .recommendations import get_recommendations
+from .cache import cache_response, conditional_response, get_metrics
+from .catalog_io import import_catalog, export_csv, export_jsonl
+from .eager import EagerLoadingViewMixin
+from core.instrumentation import timed_serialization
+from . import delivery, facets, favorites, progress, ratings, uploads
 
 
 class MovieSerialIndexView(APIView):
@@ -31,7 +45,25 @@ class MovieSerialIndexView(APIView):
                 openapi.IN_QUERY,
                 description="Поисковый запрос по названию фильма или сериала",
                 type=openapi.TYPE_STRING
-            )
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description="Включает курсорную пагинацию: размер страницы каждого раздела",
+                type=openapi.TYPE_INTEGER
+            ),
+            openapi.Parameter(
+                'movies_cursor',
+                openapi.IN_QUERY,
+                description="Курсор следующей страницы фильмов (movies_next из прошлого ответа)",
+                type=openapi.TYPE_STRING
+            ),
+            openapi.Parameter(
+                'serials_cursor',
+                openapi.IN_QUERY,
+                description="Курсор следующей страницы сериалов (serials_next из прошлого ответа)",
+                type=openapi.TYPE_STRING
+            ),
         ],
         responses={
             200: openapi.Response(
@@ -72,36 +104,77 @@ class MovieSerialIndexView(APIView):
                                 }
                             )
                         ),
+                        'movies_next': openapi.Schema(type=openapi.TYPE_STRING, description="Только при limit"),
+                        'serials_next': openapi.Schema(type=openapi.TYPE_STRING, description="Только при limit"),
+                        'continue_watching': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                            description="Только для авторизованных: недосмотренные фильмы и сериалы"
+                        ),
                     }
                 )
             )
         }
     )
+    @conditional_response('movie', 'series', 'banner', 'genre', 'country', 'filmcrew', 'media', anonymous_only=True)
     def get(self, request, *args, **kwargs):
+        response = self.get_catalog(request, *args, **kwargs)
+        # Личный ряд «Продолжить просмотр» в кэш каталога не попадает
+        if request.user.is_authenticated:
+            response.data = {**response.data, 'continue_watching': self.get_continue_watching(request)}
+        return response
+
+    @cache_response('movie', 'series', 'banner', 'genre', 'country', 'filmcrew', 'media', conditional=False)
+    def get_catalog(self, request, *args, **kwargs):
+        movies, serials = self.get_section_querysets(request)
+        banners = Banner.objects.filter(is_asset=True).first()
+
+        paginator = IndexSectionPagination(request)
+        movies_next = serials_next = None
+        if paginator.is_enabled():
+            movies, movies_next = paginator.paginate_section(movies, 'movies')
+            serials, serials_next = paginator.paginate_section(serials, 'serials')
+
+        return Response(self.get_catalog_data(paginator, banners, movies, movies_next, serials, serials_next))
+
+    def get_section_querysets(self, request):
         queryset = Movie.objects.all().order_by('-id')
 
         if 'search' in request.GET:
             search = request.GET.get('search')
-            queryset = queryset.filter(title__icontains=search)
+            queryset = search_queryset(queryset, search).order_by('search_rank')
 
+        queryset = MovieIndexSerializer.setup_eager_loading(queryset)
         movies = queryset.filter(series__isnull=True).distinct()
         serials = queryset.filter(series__isnull=False).distinct()
+        return movies, serials
 
-        banners = Banner.objects.filter(is_asset=True).first()
-
+    def get_catalog_data(self, paginator, banners, movies, movies_next, serials, serials_next):
         banner_serializer = BannerIndexSerializer(banners)
         movie_serializer = MovieIndexSerializer(movies, many=True)
         serial_serializer = MovieIndexSerializer(serials, many=True)
 
-        data = {
-            'banners': banner_serializer.data,
-            'movies': movie_serializer.data,
-            'serials': serial_serializer.data
-        }
-        return Response(data)
-
-
-class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
+        with timed_serialization():
+            data = {
+                'banners': banner_serializer.data,
+                'movies': movie_serializer.data,
+                'serials': serial_serializer.data
+            }
+        if paginator.is_enabled():
+            data['movies_next'] = movies_next
+            data['serials_next'] = serials_next
+        return data
+
+    def get_continue_watching(self, request):
+        rows = progress.continue_watching(request.user)
+        with timed_serialization():
+            return ContinueWatchingSerializer(rows, many=True).data
+
+
+class MovieDetailView(EagerLoadingViewMixin, generics.RetrieveUpdateDestroyAPIView):
+    # Версии тегов кэша, фильм, съёмочная группа, жанры, страны, готовые
+    # рекомендации, категории и рекомендации по ним, версия токена
+    query_budget = 9
     queryset = Movie.objects.all()
     permission_classes = [IsAdminOrManager]
 
@@ -126,7 +199,7 @@ class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
                                 'description': openapi.Schema(type=openapi.TYPE_STRING),
                                 'release_date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
                                 'production_year': openapi.Schema(type=openapi.TYPE_INTEGER),
-                                'duration': openapi.Schema(type=openapi.TYPE_STRING),  # Updated to string to match serializer
+                                'duration': openapi.Schema(type=openapi.TYPE_INTEGER),
                                 'age_rating': openapi.Schema(type=openapi.TYPE_STRING),
                                 'budget': openapi.Schema(type=openapi.TYPE_NUMBER),
                                 'film_crews': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_OBJECT, properties={
@@ -168,22 +241,23 @@ class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
             404: 'Movie not found'
         }
     )
+    @cache_response('movie', 'movie:{pk}', 'category', 'genre', 'country', 'filmcrew', 'recommendation', 'media',
+                    signed_urls=True)
     def get(self, request, *args, **kwargs):
         try:
             product = self.get_object()
         except Movie.DoesNotExist:
             raise NotFound('Movie not found')
 
-        categories = product.movie_categories.all() | product.series_categories.all()
-
-        recommendations = Movie.objects.filter(Q(movie_categories__in=categories) | Q(series_categories__in=categories)).exclude(id=product.id).distinct()
-        serializer = MovieSerialDetailSerializer(product)
+        recommendations = MovieIndexSerializer.setup_eager_loading(get_recommendations(product))
+        serializer = MovieSerialDetailSerializer(product, context={'request': request})
         recommendations_serializer = MovieIndexSerializer(recommendations, many=True)
 
-        data = {
-            'product': serializer.data,
-            'recommendations': recommendations_serializer.data,
-        }
+        with timed_serialization():
+            data = {
+                'product': serializer.data,
+                'recommendations': recommendations_serializer.data,
+            }
 
         return Response(data)
 
@@ -211,19 +285,69 @@ class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
 #
 #         return Response(data)
 
-class SeriesDetailView(generics.RetrieveAPIView):
+class SeriesDetailView(EagerLoadingViewMixin, generics.RetrieveAPIView):
+    query_budget = 2  # Версии тегов кэша, серия
     queryset = Series.objects.all()
     serializer_class = SerialDetailSerializer
 
+    @conditional_response('series', 'media', signed_urls=True)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 class MovieDetailViews(generics.RetrieveAPIView):
     queryset = Movie.objects.all()
     serializer_class = MovieDetail
 
-class SerialListView(generics.ListAPIView):
+    @conditional_response('movie', 'movie:{pk}', signed_urls=True)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+class MovieStreamView(generics.GenericAPIView):
+    queryset = Movie.objects.filter(is_active=True, is_film=True)
+
+    def get(self, request, *args, **kwargs):
+        movie = self.get_object()
+        if not movie.movie:
+            raise NotFound('Файл фильма не загружен')
+        delivery.check_playback(request, movie)
+        return delivery.serve(request, movie.movie.name, private=True)
+
+
+class SeriesStreamView(generics.GenericAPIView):
+    queryset = Series.objects.filter(is_active=True, movie_serial__is_active=True).select_related('movie_serial')
+
+    def get(self, request, *args, **kwargs):
+        series = self.get_object()
+        if not series.series:
+            raise NotFound('Файл серии не загружен')
+        delivery.check_playback(request, series.movie_serial)
+        return delivery.serve(request, series.series.name, private=True)
+
+
+class MediaView(APIView):
+    """Файлы MEDIA_URL с проверкой доступа; байты отдаёт фронт-сервер (product/delivery.py)."""
+    swagger_schema = None
+
+    def perform_authentication(self, request):
+        # Подписанным ссылкам пользователь не нужен — токен разбирается,
+        # только когда к request.user обратится проверка доступа
+        pass
+
+    def get(self, request, name):
+        return delivery.serve_media(request, name)
+
+class SerialListView(EagerLoadingViewMixin, generics.ListAPIView):
+    query_budget = 2  # Версии тегов кэша, серии
     serializer_class = SeriesListSerializer
+    values_fast_path = True
     def get_queryset(self):
         movie_id = self.kwargs['movie_id']
-        return Series.objects.filter(movie_serial__id=movie_id)
+        # Порядок серий совпадает с индексом (movie_serial, id)
+        return Series.objects.filter(movie_serial_id=movie_id).order_by('id')
+
+    @conditional_response('series', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 
@@ -232,7 +356,8 @@ class SerialListView(generics.ListAPIView):
 
 
 
-class FavoriteListView(generics.ListAPIView):
+class FavoriteListView(EagerLoadingViewMixin, generics.ListAPIView):
+    query_budget = 2  # Версия токена, избранное
     serializer_class = FavoriteSerializer
     permission_classes = [IsAuthenticated]
 
@@ -257,103 +382,261 @@ class RemoveFavoriteMovieView(generics.DestroyAPIView):
         return Favorite.objects.filter(user=self.request.user, movie_id=self.kwargs['movie_id'])
 
     def delete(self, request, *args, **kwargs):
-        favorite = self.get_queryset().first()
-        if favorite:
-            favorite.delete()
+        if favorites.remove(request.user.id, [self.kwargs['movie_id']]):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
 
 
+class FavoriteBatchView(APIView):
+    """
+    Пакетное изменение избранного списком id фильмов (``operation`` задаётся
+    в urls): ``add`` — добавить, ``remove`` — убрать, ``replace`` — оставить
+    ровно этот список. Повтор запроса не меняет результат; несуществующие
+    фильмы пропускаются и возвращаются в ``missing``.
+    """
+    permission_classes = [IsAuthenticated]
+    operation = 'add'
+
+    @swagger_auto_schema(request_body=FavoriteBatchSerializer)
+    def post(self, request):
+        serializer = FavoriteBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        movie_ids = serializer.validated_data['movies']
+
+        if self.operation == 'remove':
+            return Response({'removed': favorites.remove(request.user.id, movie_ids)})
+
+        movie_ids, missing = favorites.existing_movie_ids(movie_ids)
+        data = {'movies': movie_ids, 'missing': missing}
+        if self.operation == 'replace':
+            data['removed'] = favorites.replace(request.user.id, movie_ids)
+        else:
+            favorites.add(request.user.id, movie_ids)
+        return Response(data)
+
+
+class FavoriteStatusView(APIView):
+    """
+    Какие фильмы страницы в избранном: ``?movies=1,2,3`` -> ``bitmap`` "101"
+    в том же порядке, одним запросом на всю страницу.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('movies', openapi.IN_QUERY, description='id фильмов через запятую', type=openapi.TYPE_STRING),
+    ])
+    def get(self, request):
+        raw = ','.join(request.query_params.getlist('movies'))
+        serializer = FavoriteBatchSerializer(data={'movies': [pk for pk in raw.split(',') if pk.strip()]})
+        serializer.is_valid(raise_exception=True)
+        movie_ids = serializer.validated_data['movies']
+        return Response({'movies': movie_ids, 'bitmap': favorites.bitmap(request.user.id, movie_ids)})
+
 
-class MovieListView(generics.ListAPIView):
+
+class MovieListView(EagerLoadingViewMixin, generics.ListAPIView):
+    # Версии тегов кэша, список, счётчики
+    query_budget = 3
     serializer_class = CategoryIndexSerializer
 
     def get_queryset(self):
-        # Получаем все категории, связанные с фильмами
-        return Category.objects.filter(movies__isnull=False).distinct()
+        # Категории, в которых есть фильмы, — по счётчикам фасетов, без JOIN и DISTINCT
+        return facets.with_counts(Category.objects.all(), FacetCount.MOVIE_CATEGORY).filter(facet_count__gt=0)
+
+    @cache_response('category', 'movie', 'facet')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
-class SeriesListView(generics.ListAPIView):
+class SeriesListView(EagerLoadingViewMixin, generics.ListAPIView):
+    # Версии тегов кэша, список, счётчики
+    query_budget = 3
     serializer_class = CategoryIndexSerializer
 
     def get_queryset(self):
-        # Получаем все категории, связанные с сериалами
-        return Category.objects.filter(series__isnull=False).distinct()
+        # Категории, в которых есть сериалы
+        return facets.with_counts(Category.objects.all(), FacetCount.SERIES_CATEGORY).filter(facet_count__gt=0)
 
+    @cache_response('category', 'movie', 'facet')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
-class GenreListView(generics.ListAPIView):
-    queryset = Genre.objects.all()
+
+class GenreListView(EagerLoadingViewMixin, generics.ListAPIView):
+    # Версии тегов кэша, список, счётчики
+    query_budget = 3
     serializer_class = GenreListSerializer
 
+    def get_queryset(self):
+        return facets.with_counts(Genre.objects.all(), FacetCount.GENRE)
 
-class CountryListView(generics.ListAPIView):
-    queryset = Country.objects.all()
+    @cache_response('genre', 'facet', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class CountryListView(EagerLoadingViewMixin, generics.ListAPIView):
+    # Версии тегов кэша, список, счётчики
+    query_budget = 3
     serializer_class = CountryListSerializer
 
+    def get_queryset(self):
+        return facets.with_counts(Country.objects.all(), FacetCount.COUNTRY)
+
+    @cache_response('country', 'facet', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class FacetBrowseView(APIView):
+    """
+    Фасетный просмотр: сколько фильмов подходит под фильтры
+    ``MovieFacetFilter`` и сколько из них в каждом жанре, стране, категории
+    и типе.
+    """
+    filterset_class = MovieFacetFilter
+
+    @cache_response('facet', 'movie', 'genre', 'country', 'category')
+    def get(self, request):
+        return Response(facets.browse(request.query_params, self.filterset_class, Movie.objects.all()))
+
+
+class WatchHeartbeatView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(request_body=WatchHeartbeatSerializer)
+    def post(self, request):
+        serializer = WatchHeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        progress.buffer.record(
+            request.user.id,
+            data['movie'],
+            data.get('series'),
+            data['position'],
+            data['duration'],
+            final=data['final'],
+        )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ContinueWatchingView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        rows = progress.continue_watching(request.user)
+        with timed_serialization():
+            data = ContinueWatchingSerializer(rows, many=True).data
+        return Response(data)
 
 
+class ResponseCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
 
-class MovieCategoryFilterView(generics.ListAPIView):
+    def get(self, request):
+        return Response(get_metrics())
+
+
+
+
+def related_to(field_name, value_id):
+    """
+    Условие «фильм связан со значением» в виде EXISTS, а не соединения.
+    Вместе с фильтром по is_film планировщик может идти по частичному индексу
+    сортировки и проверять связь по уникальному индексу (фильм, значение),
+    останавливаясь на первой странице, вместо того чтобы собирать и
+    сортировать всю выборку значения.
+    """
+    field = Movie._meta.get_field(field_name)
+    relations = field.remote_field.through.objects.filter(**{
+        field.m2m_field_name(): OuterRef('pk'),
+        field.m2m_reverse_field_name(): value_id,
+    })
+    return Exists(relations)
+
+
+class MovieCategoryFilterView(EagerLoadingViewMixin, generics.ListAPIView):
     serializer_class = MovieIndexSerializer
+    values_fast_path = True
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
     filterset_class = MovieSerialFilter
-    ordering_fields = ['created_date', 'title', 'rating']
-    pagination_class = MovieSerialPagination
+    ordering_fields = ['created_date', 'title', 'rating', 'rating_average']
+    pagination_class = MovieKeysetPagination
 
 
     def get_queryset(self):
         category_id = self.kwargs['category_id']
-        return Movie.objects.filter(movie_categories__id=category_id, is_film=True).distinct()
+        return Movie.objects.filter(related_to('movie_categories', category_id), is_film=True)
+
+    # Порядок по оценкам меняется с каждой оценкой — отсюда тег 'rating'
+    @conditional_response('movie', 'category', 'rating', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 
-class SeriesCategoryFilterView(generics.ListAPIView):
+class SeriesCategoryFilterView(EagerLoadingViewMixin, generics.ListAPIView):
     serializer_class = MovieIndexSerializer
+    values_fast_path = True
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
     filterset_class = MovieSerialFilter
-    ordering_fields = ['created_date', 'title', 'rating']
-    pagination_class = MovieSerialPagination
+    ordering_fields = ['created_date', 'title', 'rating', 'rating_average']
+    pagination_class = MovieKeysetPagination
 
     def get_queryset(self):
         category_id = self.kwargs['category_id']
-        return Movie.objects.filter(series_categories__id=category_id, is_film=False).distinct()
+        return Movie.objects.filter(related_to('series_categories', category_id), is_film=False)
+
+    @conditional_response('movie', 'category', 'rating', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 
 
-class GenreFilterView(generics.ListAPIView):
+class GenreFilterView(EagerLoadingViewMixin, generics.ListAPIView):
     serializer_class = MovieIndexSerializer
+    values_fast_path = True
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
     filterset_class = MovieSerialFilter
-    ordering_fields = ['production_year', 'rating']
-    pagination_class = MovieSerialPagination
+    ordering_fields = ['production_year', 'rating', 'rating_average']
+    pagination_class = MovieKeysetPagination
 
 
     def get_queryset(self):
         genre_id = self.kwargs['genre_id']
         is_film = self.request.query_params.get('is_film', None)
-        queryset = Movie.objects.filter(genres__id=genre_id).distinct()
-        if is_film is not None:
-            queryset = queryset.filter(is_film=is_film)
-        return queryset
+        if is_film is None:
+            # Без is_film индекса сортировки нет — быстрее соединение по индексу связи.
+            # Пара (фильм, значение) уникальна, так что дублей нет и DISTINCT не нужен
+            return Movie.objects.filter(genres__id=genre_id)
+        return Movie.objects.filter(related_to('genres', genre_id), is_film=is_film)
 
+    @conditional_response('movie', 'genre', 'rating', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
-class CountryFilterView(generics.ListAPIView):
+
+class CountryFilterView(EagerLoadingViewMixin, generics.ListAPIView):
     serializer_class = MovieIndexSerializer
+    values_fast_path = True
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter, ]
     filterset_class = MovieSerialFilter
-    ordering_fields = ['production_year', 'rating']
-    pagination_class = MovieSerialPagination
+    ordering_fields = ['production_year', 'rating', 'rating_average']
+    pagination_class = MovieKeysetPagination
 
 
     def get_queryset(self):
         pk = self.kwargs['pk']
         is_film = self.request.query_params.get('is_film', None)
-        queryset = Movie.objects.filter(country__id=pk).distinct()
-        if is_film is not None:
-            queryset = queryset.filter(is_film=is_film)
-        return queryset
+        if is_film is None:
+            return Movie.objects.filter(country__id=pk)
+        return Movie.objects.filter(related_to('country', pk), is_film=is_film)
+
+    @conditional_response('movie', 'country', 'rating', 'media')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class AddMovieCreateView(generics.CreateAPIView):
@@ -370,7 +653,93 @@ class AddSerialCreateView(generics.CreateAPIView):
     queryset = Movie.objects.all()
     serializer_class = AddSerialCreateSerializer
     permission_classes = [IsAdminOrManager]
-    
+
+    def perform_create(self, serializer):
+        serializer.save(is_film=False)
+
+
+class ChunkedUploadCreateView(generics.CreateAPIView):
+    """Начало загрузки файла фильма или серии по частям (см. product/uploads.py)."""
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated, IsAdminOrManager]
+
+    def perform_create(self, serializer):
+        upload = serializer.save(user=self.request.user)
+        uploads.create_part(upload)
+
+
+class ChunkedUploadMixin:
+    permission_classes = [IsAuthenticated, IsAdminOrManager]
+
+    def get_upload(self, pk):
+        upload = ChunkedUpload.objects.filter(pk=pk, user_id=self.request.user.id).first()
+        if upload is None:
+            raise NotFound('Загрузка не найдена')
+        return upload
+
+    def upload_response(self, upload, **kwargs):
+        response = Response(**kwargs)
+        response['Upload-Offset'] = str(upload.offset)
+        response['Upload-Length'] = str(upload.length)
+        # Смещение меняется с каждым куском — не кэшировать
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    def error_response(self, exc):
+        return Response({'detail': str(exc)}, status=exc.status)
+
+
+class ChunkedUploadView(ChunkedUploadMixin, APIView):
+    """
+    GET/HEAD — сколько байт принято (``Upload-Offset``), PATCH — очередной
+    кусок, DELETE — отмена загрузки.
+    """
+
+    def get(self, request, pk):
+        upload = self.get_upload(pk)
+        return self.upload_response(upload, data=ChunkedUploadSerializer(upload).data)
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('Upload-Offset', openapi.IN_HEADER, type=openapi.TYPE_INTEGER, required=True),
+        openapi.Parameter('Upload-Checksum', openapi.IN_HEADER, type=openapi.TYPE_STRING,
+                          description='Например, "sha256 <base64>"'),
+    ])
+    def patch(self, request, pk):
+        upload = self.get_upload(pk)
+        if request.content_type.split(';')[0].strip() != 'application/offset+octet-stream':
+            return Response({'detail': 'Ожидается Content-Type: application/offset+octet-stream'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            size = int(request.headers.get('Content-Length') or 0)
+            if offset < 0 or size < 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': 'Нужны неотрицательные Upload-Offset и Content-Length'})
+        try:
+            checksum = uploads.parse_checksum(request.headers.get('Upload-Checksum'))
+            # Тело читается из потока запроса, request.data не трогаем
+            uploads.write_chunk(upload, offset, request.stream, size, checksum)
+        except uploads.UploadError as exc:
+            return self.error_response(exc)
+        return self.upload_response(upload, status=status.HTTP_204_NO_CONTENT)
+
+    def delete(self, request, pk):
+        # Файл куска удаляет сигнал post_delete
+        self.get_upload(pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadFinalizeView(ChunkedUploadMixin, APIView):
+    """Прикрепляет полностью загруженный файл к фильму или серии."""
+
+    def post(self, request, pk):
+        try:
+            upload = uploads.finalize(self.get_upload(pk))
+        except uploads.UploadError as exc:
+            return self.error_response(exc)
+        return self.upload_response(upload, data=ChunkedUploadSerializer(upload).data)
+
 
 
 class AddRatingView(generics.CreateAPIView):
@@ -378,15 +747,42 @@ class AddRatingView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        movie_id = serializer.validated_data.get('movie').id  # предполагается, что 'movie' - это поле в сериализаторе
-        user = self.request.user
-
-        # Проверяем, существует ли уже рейтинг для данного фильма и пользователя
-        if Rating.objects.filter(movie_id=movie_id, user=user).exists():
+        # Повторную оценку отсекает уникальный индекс (movie, user) — без
+        # отдельной проверки и без гонки между проверкой и вставкой
+        try:
+            with transaction.atomic():
+                rating = serializer.save(user=self.request.user)
+                rating_added(rating)
+        except IntegrityError:
             raise ValidationError({"detail": "Вы уже поставили оценку этому фильму."})
 
-        # Если такой записи нет, создаем новую
-        serializer.save(user=user)
+
+class RatingUpsertView(APIView):
+    """
+    Поставить или изменить оценку одним запросом: 201 — оценка создана,
+    200 — изменена. При ``RATING_BUFFERED_WRITES`` оценка ставится в буфер
+    и пишется пачкой в течение ``RATING_FLUSH_INTERVAL`` секунд — ответ 202.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(request_body=RatingUpsertSerializer)
+    def post(self, request):
+        serializer = RatingUpsertSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        movie_id, score = serializer.validated_data['movie'], serializer.validated_data['score']
+        data = {'movie': movie_id, 'score': score}
+
+        if ratings.is_buffered():
+            if not Movie.objects.filter(pk=movie_id).exists():
+                raise ValidationError({'movie': 'Фильм не найден.'})
+            ratings.buffer.record(request.user.id, movie_id, score)
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            created = ratings.upsert([{'user': request.user.id, 'movie': movie_id, 'score': score}])
+        except IntegrityError:
+            raise ValidationError({'movie': 'Фильм не найден.'})
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 class UpdateRatingView(generics.RetrieveUpdateAPIView):
     serializer_class = RatingSerializer
@@ -395,10 +791,48 @@ class UpdateRatingView(generics.RetrieveUpdateAPIView):
     def get_queryset(self):
         return Rating.objects.filter(user=self.request.user)
 
+    def perform_update(self, serializer):
+        old_movie_id, old_score = serializer.instance.movie_id, serializer.instance.score
+        with transaction.atomic():
+            rating = serializer.save()
+            rating_changed(old_movie_id, old_score, rating)
 
 
+class CatalogImportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
 
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('file', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True,
+                              description="Файл каталога: JSONL или CSV"),
+            openapi.Parameter('file_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['jsonl', 'csv'],
+                              description="По умолчанию — по расширению файла"),
+        ]
+    )
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'Файл не передан'})
+        file_format = request.query_params.get('file_format') or ('csv' if upload.name.endswith('.csv') else 'jsonl')
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        stats = import_catalog(stream, file_format)
+        return Response(stats.as_dict())
 
 
+class CatalogExportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
 
-
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('file_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['jsonl', 'csv']),
+        ]
+    )
+    def get(self, request):
+        if request.query_params.get('file_format') == 'csv':
+            response = StreamingHttpResponse(export_csv(), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="catalog.csv"'
+        else:
+            response = StreamingHttpResponse(export_jsonl(), content_type='application/x-ndjson; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="catalog.jsonl"'
+        return response
@@ -0,0 +1,226 @@
+"""
+Проверка JWT без запроса к базе на каждый вызов API.
+
+При входе в токен пишутся роль пользователя (``status``, ``is_admin``) и
+версия его токенов (``auth_version``). ``StatelessJWTAuthentication`` строит
+из этих claims объект ``MyUser`` без чтения строки: права
+(``IsAdminOrManager``) и фильтры по ``request.user`` работают как раньше, а
+остальные поля подгружаются из базы только при обращении к ним.
+
+Смена роли или пароля увеличивает ``auth_version`` — старые токены после
+этого отклоняются. Текущая версия берётся из памяти процесса (живёт
+``AUTH_VERSION_CACHE_TTL`` секунд), а затем из хранилища версий, поэтому
+отзыв вступает в силу во всех процессах не позже этого срока.
+
+Хранилище версий — база (колонка ``MyUser.auth_version``): один запрос по
+первичному ключу на пользователя раз в ``AUTH_VERSION_CACHE_TTL`` секунд в
+каждом процессе, а не на каждый запрос API. Если кэш
+``AUTH_VERSION_CACHE_ALIAS`` общий для процессов (Redis, Memcached, база),
+он стоит перед базой; запись версии в нём живёт ``AUTH_VERSION_SHARED_TTL``
+секунд — если публикация новой версии не дошла до кэша, старая не
+останется там навсегда. Кэш в памяти процесса (``LocMemCache``, по
+умолчанию) как хранилище не годится — другие воркеры не узнали бы о новой
+версии, — и тогда версия читается прямо из базы.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import MyUser
+
+
+VERSION_PREFIX = 'auth-version:'
+# Claims, из которых собирается пользователь
+CLAIM_FIELDS = ('status', 'is_admin')
+VERSION_CLAIM = 'ver'
+
+
+class LRUCache:
+    """Небольшой потокобезопасный LRU со сроком жизни записей."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def is_requested():
+    return getattr(settings, 'JWT_STATELESS_AUTH', True)
+
+
+def get_cache():
+    return caches[getattr(settings, 'AUTH_VERSION_CACHE_ALIAS', 'default')]
+
+
+def is_cache_shared():
+    """Видят ли все процессы одни и те же записи кэша версий."""
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def is_enabled():
+    return is_requested()
+
+
+def get_version_ttl():
+    return getattr(settings, 'AUTH_VERSION_CACHE_TTL', 5)
+
+
+def get_shared_ttl():
+    return getattr(settings, 'AUTH_VERSION_SHARED_TTL', 300)
+
+
+def get_user_ttl():
+    return getattr(settings, 'AUTH_USER_CACHE_TTL', 30)
+
+
+versions = LRUCache(getattr(settings, 'AUTH_CACHE_SIZE', 10000))
+users = LRUCache(getattr(settings, 'AUTH_CACHE_SIZE', 10000))
+
+
+def get_auth_version(user_id):
+    """Текущая версия токенов пользователя или None, если его нет."""
+    version = versions.get(user_id)
+    if version is not None:
+        return version
+    # Кэш в памяти процесса не знает о чужих записях — тогда сразу база
+    cache = get_cache() if is_cache_shared() else None
+    version = cache.get(f'{VERSION_PREFIX}{user_id}') if cache is not None else None
+    if version is None:
+        version = MyUser.objects.filter(pk=user_id).values_list('auth_version', flat=True).first()
+        if version is None:
+            return None
+        if cache is not None:
+            cache.add(f'{VERSION_PREFIX}{user_id}', version, timeout=get_shared_ttl())
+    versions.set(user_id, version, get_version_ttl())
+    return version
+
+
+def publish_auth_version(user_id, version):
+    """
+    Раздаёт новую версию после коммита; ``version=None`` — пользователь удалён.
+    Другие процессы увидят её, когда истечёт их ``AUTH_VERSION_CACHE_TTL``.
+    """
+    def publish():
+        if is_cache_shared():
+            key = f'{VERSION_PREFIX}{user_id}'
+            if version is None:
+                get_cache().delete(key)
+            else:
+                get_cache().set(key, version, timeout=get_shared_ttl())
+        versions.discard(user_id)
+        users.discard(user_id)
+    transaction.on_commit(publish)
+
+
+def forget_user(user_id):
+    """Убирает полную строку пользователя из памяти процесса после коммита."""
+    transaction.on_commit(lambda: users.discard(user_id))
+
+
+def get_user(user_id):
+    """
+    Полная строка пользователя: из памяти процесса (``AUTH_USER_CACHE_TTL``)
+    или из базы. Возвращается копия — общий объект не меняют запросы.
+    """
+    user = users.get(user_id)
+    if user is None:
+        user = MyUser.objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+        users.set(user_id, user, get_user_ttl())
+    return copy.copy(user)
+
+
+def add_claims(token, user):
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    token[VERSION_CLAIM] = user.auth_version
+    return token
+
+
+def user_from_claims(validated_token):
+    """
+    ``MyUser`` только с полями из токена; остальные отложены (deferred) и
+    читаются из базы при первом обращении, как у ``.only()``.
+    """
+    field_names = [MyUser._meta.pk.attname, *CLAIM_FIELDS]
+    values = [validated_token[api_settings.USER_ID_CLAIM], *(validated_token[field] for field in CLAIM_FIELDS)]
+    return MyUser.from_db(router.db_for_read(MyUser), field_names, values)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication``, которая не читает пользователя из базы: роль
+    берётся из claims, свежесть токена — по версии (см. модуль).
+
+    Токены без claims роли (выданные до этой схемы или вручную через
+    ``AccessToken.for_user``) проверяются по полной строке пользователя из
+    ``get_user``.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        has_claims = VERSION_CLAIM in validated_token and all(field in validated_token for field in CLAIM_FIELDS)
+        if not is_enabled():
+            # JWT_STATELESS_AUTH выключен: строка из базы на каждый запрос
+            user = super().get_user(validated_token)
+            self.check_version(validated_token, user.auth_version)
+            return user
+        if not has_claims:
+            user = get_user(user_id)
+            if user is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            return user
+
+        version = get_auth_version(user_id)
+        if version is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        self.check_version(validated_token, version)
+        return user_from_claims(validated_token)
+
+    def check_version(self, validated_token, version):
+        if validated_token.get(VERSION_CLAIM, version) != version:
+            raise AuthenticationFailed('Токен отозван, войдите заново', code='token_revoked')
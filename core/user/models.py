@@ -60,6 +60,12 @@ class MyUser(AbstractBaseUser):
         'Администратор',
         default=False
     )
+    # Растёт при смене роли или пароля — выданные раньше токены перестают действовать
+    auth_version = models.PositiveIntegerField(
+        'Версия токенов',
+        default=0,
+        editable=False
+    )
 
     USERNAME_FIELD = 'phone_number'
     REQUIRED_FIELDS = ['username']
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from .authentication import add_claims
 from .models import MyUser
 
 
@@ -36,3 +39,11 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
             'phone_number',
         )
 
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Пара токенов с ролью и версией токенов пользователя (см. ``authentication``)."""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
@@ -0,0 +1,40 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import MyUser
+from . import authentication
+
+
+# Поля, смена которых отзывает выданные токены
+REVOKING_FIELDS = ('status', 'is_admin', 'password')
+
+
+@receiver(pre_save, sender=MyUser)
+def remember_revoking_fields(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    fields = [field for field in REVOKING_FIELDS if update_fields is None or field in update_fields]
+    if not fields or any(field in instance.get_deferred_fields() for field in fields):
+        return
+    previous = MyUser.objects.filter(pk=instance.pk).values(*fields).first()
+    if previous is not None and any(previous[field] != getattr(instance, field) for field in fields):
+        instance._revoke_tokens = True
+
+
+@receiver(post_save, sender=MyUser)
+def revoke_tokens(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    if instance.__dict__.pop('_revoke_tokens', False):
+        MyUser.objects.filter(pk=instance.pk).update(auth_version=F('auth_version') + 1)
+        instance.auth_version = MyUser.objects.filter(pk=instance.pk).values_list('auth_version', flat=True).get()
+        authentication.publish_auth_version(instance.pk, instance.auth_version)
+    else:
+        # Изменился только профиль — токены остаются в силе
+        authentication.forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=MyUser)
+def forget_deleted_user(sender, instance, **kwargs):
+    authentication.publish_auth_version(instance.pk, None)
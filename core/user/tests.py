@@ -1,3 +1,47 @@
-from django.test import TestCase
+from django.db.models import F
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 
-# Create your tests here.
+from . import authentication
+from .models import MyUser
+from .serializers import ClaimsTokenObtainPairSerializer
+
+
+class RevocationAcrossProcessesTests(TestCase):
+    """Новая версия токенов, записанная другим процессом, отклоняет старый токен."""
+
+    def setUp(self):
+        self.user = MyUser.objects.create_user(phone_number='+70000000001', username='revoke', password='!')
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        self.request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        authentication.versions.clear()
+        authentication.users.clear()
+
+    def authenticate(self):
+        return authentication.StatelessJWTAuthentication().authenticate(self.request)
+
+    def revoke_elsewhere(self):
+        # Как в другом воркере: ни кэш этого процесса, ни сигналы не знают о смене
+        MyUser.objects.filter(pk=self.user.pk).update(auth_version=F('auth_version') + 1)
+
+    def test_local_memory_cache_uses_database(self):
+        self.assertTrue(authentication.is_enabled())
+        self.authenticate()
+        # В пределах AUTH_VERSION_CACHE_TTL пользователь и версия не читаются
+        with self.assertNumQueries(0):
+            self.authenticate()
+        self.revoke_elsewhere()
+        # Истёк AUTH_VERSION_CACHE_TTL процесса: версия — из базы
+        authentication.versions.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_shared_cache_after_process_ttl(self):
+        self.assertTrue(authentication.is_enabled())
+        self.authenticate()
+        self.revoke_elsewhere()
+        # Истёк AUTH_VERSION_CACHE_TTL процесса
+        authentication.versions.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
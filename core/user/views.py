@@ -1,4 +1,5 @@
 from rest_framework.generics import CreateAPIView, RetrieveAPIView
+from .authentication import get_user
 from .models import MyUser
 from .serializers import UserRegisterSerializer, UserProfileSerializer, UserProfileUpdateSerializer
 from django.shortcuts import get_object_or_404
@@ -18,7 +19,8 @@ class UserProfileView(APIView):
 
     @swagger_auto_schema(responses={200: UserProfileSerializer()})
     def get(self, request):
-        user = MyUser.objects.filter(id=request.user.id).first()
+        # request.user собран из токена — полную строку берём из памяти процесса или базы
+        user = get_user(request.user.id)
         serializer = UserProfileSerializer(user)
         return Response(serializer.data)
 